@@ -6,7 +6,9 @@ from flask import Flask, render_template, request, redirect, url_for
 from flask_sqlalchemy import get_debug_queries
 from flask_wtf.csrf import CSRFError
 from app.util import pretty_date
-from app.ext import db, sitemap, login_manager, csrf, migrate,app_helper, db_config, alipay
+from app.ext import db, sitemap, login_manager, csrf, migrate,app_helper, db_config, alipay, \
+    view_counter, search_index, page_cache, access_logger, match_spider, assets, compress, images, \
+    uploads, storage, bing, baidu_push
 from app.settings import config
 from app.template_global import register_template_filter, register_template_global
 from app.models import AccessLog
@@ -96,6 +98,17 @@ def register_extensions(app):
     app_helper.init_app(app)
     db_config.init_app(app, db=db)
     alipay.init_app(app)
+    view_counter.init_app(app)
+    search_index.init_app(app)
+    page_cache.init_app(app)
+    access_logger.init_app(app)
+    assets.init_app(app)
+    compress.init_app(app)
+    images.init_app(app)
+    uploads.init_app(app)
+    storage.init_app(app)
+    bing.init_app(app)
+    baidu_push.init_app(app)
 
     
 
@@ -139,26 +152,11 @@ def register_request_handlers(app):
 
     @app.before_request
     def before_app_request():
-        user_agent = request.headers.get("User-Agent")
-        if user_agent is None:
-            return
-        remark = None
-        if 'Baiduspider' in user_agent :
-            remark = '百度'
-        if 'Bytespider' in user_agent :
-            remark = '头条搜索'
-        if 'YisouSpider' in user_agent:
-            remark = '神马搜索'
-        if 'Sogou' in user_agent:
-            remark = '搜狗'
-        if 'Sosospider' in user_agent:
-            remark = '搜搜'
-
+        remark = match_spider(request.headers.get("User-Agent"))
         if remark :    
-            accessLog = AccessLog(ip = request.remote_addr,
+            access_logger.log(ip = request.remote_addr,
                 url = request.path,
                 remark = remark)
-            db.session.add(accessLog)
 
     @app.after_request
     def query_profiler(response):
@@ -185,4 +183,272 @@ def register_commands(app):
             db.drop_all()
             click.echo('Drop tables.')
         db.create_all()
-        click.echo('Initialized database.')
\ No newline at end of file
+        click.echo('Initialized database.')
+
+    @app.cli.command()
+    def flush_views():
+        """Flush buffered article view counts to the database."""
+        n = view_counter.flush()
+        click.echo('Flushed view counts of %d articles.' % n)
+
+    @app.cli.command()
+    def search_reindex():
+        """Rebuild the full-text search index."""
+        n = search_index.rebuild()
+        click.echo('Indexed %d articles.' % n)
+
+    @app.cli.command()
+    @click.option('--limit', default=12, help='Maximum number of queries allowed per page.')
+    def query_count(limit):
+        """Check the number of SQL queries run by the public pages."""
+        from flask import request_started, request_finished
+        from app.models import Article, Category, Tag
+        app.config['H3BLOG_PAGE_CACHE_TIMEOUT'] = 0
+        paths = ['/', '/hot/', '/archive/', '/tags/']
+        with app.test_request_context():
+            a = Article.query.filter(Article.state == 1).order_by(Article.id.desc()).first()
+            if a:
+                paths.append(url_for('main.article', name=a.name))
+                paths.append(url_for('main.search_results', query=a.title))
+            c = Category.query.filter(Category.tpl_mold != 'single_page').first()
+            if c:
+                paths.append(url_for('main.category', c=c.name))
+            t = Tag.query.first()
+            if t:
+                paths.append(url_for('main.tag', t=t.code))
+        counts = {}
+        def start(sender, **extra):
+            # 命令行中请求共用同一个应用上下文，记录请求开始时已有的查询数量
+            counts[request.path] = len(get_debug_queries())
+        def finish(sender, response, **extra):
+            counts[request.path] = len(get_debug_queries()) - counts[request.path]
+        with request_started.connected_to(start, app), request_finished.connected_to(finish, app):
+            client = app.test_client()
+            for path in paths:
+                client.get(path)
+        failed = False
+        for path in paths:
+            n = counts.get(path, 0)
+            click.echo('%4d  %s%s' % (n, path, '  <-- over limit' if n > limit else ''))
+            failed = failed or n > limit
+        if failed:
+            raise click.ClickException('Some pages run more than %d queries.' % limit)
+
+    @app.cli.command()
+    @click.option('--rebuild', is_flag=True, help='Rebuild the rollup tables from the raw logs first.')
+    def access_log_prune(rebuild):
+        """Prune expired spider access logs."""
+        access_logger.flush()
+        if rebuild:
+            n = access_logger.rebuild_stats()
+            click.echo('Rolled up %d access logs.' % n)
+        n = access_logger.prune()
+        click.echo('Pruned %d access logs.' % n)
+
+    @app.cli.command()
+    @click.option('--workers', default=None, type=int, help='Number of render processes, defaults to the CPU count.')
+    @click.option('--chunk-size', default=200, help='Number of articles read and committed at a time.')
+    @click.option('--force', is_flag=True, help='Ignore the markdown render cache.')
+    def rerender(workers, chunk_size, force):
+        """Re-render the html of all markdown articles."""
+        from app.util.render import rerender_articles
+        def progress(stats):
+            click.echo('%d articles, %.1f articles/s' % (stats['total'], stats['total'] / max(stats['seconds'], 0.001)))
+        stats = rerender_articles(workers, chunk_size, force, progress)
+        click.echo('Rendered %d, cached %d, updated %d of %d articles in %.2fs (%.1f articles/s).' %
+                   (stats['rendered'], stats['cached'], stats['updated'], stats['total'],
+                    stats['seconds'], stats['total'] / max(stats['seconds'], 0.001)))
+        for article_id, error in stats['failed']:
+            click.echo('Failed to render article %d: %s' % (article_id, error), err=True)
+        if stats['failed']:
+            raise click.ClickException('%d articles failed to render.' % len(stats['failed']))
+
+    @app.cli.command()
+    @click.option('--number', default=200, help='Number of documents rendered by each method.')
+    def bench_markdown(number):
+        """Compare a new Markdown instance per render with the reused instance."""
+        import time
+        import markdown
+        from app.models import Article
+        from app.util.render import MARKDOWN_EXTENSIONS, markdown_to_html
+        docs = [c for c, in db.session.query(Article.content).
+                filter(Article.editor == 'markdown').order_by(Article.id.desc()).limit(number)]
+        if not docs:
+            docs = ['# h3blog\n\n*hello* **world**[^1]\n\n```python\nprint(1)\n```\n\n[^1]: note']
+        docs = [docs[i % len(docs)] or '' for i in range(number)]
+        results = {}
+        for name, render in (('new instance', lambda text: markdown.markdown(text, extensions=list(MARKDOWN_EXTENSIONS))),
+                             ('reused instance', markdown_to_html)):
+            start = time.perf_counter()
+            results[name] = [render(text) for text in docs]
+            seconds = time.perf_counter() - start
+            click.echo('%-16s %8.3f ms/doc  %8.1f docs/s' % (name, seconds * 1000 / number, number / seconds))
+        if results['new instance'] != results['reused instance']:
+            raise click.ClickException('The reused instance rendered different html.')
+
+    @app.cli.command()
+    @click.option('--number', default=100, help='Number of images drawn by each method.')
+    @click.option('--distinct', default=10, help='Number of distinct titles, repeated titles hit the disk cache.')
+    def bench_draw(number, distinct):
+        """Compare drawing cover images without caches, with cached fonts/backgrounds and with the disk cache."""
+        import io
+        import shutil
+        import tempfile
+        import time
+        from app.util.draw_img import H3blogDrow, clear_draw_cache, cover_config, draw_cached
+        font_path = os.path.join(app.root_path, 'admin', 'static', 'fonts', '站酷庆科黄油体.ttf')
+        configs = [cover_config('h3blog %d' % (i % distinct), font_path) for i in range(number)]
+        def draw(config):
+            d = H3blogDrow()
+            d.parse_config(config)
+            d.draw().save(io.BytesIO(), 'PNG')
+        def uncached(config):
+            clear_draw_cache()
+            draw(config)
+        cache_dir = tempfile.mkdtemp()
+        try:
+            for name, render in (('no cache', uncached), ('cached engine', draw),
+                                 ('disk cache', lambda config: draw_cached(config, cache_dir))):
+                start = time.perf_counter()
+                for config in configs:
+                    render(config)
+                seconds = time.perf_counter() - start
+                click.echo('%-14s %8.3f ms/image  %8.1f images/s' % (name, seconds * 1000 / number, number / seconds))
+        finally:
+            shutil.rmtree(cache_dir, ignore_errors=True)
+
+    @app.cli.command()
+    @click.option('--config', 'config_file', default=None, type=click.File(encoding='utf-8'),
+                  help='JSON file with cover options: width, height, background_color, background_img, '
+                       'title_color, title_size, font_path.')
+    @click.option('--workers', default=None, type=int, help='Number of draw processes, defaults to the CPU count.')
+    @click.option('--chunk-size', default=100, help='Number of articles read and updated at a time.')
+    @click.option('--limit', default=None, type=int, help='Stop after this many articles.')
+    def gen_covers(config_file, workers, chunk_size, limit):
+        """Draw cover images for articles without a thumbnail."""
+        import json
+        from app.util.draw_img import generate_covers
+        template = json.load(config_file) if config_file else None
+        def progress(stats):
+            click.echo('%d articles, %.1f articles/s' % (stats['total'], stats['total'] / max(stats['seconds'], 0.001)))
+        # 图片地址需要请求上下文
+        with app.test_request_context():
+            stats = generate_covers(template, workers, chunk_size, limit, progress)
+        if stats['updated']:
+            page_cache.clear()
+        storage.join()
+        click.echo('Updated %d of %d articles in %.2fs.' % (stats['updated'], stats['total'], stats['seconds']))
+        for article_id, error in stats['failed']:
+            click.echo('Failed to draw the cover of article %d: %s' % (article_id, error), err=True)
+        if stats['failed']:
+            raise click.ClickException('%d covers failed.' % len(stats['failed']))
+
+    @app.cli.command()
+    @click.option('--theme', default=None, help='Theme to collect, defaults to H3BLOG_TEMPLATE.')
+    def collect_static(theme):
+        """Copy theme static files to fingerprinted, precompressed assets."""
+        n = assets.collect(theme)
+        click.echo('Collected %d static files into %s.' % (n, assets.path))
+
+    @app.cli.command()
+    @click.option('--theme', default=None, help='Theme to prune, defaults to H3BLOG_TEMPLATE.')
+    @click.option('--days', default=7.0, help='Keep files that went out of use less than this many days ago.')
+    def prune_static(theme, days):
+        """Delete fingerprinted assets no longer referenced by the manifest."""
+        n = assets.prune(theme, days)
+        click.echo('Deleted %d old static files.' % n)
+
+    @app.cli.command()
+    def storage_push():
+        """Push pictures that still have local urls to the configured remote storage."""
+        from flask import url_for
+        from app.models import Picture
+        if not storage.remote:
+            raise click.ClickException('H3BLOG_UPLOAD_TYPE is not a remote storage.')
+        with app.test_request_context():
+            prefix = url_for('admin.get_image', filename='x')[:-1]
+        pushed = failed = 0
+        for pic in Picture.query.filter(Picture.url.startswith(prefix)).order_by(Picture.id).all():
+            try:
+                storage.push(pic.id, pic.url[len(prefix):])
+                pushed += 1
+            except Exception as e:
+                failed += 1
+                click.echo('Failed to push picture %d: %s' % (pic.id, e), err=True)
+        click.echo('Pushed %d pictures, %d failed.' % (pushed, failed))
+
+    @app.cli.command()
+    def bing_refresh():
+        """Download today's Bing wallpaper into the local cache."""
+        current = bing.refresh()
+        click.echo('Bing wallpaper %s: %s (%d sizes).' % (current['date'], current['url'], len(current['images'])))
+
+    @app.cli.command('baidu-push')
+    @click.argument('urls', nargs=-1)
+    def baidu_push_command(urls):
+        """Queue URLs for Baidu and push everything that is due."""
+        if urls:
+            click.echo('Queued %d urls.' % baidu_push.enqueue(urls))
+        if not baidu_push.enabled:
+            raise click.ClickException('BAIDU_PUSH_TOKEN is not set.')
+        n = baidu_push.process()
+        stats = baidu_push.stats()
+        click.echo('Pushed %d urls, %d pending, %d failed, remaining quota %s.' %
+                   (n, stats['pending'], stats['failed'], stats['remain']))
+
+    @app.cli.command()
+    @click.option('--number', default=200, help='Number of signatures and gateway calls measured by each method.')
+    @click.option('--workers', default=None, type=int, help='Threads for the batch query, defaults to ALIPAY_POOL_SIZE.')
+    def bench_alipay(number, workers):
+        """Measure Alipay signing and gateway round trips against a local fake gateway."""
+        import time
+        import requests
+        from Crypto.PublicKey import RSA
+        from app.util.fake_server import FakeServer, fake_alipay_app
+        def body(pem):
+            return ''.join(pem.decode().strip().splitlines()[1:-1])
+        key = RSA.generate(2048)
+        public_key = key.publickey().export_key()
+        keys = ('ALIPAY_APPID', 'ALIPAY_PRIVATE_KEY', 'ALIPAY_PUBLIC_KEY', 'ALIPAY_GATEWAY')
+        saved = dict((k, app.config.get(k)) for k in keys)
+        def run(name, func, n=number):
+            start = time.perf_counter()
+            func()
+            seconds = time.perf_counter() - start
+            click.echo('%-22s %8.3f ms/call  %8.1f calls/s' % (name, seconds * 1000 / n, n / seconds))
+        def reimport_keys():
+            for i in range(number):
+                alipay._config_version = None
+                alipay.build_trade_precreate_url('bench', 'sign%d' % i, 1)
+        def cached_keys():
+            for i in range(number):
+                alipay.build_trade_precreate_url('bench', 'sign%d' % i, 1)
+        def unpooled():
+            for i in range(number):
+                requests.get(alipay.build_trade_precreate_url('bench', 'get%d' % i, 1), timeout=5).json()
+        def pooled():
+            for i in range(number):
+                alipay.trade_precreate_qrcode_str('bench', 'bench%d' % i, 1)
+        with FakeServer(fake_alipay_app(public_key)) as server:
+            app.config.update(ALIPAY_APPID='bench', ALIPAY_PRIVATE_KEY=body(key.export_key('PEM', pkcs=8)),
+                              ALIPAY_PUBLIC_KEY=body(public_key), ALIPAY_GATEWAY=server.url + '/gateway.do')
+            try:
+                run('sign, reimport keys', reimport_keys)
+                run('sign, cached keys', cached_keys)
+                run('requests.get', unpooled)
+                run('pooled session', pooled)
+                nos = ['bench%d' % i for i in range(number)]
+                results = {}
+                run('batch query', lambda: results.update(alipay.trade_query_many(nos, workers)))
+                failed = [no for no, r in results.items() if r.get('code') != '10000']
+                if failed:
+                    raise click.ClickException('%d queries failed: %s' % (len(failed), results[failed[0]]))
+            finally:
+                app.config.update(saved)
+                alipay._config_version = None
+
+    @app.cli.command('sitemap')
+    def generate_sitemap():
+        """Regenerate the cached sitemap files."""
+        n = sitemap.generate()
+        click.echo('Generated %d sitemap files.' % n)
\ No newline at end of file
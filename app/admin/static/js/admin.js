@@ -55,9 +55,9 @@ function baidu_push_article(api,url) {
         data: 'urls='+url,
         success: function(res){
             if(res.success > 0) {
-                toastr.success('成功推送' + res.success + '个','剩余调用次数' + res.remain);
+                toastr.success('已加入推送队列' + res.success + '个','等待推送' + res.pending + '个');
             }else {
-                toastr.error('推送失败','非本站链接或链接不合法')
+                toastr.warning('链接已经在推送队列中')
             }
             console.log(res)
         }
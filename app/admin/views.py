@@ -8,17 +8,20 @@ from wtforms.fields.core import SelectField
 
 from app import util
 from . import admin
-from app.ext import db,app_helper, check_db_uri
+from app.ext import db,app_helper, check_db_uri, search_index, page_cache, sitemap, access_logger, \
+    images, uploads, storage, baidu_push
+from app.ext.access_logger import SPIDERS
 from .forms import AddAdminForm, LoginForm, AddUserForm, DeleteUserForm, EditUserForm, ArticleForm, \
         ChangePasswordForm, AddFolderForm, CategoryForm, RecommendForm, InvitcodeForm, OnlineToolForm, \
         SettingForm, ConfigForm, TagForm
 from app.models import User, Category, Tag, Article, Recommend, AccessLog, Picture, InvitationCode, \
-    OnlineTool, Setting
+    OnlineTool, Setting, AccessLogHourly, AccessLogDaily, BaiduPush
 import os, io
-from datetime import datetime
-from app.util import admin_required, author_required, isAjax, upload_file_qiniu, allowed_file, \
-    baidu_push_urls, strip_tags, gen_invit_code
+from datetime import datetime, date, timedelta
+from app.util import admin_required, author_required, isAjax, allowed_file, \
+    strip_tags, gen_invit_code
 from app.settings import config, exist_config, create_config
+from app.template_global import clear_template_global_cache
 
 
 @admin.route("/setup", methods=['GET', 'POST'])
@@ -143,7 +146,7 @@ def articles():
 @admin_required
 def article_edit(id):
     '''加载编辑文章'''
-    article = Article.query.get(int(id))
+    article = Article.query.options(db.undefer_group('body')).get(int(id))
     form = ArticleForm(obj=article)
     #当请求参数editor为空，使用文章原来编辑器
     editor = request.args.get('editor', article.editor)
@@ -154,6 +157,11 @@ def article_edit(id):
     return render_template('admin/write.html', form=form)
 
 
+def _neighbor_tags(article_id: int) -> list:
+    '''上一篇、下一篇文章的缓存标签，发布文章、修改状态后它们页面中的链接会变化'''
+    return ['article:%d' % n.id for n in Article.neighbors().get(article_id, ()) if n is not None]
+
+
 @admin.route('/article/write', methods=['GET','POST'])
 @login_required
 @admin_required
@@ -165,11 +173,20 @@ def write():
         a = None
         if form.id.data:
             a = Article.query.get(int(form.id.data))
+        # 文章修改前的分类和标签，用于清除页面缓存
+        cache_tags = ['articles', 'category:%d' % cty.id]
+        # 新发布的文章推送给百度
+        published = a is not None and a.state == 1
         if a :
+            cache_tags.append('article:%d' % a.id)
+            cache_tags.extend(_neighbor_tags(a.id))
+            cache_tags.append('category:%s' % a.category_id)
+            cache_tags.extend(['tag:%d' % t.id for t in a.tags])
             a.title = form.title.data.strip()
             a.editor = form.editor.data
             a.content = form.content.data
             a.content_html = a.content_to_html() if a.editor == 'markdown' else form.content_html.data
+            a.split_content()
             a.summary = form.summary.data
             a.thumbnail = form.thumbnail.data
             a.category = cty
@@ -186,6 +203,7 @@ def write():
                         state = form.state.data,summary = form.summary.data,
                         category=cty, author=current_user._get_current_object())
             a.content_html = a.content_to_html() if a.editor == 'markdown' else form.content_html.data
+            a.split_content()
             db.session.add(a)
             db.session.commit()
             if not a.name and len(a.name) == 0 :
@@ -199,6 +217,17 @@ def write():
             t = Tag.add(tg)
             if t not in a.tags :
                 a.tags.append(t)
+        search_index.index_article(a)
+        db.session.commit()
+        Article.clear_neighbors()
+        cache_tags.append('article:%d' % a.id)
+        cache_tags.extend(_neighbor_tags(a.id))
+        cache_tags.extend(['tag:%d' % t.id for t in a.tags])
+        page_cache.purge(*cache_tags)
+        clear_template_global_cache()
+        sitemap.invalidate()
+        if a.state == 1 and not published:
+            baidu_push.enqueue([baidu_push.article_url(a.name)])
         if isAjax() :
             msg = '发布成功' if int(form.state.data) == 1 else '保存成功' 
             return jsonify({'code':1,'msg':msg,'id':a.id})
@@ -280,36 +309,12 @@ def draw_preview():
     background_color = request.args.get('background_color', '#424155')
     title = request.args.get('title','何三笔记')
     title_color = request.args.get('title_color','#ff0000')
-    print(title_color)
     title_size = request.args.get('title_size',type=int, default= 60)
     font_path = os.path.join(admin.static_folder,'fonts','站酷庆科黄油体.ttf')
-    d_config = {
-        'width': width,
-        'height': height,
-        'background_img': '',
-        'background_color': background_color,
-
-        'layers': [
-            {
-                'layer_type': 'text',
-                'color': title_color,
-                'font': {
-                    'font': font_path,
-                    'size': title_size,
-                },
-                'position': '0,0',
-                'align': 'center',
-                'text': title
-            }
-        ]
-    }
-    d = util.H3blogDrow()
-    d.parse_config(d_config)
-    img = d.draw()
-    bytesIO = io.BytesIO()
-    img.save(bytesIO, 'PNG')
-    bytesIO.seek(0)
-    return send_file(bytesIO, mimetype='image/png')
+    d_config = util.cover_config(title, font_path, width, height, background_color, title_color, title_size)
+    # 相同配置的图片只画一次
+    filename = util.draw_cached(d_config, os.path.join(current_app.config['H3BLOG_CACHE_PATH'], 'draw'))
+    return send_file(filename, mimetype='image/png', conditional=True)
 
 
 @admin.route('/upload',methods=['POST'])
@@ -318,36 +323,63 @@ def draw_preview():
 def upload():
     """图片上传处理"""
     file=request.files.get('file')
-    if not allowed_file(file.filename):
+    if file is None or not allowed_file(file.filename):
         res={
             'code':0,
             'msg':'图片格式异常'
         }
     else:
-        url_path = ''
-        upload_type = current_app.config.get('H3BLOG_UPLOAD_TYPE')
-        ex=os.path.splitext(file.filename)[1]
-        filename=datetime.now().strftime('%Y%m%d%H%M%S')+ex
-        if upload_type is None or upload_type == '' or upload_type == 'local':
-            file.save(os.path.join(current_app.config['H3BLOG_UPLOAD_PATH'],filename))
-            url_path = url_for('admin.get_image',filename=filename)
-        elif upload_type == 'qiniu':
-            try:
-                qiniu_cdn_url = current_app.config.get('QINIU_CDN_URL')
-                url_path = qiniu_cdn_url + upload_file_qiniu(file.read(),filename)
-            except Exception as e:
-                return jsonify({'success':0,'message':'上传图片异常'})
-        #返回
-        pic = Picture(name = file.filename if len(file.filename)< 32 else filename,url = url_path)
-        db.session.add(pic)
+        try:
+            filename, sha256, _ = uploads.save(file.stream, file.filename)
+            pic = uploads.add_picture(file.filename, filename, sha256)
+        except Exception as e:
+            current_app.logger.error('上传图片失败: %s' % e)
+            return jsonify({'code':0,'msg':'上传图片异常'})
         res={
             'code':1,
             'msg':u'图片上传成功',
-            'url': url_path
+            'url': pic.url
         }
     return jsonify(res)
 
 
+@admin.route('/upload/chunk',methods=['GET', 'POST'])
+@login_required
+@admin_required
+def upload_chunk():
+    """
+    分块上传，客户端生成 upload_id
+    GET 返回已上传的大小，中断后从这个位置继续上传
+    POST 上传 offset 位置的分块，全部上传(大小等于 total)后保存图片
+    """
+    upload_id = request.values.get('upload_id', '')
+    chunk_size = current_app.config['H3BLOG_UPLOAD_CHUNK_SIZE']
+    try:
+        if request.method == 'GET':
+            return jsonify({'code':1, 'offset':uploads.uploaded_size(upload_id), 'chunk_size':chunk_size})
+        filename = request.form.get('filename', '')
+        total = request.form.get('total', -1, type=int)
+        file = request.files.get('file')
+        if file is None or not allowed_file(filename):
+            return jsonify({'code':0,'msg':'图片格式异常'})
+        if total > current_app.config['H3BLOG_UPLOAD_MAX_SIZE']:
+            return jsonify({'code':0,'msg':'图片太大'})
+        offset = uploads.append_chunk(upload_id, request.form.get('offset', 0, type=int), file.stream)
+        if offset < total:
+            return jsonify({'code':1, 'offset':offset, 'chunk_size':chunk_size})
+        if offset > total:
+            uploads.discard(upload_id)
+            raise ValueError('上传大小 %d 超过文件大小 %d' % (offset, total))
+        name, sha256, _ = uploads.finish_chunks(upload_id, filename)
+        pic = uploads.add_picture(filename, name, sha256)
+    except ValueError as e:
+        return jsonify({'code':0, 'msg':str(e)})
+    except Exception as e:
+        current_app.logger.error('上传图片失败: %s' % e)
+        return jsonify({'code':0,'msg':'上传图片异常'})
+    return jsonify({'code':1, 'msg':u'图片上传成功', 'url':pic.url, 'offset':offset})
+
+
 @admin.route('/tags')
 @login_required
 @admin_required
@@ -373,6 +405,9 @@ def tag_add():
     form = CategoryForm()
     if request.method == 'POST' and form.validate_on_submit():
         Tag.add(form.name.data.strip())
+        page_cache.purge('layout')
+        clear_template_global_cache()
+        sitemap.invalidate()
         return redirect(url_for('admin.tags'))
 
     return render_template('admin/tag.html',form=form)
@@ -392,6 +427,9 @@ def tag_edit():
     if request.method == 'POST' and form.validate_on_submit():
         form.populate_obj(c)
         db.session.commit()
+        page_cache.purge('layout')
+        clear_template_global_cache()
+        sitemap.invalidate()
         return redirect(url_for('admin.tags'))
 
     form = TagForm(obj=c)
@@ -433,6 +471,9 @@ def categroy_add():
         #         seo_keywords = form.seo_keywords.data)
         db.session.add(c)
         db.session.commit()  
+        page_cache.purge('layout')
+        clear_template_global_cache()
+        sitemap.invalidate()
         return redirect(url_for('admin.categorys'))
 
     return render_template('admin/category.html',form=form)
@@ -449,6 +490,9 @@ def categroy_edit(id):
     if request.method == 'POST' and form.validate_on_submit():
         form.populate_obj(c)
         db.session.commit()
+        page_cache.purge('layout')
+        clear_template_global_cache()
+        sitemap.invalidate()
         return redirect(url_for('admin.categorys'))
 
     form = CategoryForm(obj=c)
@@ -456,6 +500,18 @@ def categroy_edit(id):
 
 @admin.route('/uploads/<path:filename>')
 def get_image(filename):
+    '''
+    上传的图片，?w=320 返回缩略图，浏览器支持时返回 WebP 格式
+    '''
+    width = request.args.get('w', type=int)
+    if width and width > 0:
+        # 只有明确声明支持 WebP 的浏览器才返回 WebP，*/* 不算
+        webp = any(m == 'image/webp' and q > 0 for m, q in request.accept_mimetypes)
+        variant = images.get(filename, width, webp)
+        if variant is not None:
+            response = send_from_directory(*variant)
+            response.vary.add('Accept')
+            return response
     return send_from_directory(current_app.config['H3BLOG_UPLOAD_PATH'], filename)
 
 @admin.route('/imagehosting')
@@ -475,10 +531,28 @@ def image_hosting():
 @admin.route('/baidu_push_urls',methods=['POST'])
 @admin_required
 def baidu_push_article():
-    urls = request.form.get('urls')
-    domain = current_app.config.get('H3BLOG_DOMAIN','https://www.h3blog.com')
-    ret = baidu_push_urls(domain,urls)
-    return jsonify(ret)
+    '''
+    链接加入百度推送队列，多个链接使用换行分隔
+    '''
+    urls = request.form.get('urls', '').split('\n')
+    n = baidu_push.enqueue(urls)
+    return jsonify({'success': n, 'pending': baidu_push.stats()['pending']})
+
+@admin.route('/baidu_push', methods=['GET'])
+@login_required
+@admin_required
+def baidu_push_logs():
+    '''
+    百度推送队列和推送结果
+    '''
+    state = request.args.get('state', -1, type=int)
+    page = request.args.get('page', 1, type=int)
+    query = BaiduPush.query
+    if state in (BaiduPush.PENDING, BaiduPush.SUCCESS, BaiduPush.FAILED):
+        query = query.filter(BaiduPush.state == state)
+    logs = query.order_by(BaiduPush.id.desc()).paginate(page, per_page=50, error_out=False)
+    return render_template('admin/baidu_push.html', logs=logs, stats=baidu_push.stats(),
+                           enabled=baidu_push.enabled, params={'state': state})
 
 @admin.route('/recommends',methods=['GET'])
 @login_required
@@ -508,6 +582,7 @@ def recommends_add():
                 state = form.state.data)
         db.session.add(r)
         db.session.commit()  
+        page_cache.purge('recommend')
         return redirect(url_for('admin.recommends'))
 
     return render_template('admin/recommend.html',form=form)
@@ -528,6 +603,7 @@ def recommends_edit(id):
         r.sn = form.sn.data
         r.state = form.state.data
         db.session.commit()
+        page_cache.purge('recommend')
         return redirect(url_for('admin.recommends'))
 
     form = RecommendForm(obj=r)
@@ -535,21 +611,69 @@ def recommends_edit(id):
 
 
 
+# 抓取统计可选的天数
+ACCESS_LOG_DAYS = (1, 7, 30, 90)
+
 @admin.route('/accesslogs',methods=['GET'])
 @login_required
 @admin_required
 def access_logs():
     '''
-    搜索引擎抓取记录
+    搜索引擎抓取统计
+    统计数据读取按小时、按天的汇总表，原始日志只显示最近的记录
     '''
-    remark = request.args.get('remark','')
-    params = {'remark': remark}
-    page = request.args.get('page',1, type=int)
-    logs = AccessLog.query.filter(
-        AccessLog.remark.like("%" + remark + "%") if remark is not None else ''
-        ).order_by(AccessLog.timestamp.desc()). \
-        paginate(page, per_page=current_app.config['H3BLOG_POST_PER_PAGE'], error_out=False)
-    return render_template('admin/access_log.html',logs = logs,params = params)
+    remark = request.args.get('remark', '')
+    days = request.args.get('days', 7, type=int)
+    if days not in ACCESS_LOG_DAYS:
+        days = 7
+    params = {'remark': remark, 'days': days}
+    today = date.today()
+    start = today - timedelta(days=days - 1)
+    total = db.func.sum(AccessLogDaily.count)
+
+    #各搜索引擎抓取总数
+    spiders = db.session.query(AccessLogDaily.remark, total). \
+        filter(AccessLogDaily.day >= start). \
+        group_by(AccessLogDaily.remark).order_by(total.desc()).all()
+
+    #每天抓取数量
+    q = db.session.query(AccessLogDaily.day, AccessLogDaily.remark, total). \
+        filter(AccessLogDaily.day >= start)
+    if remark:
+        q = q.filter(AccessLogDaily.remark == remark)
+    counts = {}
+    for day, r, n in q.group_by(AccessLogDaily.day, AccessLogDaily.remark):
+        counts.setdefault(day, {})[r] = n
+    trend = []
+    for i in range(days):
+        day = today - timedelta(days=i)
+        trend.append((day, counts.get(day, {})))
+
+    #抓取最多的路径
+    q = db.session.query(AccessLogDaily.url, total). \
+        filter(AccessLogDaily.day >= start)
+    if remark:
+        q = q.filter(AccessLogDaily.remark == remark)
+    urls = q.group_by(AccessLogDaily.url).order_by(total.desc()).limit(20).all()
+
+    #最近24小时每小时抓取数量
+    hour = datetime.now().replace(minute=0, second=0, microsecond=0)
+    q = db.session.query(AccessLogHourly.hour, db.func.sum(AccessLogHourly.count)). \
+        filter(AccessLogHourly.hour > hour - timedelta(hours=24))
+    if remark:
+        q = q.filter(AccessLogHourly.remark == remark)
+    counts = dict(q.group_by(AccessLogHourly.hour))
+    hours = [(hour - timedelta(hours=i), counts.get(hour - timedelta(hours=i), 0)) for i in range(24)]
+
+    #最近的原始日志
+    q = AccessLog.query
+    if remark:
+        q = q.filter(AccessLog.remark == remark)
+    logs = q.order_by(AccessLog.id.desc()).limit(current_app.config['H3BLOG_POST_PER_PAGE']).all()
+
+    return render_template('admin/access_log.html', logs=logs, params=params, spiders=spiders,
+                           trend=trend, urls=urls, hours=hours, names=[name for _, name in SPIDERS],
+                           day_options=ACCESS_LOG_DAYS, dropped=access_logger.dropped)
 
 @admin.route('/invitcodes',methods=['GET','POST'])
 @login_required
@@ -600,6 +724,8 @@ def settings():
                 from app.main import main as main_blueprint, change_static_folder
                 change_static_folder(main_blueprint, tpl_path)
         db.session.commit()
+        page_cache.clear()
+        sitemap.invalidate()
         flash({'success': '修改成功！'})
         
 
@@ -1,8 +1,19 @@
 from .ali_pay import AliPay
+from .view_counter import ViewCounter
+from .search import SearchIndex
+from .page_cache import PageCache
+from .sitemap import Sitemap
+from .access_logger import AccessLogger, match_spider
+from .assets import Assets
+from .compress import Compress
+from .images import ImageDerivatives
+from .uploads import UploadStore
+from .storage import Storage
+from .bing import BingWallpaper
+from .baidu_push import BaiduPusher
 from flask.app import Flask
 from flask_login import LoginManager
 from flask_sqlalchemy import SQLAlchemy
-from flask_sitemap import Sitemap
 from flask_migrate import Migrate
 from flask_wtf.csrf import CSRFProtect
 
@@ -43,6 +54,17 @@ app_helper = AppHelper()
 csrf = CSRFProtect()
 db_config = DBConfig()
 alipay = AliPay()
+view_counter = ViewCounter()
+search_index = SearchIndex()
+page_cache = PageCache()
+access_logger = AccessLogger()
+assets = Assets()
+compress = Compress()
+images = ImageDerivatives()
+uploads = UploadStore()
+storage = Storage()
+bing = BingWallpaper()
+baidu_push = BaiduPusher()
 
 
 def check_db_uri(uri: str) ->bool:
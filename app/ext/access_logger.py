@@ -0,0 +1,241 @@
+import atexit
+import queue
+import re
+import threading
+import time
+from collections import Counter
+from datetime import datetime, timedelta
+
+# 搜索引擎爬虫 User-Agent 标识和名称
+SPIDERS = (
+    ('Baiduspider', '百度'),
+    ('Bytespider', '头条搜索'),
+    ('YisouSpider', '神马搜索'),
+    ('Sogou', '搜狗'),
+    ('Sosospider', '搜搜'),
+)
+
+_spider_re = re.compile('|'.join('({})'.format(re.escape(ua)) for ua, _ in SPIDERS))
+
+
+def match_spider(user_agent: str) -> str:
+    """根据 User-Agent 返回搜索引擎名称，不是爬虫返回 None"""
+    if not user_agent:
+        return None
+    m = _spider_re.search(user_agent)
+    if m is None:
+        return None
+    return SPIDERS[m.lastindex - 1][1]
+
+
+class AccessLogger(object):
+    """
+    搜索引擎抓取日志
+
+    请求中只把日志放入内存队列，由后台线程批量写入 access_log 表，
+    同一事务中累加 access_log_hourly、access_log_daily 汇总表。
+    队列满时丢弃日志并计数，程序退出时写入队列中剩余的日志。
+    后台线程每小时按保留天数清理一次原始日志和小时汇总，按天汇总永久保留。
+    """
+    # 自动清理间隔(秒)
+    PRUNE_INTERVAL = 3600
+
+    def __init__(self) -> None:
+        self.app = None
+        self.queue = None
+        self.dropped = 0
+        self.written = 0
+        self.failed = 0
+        self._thread = None
+        self._lock = threading.Lock()
+        self._event = threading.Event()
+        self._write_lock = threading.Lock()
+        self._pruned = 0
+
+    def init_app(self, app) -> None:
+        self.app = app
+        self.queue = queue.Queue(maxsize=int(app.config['H3BLOG_ACCESS_LOG_QUEUE_SIZE']))
+        atexit.register(self.flush)
+
+    def log(self, ip: str, url: str, remark: str) -> None:
+        """记录一次抓取，不会阻塞请求"""
+        record = {
+            'ip': (ip or '')[:20],
+            'url': (url or '')[:120],
+            'remark': remark,
+            'timestamp': datetime.now(),
+        }
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+            return
+        self._event.set()
+        self._ensure_thread()
+
+    def flush(self) -> int:
+        """把队列中的日志全部写入数据库，返回写入条数"""
+        count = 0
+        while True:
+            batch = self._drain(int(self.app.config['H3BLOG_ACCESS_LOG_BATCH_SIZE']))
+            if not batch:
+                return count
+            self._write(batch)
+            count += len(batch)
+
+    def _drain(self, size: int) -> list:
+        batch = []
+        while len(batch) < size:
+            try:
+                batch.append(self.queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _write(self, batch: list) -> None:
+        from app.ext import db
+        from app.models import AccessLog
+        try:
+            with self._write_lock, db.get_engine(app=self.app).begin() as conn:
+                conn.execute(AccessLog.__table__.insert(), batch)
+                self._rollup(conn, batch)
+            self.written += len(batch)
+        except Exception as e:
+            self.failed += len(batch)
+            self.app.logger.error('写入抓取日志失败: %s' % e)
+
+    def _rollup(self, conn, records, hour_since: datetime = None, day_since: datetime = None) -> None:
+        """按小时、按天累加汇总表，指定 hour_since、day_since 时只累加这个时间以后的日志"""
+        from app.models import AccessLogHourly, AccessLogDaily
+        hourly = Counter()
+        daily = Counter()
+        for r in records:
+            ts = r['timestamp']
+            key = (r['remark'] or '', r['url'] or '')
+            if hour_since is None or ts >= hour_since:
+                hourly[(ts.replace(minute=0, second=0, microsecond=0),) + key] += 1
+            if day_since is None or ts >= day_since:
+                daily[(ts.date(),) + key] += 1
+        self._upsert(conn, AccessLogHourly.__table__, 'hour', hourly)
+        self._upsert(conn, AccessLogDaily.__table__, 'day', daily)
+
+    def _upsert(self, conn, table, period: str, counts: Counter) -> None:
+        """
+        汇总数量累加到表中，不存在时插入
+        多个进程同时写入同一行时，MySQL、PostgreSQL 使用数据库的 upsert 语句，
+        其他数据库插入冲突时改为更新
+        """
+        from sqlalchemy.exc import IntegrityError
+        if not counts:
+            return
+        rows = [{period: value, 'remark': remark, 'url': url, 'count': n}
+                for (value, remark, url), n in counts.items()]
+        dialect = conn.dialect.name
+        if dialect == 'mysql':
+            from sqlalchemy.dialects.mysql import insert
+            stmt = insert(table)
+            conn.execute(stmt.on_duplicate_key_update(count=table.c.count + stmt.inserted['count']), rows)
+            return
+        if dialect == 'postgresql':
+            from sqlalchemy.dialects.postgresql import insert
+            stmt = insert(table)
+            conn.execute(stmt.on_conflict_do_update(index_elements=[period, 'remark', 'url'],
+                                                    set_={'count': table.c.count + stmt.excluded['count']}), rows)
+            return
+        for row in rows:
+            where = (table.c[period] == row[period]) & (table.c.remark == row['remark']) & (table.c.url == row['url'])
+            update = table.update().where(where).values(count=table.c.count + row['count'])
+            if conn.execute(update).rowcount:
+                continue
+            try:
+                with conn.begin_nested():
+                    conn.execute(table.insert(), row)
+            except IntegrityError:
+                # 其他进程刚插入了这一行
+                conn.execute(update)
+
+    def rebuild_stats(self, chunk_size: int = 5000) -> int:
+        """
+        根据保留的原始日志重建汇总表，返回处理的日志条数
+        只重建原始日志完整覆盖的小时和天，更早的汇总(原始日志已经清理)保持不变
+        """
+        from app.ext import db
+        from app.models import AccessLog, AccessLogHourly, AccessLogDaily
+        t = AccessLog.__table__
+        hourly = AccessLogHourly.__table__
+        daily = AccessLogDaily.__table__
+        engine = db.get_engine(app=self.app)
+        with self._write_lock:
+            with engine.begin() as conn:
+                first = conn.execute(db.select([db.func.min(t.c.timestamp)])).scalar()
+                if first is None:
+                    return 0
+                # 最早的小时和天可能已经清理了一部分原始日志，不重建
+                hour_since = first.replace(minute=0, second=0, microsecond=0) + timedelta(hours=1)
+                day_since = datetime.combine(first.date() + timedelta(days=1), datetime.min.time())
+                conn.execute(hourly.delete().where(hourly.c.hour >= hour_since))
+                conn.execute(daily.delete().where(daily.c.day >= day_since.date()))
+            count = 0
+            last_id = 0
+            while True:
+                with engine.begin() as conn:
+                    rows = conn.execute(db.select([t.c.id, t.c.url, t.c.remark, t.c.timestamp]).
+                                        where(t.c.id > last_id).order_by(t.c.id.asc()).
+                                        limit(chunk_size)).fetchall()
+                    if not rows:
+                        return count
+                    self._rollup(conn, [dict(r) for r in rows if r.timestamp is not None],
+                                 hour_since, day_since)
+                last_id = rows[-1].id
+                count += len(rows)
+
+    def prune(self, chunk_size: int = 5000) -> int:
+        """
+        删除超过保留天数的原始日志和小时汇总，返回删除的原始日志条数
+        原始日志按主键分批删除，避免长时间锁表
+        """
+        from app.ext import db
+        from app.models import AccessLog, AccessLogHourly
+        t = AccessLog.__table__
+        engine = db.get_engine(app=self.app)
+        now = datetime.now()
+        cutoff = now - timedelta(days=int(self.app.config['H3BLOG_ACCESS_LOG_RETENTION_DAYS']))
+        count = 0
+        while True:
+            with engine.begin() as conn:
+                ids = [r[0] for r in conn.execute(db.select([t.c.id]).
+                                                  where(t.c.timestamp < cutoff).limit(chunk_size))]
+                if not ids:
+                    break
+                conn.execute(t.delete().where(t.c.id.in_(ids)))
+            count += len(ids)
+        hourly = AccessLogHourly.__table__
+        hourly_cutoff = now - timedelta(days=int(self.app.config['H3BLOG_ACCESS_LOG_HOURLY_RETENTION_DAYS']))
+        with engine.begin() as conn:
+            conn.execute(hourly.delete().where(hourly.c.hour < hourly_cutoff))
+        self._pruned = time.time()
+        return count
+
+    def _ensure_thread(self) -> None:
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._thread = threading.Thread(target=self._run, name='h3blog-access-logger', daemon=True)
+            self._thread.start()
+
+    def _run(self) -> None:
+        interval = float(self.app.config['H3BLOG_ACCESS_LOG_FLUSH_INTERVAL'])
+        while True:
+            self._event.wait()
+            self._event.clear()
+            # 等待一段时间凑够一批再写入，日志留在队列中，退出时可以由 flush() 写入
+            time.sleep(interval)
+            self.flush()
+            if time.time() - self._pruned > self.PRUNE_INTERVAL:
+                try:
+                    self.prune()
+                except Exception as e:
+                    self._pruned = time.time()
+                    self.app.logger.error('清理抓取日志失败: %s' % e)
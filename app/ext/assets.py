@@ -0,0 +1,222 @@
+import gzip
+import hashlib
+import json
+import mimetypes
+import os
+import posixpath
+import re
+import time
+from flask import request, send_from_directory, url_for
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+MANIFEST = 'manifest.json'
+# 文件名带内容哈希，可以长期缓存
+ASSET_MAX_AGE = 365 * 24 * 3600
+# 需要预压缩的文件类型
+COMPRESS_EXTENSIONS = frozenset(['.css', '.js', '.svg', '.txt', '.html', '.json', '.xml',
+                                 '.eot', '.ttf', '.otf', '.ico'])
+# 小于这个大小的文件不压缩
+COMPRESS_MIN_SIZE = 512
+# 检查 manifest.json 是否更新的间隔(秒)
+MANIFEST_CHECK_INTERVAL = 1
+
+_css_url_re = re.compile(r'''url\(\s*(['"]?)([^'")]+)\1\s*\)''')
+# 地址中的路径和 ?查询参数/#锚点
+_url_suffix_re = re.compile(r'([^?#]*)(.*)')
+
+
+class Assets(object):
+    """
+    前端模板静态文件
+
+    flask collect-static 把 themes/<模板>/static 下的文件复制到
+    H3BLOG_CACHE_PATH/assets/<模板>，文件名加上内容哈希，同时生成 .gz/.br 预压缩文件
+    和 manifest.json。模板中的 url_for('main.static', filename=...) 会替换为
+    /assets/<模板>/<带哈希的文件名>，浏览器可以缓存一年。
+    H3BLOG_ASSETS 为 0 或者没有执行 collect-static 时仍然使用原来的静态文件。
+
+    collect-static 只增加文件，缓存的页面和浏览器中还在使用的旧文件不会删除，
+    由 flask prune-static 删除不再使用超过一定天数的文件。
+    各进程发现 manifest.json 修改后重新读取。
+    """
+    def __init__(self) -> None:
+        self.app = None
+        # 模板 -> (检查时间, manifest.json 修改时间, manifest)
+        self._manifests = {}
+
+    def init_app(self, app) -> None:
+        self.app = app
+        app.add_url_rule('/assets/<theme>/<path:filename>', 'assets', self.send_file)
+        app.jinja_env.globals['url_for'] = self.url_for
+
+    @property
+    def path(self) -> str:
+        return os.path.join(self.app.config['H3BLOG_CACHE_PATH'], 'assets')
+
+    def theme_static_path(self, theme: str) -> str:
+        return os.path.join(self.app.root_path, 'main', 'themes', theme, 'static')
+
+    def manifest(self, theme: str) -> dict:
+        """原文件名到带哈希文件名的映射，没有执行 collect-static 时为空"""
+        now = time.time()
+        cached = self._manifests.get(theme)
+        if cached is not None and now - cached[0] < MANIFEST_CHECK_INTERVAL:
+            return cached[2]
+        filename = os.path.join(self.path, theme, MANIFEST)
+        try:
+            mtime = os.stat(filename).st_mtime
+        except OSError:
+            mtime = None
+        if cached is not None and cached[1] == mtime:
+            manifest = cached[2]
+        else:
+            manifest = self._read_manifest(theme)
+        self._manifests[theme] = (now, mtime, manifest)
+        return manifest
+
+    def _read_manifest(self, theme: str) -> dict:
+        try:
+            with open(os.path.join(self.path, theme, MANIFEST), encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def url_for(self, endpoint: str, **values) -> str:
+        """模板使用的 url_for，前端模板的静态文件替换为带哈希的地址"""
+        if self.app.config['H3BLOG_ASSETS'] and 'filename' in values and \
+                (endpoint == 'main.static' or (endpoint == '.static' and request.blueprint == 'main')):
+            theme = self.app.config['H3BLOG_TEMPLATE']
+            hashed = self.manifest(theme).get(values['filename'])
+            if hashed is not None:
+                values['filename'] = hashed
+                return url_for('assets', theme=theme, **values)
+        return url_for(endpoint, **values)
+
+    def send_file(self, theme: str, filename: str):
+        """返回带哈希的静态文件，浏览器支持时返回预压缩的文件"""
+        directory = os.path.join(self.path, theme)
+        accept = request.accept_encodings
+        for encoding, suffix in (('br', '.br'), ('gzip', '.gz')):
+            if accept[encoding] and os.path.isfile(os.path.join(directory, filename + suffix)):
+                mimetype = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+                response = send_from_directory(directory, filename + suffix, mimetype=mimetype,
+                                               cache_timeout=ASSET_MAX_AGE)
+                response.headers['Content-Encoding'] = encoding
+                break
+        else:
+            response = send_from_directory(directory, filename, cache_timeout=ASSET_MAX_AGE)
+        response.vary.add('Accept-Encoding')
+        response.cache_control.immutable = True
+        return response
+
+    def collect(self, theme: str = None) -> int:
+        """
+        生成带哈希文件名的静态文件，返回文件数量
+        css 中引用的字体、图片地址同样替换为带哈希的文件名
+        已经存在的文件不重复生成，以前生成的文件保留，由 prune() 删除
+        """
+        theme = theme or self.app.config['H3BLOG_TEMPLATE']
+        source = self.theme_static_path(theme)
+        target = os.path.join(self.path, theme)
+        old = self._read_manifest(theme)
+        files = []
+        for root, _, names in os.walk(source):
+            for name in names:
+                files.append(os.path.relpath(os.path.join(root, name), source).replace(os.sep, '/'))
+        # css 最后处理，引用的文件已经有了哈希文件名
+        files.sort(key=lambda f: (f.endswith('.css'), f))
+        manifest = {}
+        for filename in files:
+            with open(os.path.join(source, filename), 'rb') as f:
+                data = f.read()
+            if filename.endswith('.css'):
+                data = self._rewrite_css(filename, data, manifest)
+            hashed = self._hashed_name(filename, data)
+            manifest[filename] = hashed
+            self._write(os.path.join(target, hashed), data)
+        os.makedirs(target, exist_ok=True)
+        tmp = os.path.join(target, MANIFEST + '.%d.tmp' % os.getpid())
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump(manifest, f, ensure_ascii=False, indent=1, sort_keys=True)
+        os.replace(tmp, os.path.join(target, MANIFEST))
+        # 不再使用的文件从现在开始计算保留时间
+        now = time.time()
+        for hashed in set(old.values()) - set(manifest.values()):
+            for suffix in ('', '.gz', '.br'):
+                try:
+                    os.utime(os.path.join(target, hashed + suffix), (now, now))
+                except OSError:
+                    pass
+        self._manifests.pop(theme, None)
+        return len(manifest)
+
+    def prune(self, theme: str = None, days: float = 7) -> int:
+        """删除当前 manifest.json 中没有、并且超过 days 天没有使用的文件，返回删除的文件数量"""
+        theme = theme or self.app.config['H3BLOG_TEMPLATE']
+        target = os.path.join(self.path, theme)
+        keep = set(self._read_manifest(theme).values())
+        if not keep:
+            return 0
+        cutoff = time.time() - days * 24 * 3600
+        count = 0
+        for root, _, names in os.walk(target):
+            for name in names:
+                path = os.path.join(root, name)
+                filename = os.path.relpath(path, target).replace(os.sep, '/')
+                if filename == MANIFEST:
+                    continue
+                base = filename[:-3] if filename.endswith(('.gz', '.br')) else filename
+                if base in keep or os.path.getmtime(path) >= cutoff:
+                    continue
+                os.remove(path)
+                count += 1
+        return count
+
+    def _hashed_name(self, filename: str, data: bytes) -> str:
+        base, ext = posixpath.splitext(filename)
+        return '{}.{}{}'.format(base, hashlib.sha256(data).hexdigest()[:12], ext)
+
+    def _rewrite_css(self, filename: str, data: bytes, manifest: dict) -> bytes:
+        directory = posixpath.dirname(filename)
+        def repl(m):
+            url = m.group(2).strip()
+            if url.startswith(('data:', 'http:', 'https:', '//', '/', '#')):
+                return m.group(0)
+            path, suffix = _url_suffix_re.match(url).groups()
+            target = posixpath.normpath(posixpath.join(directory, path))
+            hashed = manifest.get(target)
+            if hashed is None:
+                return m.group(0)
+            new_path = posixpath.relpath(hashed, directory or '.')
+            return 'url({0}{1}{2}{0})'.format(m.group(1), new_path, suffix)
+        text = data.decode('utf-8', errors='surrogateescape')
+        return _css_url_re.sub(repl, text).encode('utf-8', errors='surrogateescape')
+
+    def _write(self, filename: str, data: bytes) -> None:
+        """
+        写入文件和预压缩文件，文件名带内容哈希，已经存在时不需要重新写入
+        预压缩文件先写入，原文件存在时预压缩文件一定已经写好
+        """
+        if os.path.isfile(filename):
+            return
+        os.makedirs(os.path.dirname(filename), exist_ok=True)
+        ext = posixpath.splitext(filename)[1].lower()
+        if ext in COMPRESS_EXTENSIONS and len(data) >= COMPRESS_MIN_SIZE:
+            compressed = gzip.compress(data, 9, mtime=0)
+            if len(compressed) < len(data):
+                self._replace(filename + '.gz', compressed)
+            if brotli is not None:
+                compressed = brotli.compress(data)
+                if len(compressed) < len(data):
+                    self._replace(filename + '.br', compressed)
+        self._replace(filename, data)
+
+    def _replace(self, filename: str, data: bytes) -> None:
+        tmp = '%s.%d.tmp' % (filename, os.getpid())
+        with open(tmp, 'wb') as f:
+            f.write(data)
+        os.replace(tmp, filename)
@@ -0,0 +1,234 @@
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta
+import requests
+
+# 百度主动推送每次请求最多的链接数
+MAX_BATCH_SIZE = 2000
+# 推送请求超时时间
+TIMEOUT = 10
+# 领取的链接超过这个时间没有完成(比如进程退出)时可以重新推送
+LEASE_SECONDS = 300
+
+
+class BaiduPusher(object):
+    """
+    百度主动推送
+
+    发布文章时把链接加入 baidu_push 表，由后台线程合并成批(最多 H3BLOG_BAIDU_PUSH_BATCH_SIZE 条)，
+    通过复用连接的 Session 推送。每次请求至少间隔 H3BLOG_BAIDU_PUSH_INTERVAL 秒，
+    超过配额时每批数量减半重试，一条也超过配额时暂停到第二天；网络错误或服务器错误按
+    H3BLOG_BAIDU_PUSH_RETRY_DELAY * 2^n 秒后重试，超过 H3BLOG_BAIDU_PUSH_RETRIES 次标记为失败。
+    推送结果记录在表中，后台「百度推送」页面查看。
+    """
+    def __init__(self) -> None:
+        self.app = None
+        # 接口返回的当天剩余配额，None 为未知
+        self.remain = None
+        # 超过配额后缩小的每批数量
+        self.limit = None
+        self.paused_until = None
+        self._session = requests.Session()
+        self._session.headers['Content-Type'] = 'text/plain'
+        self._thread = None
+        self._lock = threading.Lock()
+        self._push_lock = threading.Lock()
+        self._event = threading.Event()
+        self._last_request = 0
+
+    def init_app(self, app) -> None:
+        self.app = app
+        # 重启后继续推送表中等待的链接
+        app.before_first_request(self._ensure_thread)
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.app.config.get('BAIDU_PUSH_TOKEN'))
+
+    def site(self) -> str:
+        domain = self.app.config['H3BLOG_DOMAIN'].rstrip('/')
+        if domain.startswith('http://') or domain.startswith('https://'):
+            return domain
+        return '{}://{}'.format(self.app.config['SITEMAP_URL_SCHEME'], domain)
+
+    def article_url(self, name) -> str:
+        """文章的完整地址，需要在请求上下文中调用"""
+        from flask import url_for
+        return self.site() + url_for('main.article', name=name)
+
+    def enqueue(self, urls) -> int:
+        """链接加入推送队列，已经在等待推送的链接不重复加入，返回加入的数量"""
+        from app.ext import db
+        from app.models import BaiduPush
+        urls = list(dict.fromkeys(u.strip() for u in urls if u and u.strip()))
+        if not urls:
+            return 0
+        t = BaiduPush.__table__
+        now = datetime.now()
+        with db.get_engine(app=self.app).begin() as conn:
+            waiting = set(r[0] for r in conn.execute(db.select([t.c.url]).
+                          where((t.c.state == BaiduPush.PENDING) & t.c.url.in_(urls))))
+            rows = [{'url': u, 'state': BaiduPush.PENDING, 'attempts': 0, 'next_try': now, 'timestamp': now}
+                    for u in urls if u not in waiting]
+            if rows:
+                conn.execute(t.insert(), rows)
+        self._ensure_thread()
+        self._event.set()
+        return len(rows)
+
+    def stats(self) -> dict:
+        """各状态的链接数量"""
+        from app.ext import db
+        from app.models import BaiduPush
+        t = BaiduPush.__table__
+        with db.get_engine(app=self.app).connect() as conn:
+            counts = dict(conn.execute(db.select([t.c.state, db.func.count()]).group_by(t.c.state)).fetchall())
+        return {'pending': counts.get(BaiduPush.PENDING, 0), 'success': counts.get(BaiduPush.SUCCESS, 0),
+                'failed': counts.get(BaiduPush.FAILED, 0), 'remain': self.remain, 'paused_until': self.paused_until}
+
+    def process(self) -> int:
+        """推送所有到时间的链接，返回推送成功的数量"""
+        if not self.enabled:
+            return 0
+        count = 0
+        with self._push_lock:
+            while self.paused_until is None or datetime.now() >= self.paused_until:
+                if self.paused_until is not None:
+                    # 第二天配额恢复，剩余配额未知
+                    self.paused_until = None
+                    self.remain = None
+                rows = self._claim()
+                if not rows:
+                    break
+                count += self._push(rows)
+        return count
+
+    def _batch_size(self) -> int:
+        size = min(int(self.app.config['H3BLOG_BAIDU_PUSH_BATCH_SIZE']), MAX_BATCH_SIZE)
+        if self.limit is not None:
+            size = min(size, self.limit)
+        if self.remain is not None:
+            size = min(size, self.remain)
+        return size
+
+    def _claim(self) -> list:
+        """领取一批到时间的链接，其他进程不会再领取"""
+        from app.ext import db
+        from app.models import BaiduPush
+        t = BaiduPush.__table__
+        now = datetime.now()
+        lease = uuid.uuid4().hex
+        with db.get_engine(app=self.app).begin() as conn:
+            ids = [r[0] for r in conn.execute(db.select([t.c.id]).
+                   where((t.c.state == BaiduPush.PENDING) & (t.c.next_try <= now)).
+                   order_by(t.c.id.asc()).limit(self._batch_size()))]
+            if not ids:
+                return []
+            conn.execute(t.update().where(t.c.id.in_(ids) & (t.c.state == BaiduPush.PENDING) &
+                                          (t.c.next_try <= now)).
+                         values(lease=lease, next_try=now + timedelta(seconds=LEASE_SECONDS)))
+            return conn.execute(db.select([t.c.id, t.c.url, t.c.attempts]).
+                                where(t.c.lease == lease).order_by(t.c.id.asc())).fetchall()
+
+    def _request(self, urls: list) -> requests.Response:
+        wait = float(self.app.config['H3BLOG_BAIDU_PUSH_INTERVAL']) - (time.time() - self._last_request)
+        if wait > 0:
+            time.sleep(wait)
+        self._last_request = time.time()
+        api = self.app.config['H3BLOG_BAIDU_PUSH_API'].rstrip('/') + '/urls'
+        return self._session.post(api, params={'site': self.site(), 'token': self.app.config.get('BAIDU_PUSH_TOKEN')},
+                                  data='\n'.join(urls).encode('utf-8'), timeout=TIMEOUT)
+
+    def _push(self, rows: list) -> int:
+        from app.ext import db
+        from app.models import BaiduPush
+        t = BaiduPush.__table__
+        now = datetime.now()
+        try:
+            resp = self._request([r.url for r in rows])
+            data = resp.json() if resp.status_code < 500 else {}
+        except (requests.RequestException, ValueError) as e:
+            # requests.Timeout() 等异常的 str 可能为空，带上异常类型
+            resp, data = None, {'message': '%s: %s' % (type(e).__name__, e) if str(e) else type(e).__name__}
+        results = {}
+        if resp is not None and resp.status_code == 200 and 'success' in data:
+            self.remain = data.get('remain')
+            if self.remain is not None:
+                self.limit = None
+            invalid = {}
+            for key, reason in (('not_same_site', '不是本站链接'), ('not_valid', '链接不合法')):
+                for u in data.get(key) or []:
+                    invalid[u] = reason
+            for r in rows:
+                if r.url in invalid:
+                    results[r.id] = {'state': BaiduPush.FAILED, 'result': invalid[r.url]}
+                else:
+                    results[r.id] = {'state': BaiduPush.SUCCESS, 'result': '推送成功，剩余配额 %s' % self.remain}
+            if self.remain == 0:
+                self._pause()
+        elif resp is not None and resp.status_code == 400 and 'over quota' in str(data.get('message')):
+            # 超过配额，减少每批数量马上重试；一条也超过时配额已经用完，明天再推送。不算重试次数
+            if len(rows) > 1:
+                self.limit = len(rows) // 2
+                result, next_try = '超过配额，减少每批数量重试', now
+            else:
+                self.remain = 0
+                self._pause()
+                result, next_try = '配额用完', self.paused_until
+            for r in rows:
+                results[r.id] = {'state': BaiduPush.PENDING, 'result': result, 'attempts': r.attempts,
+                                 'next_try': next_try}
+        elif resp is not None and 400 <= resp.status_code < 500:
+            # token、站点错误等，重试也不会成功
+            for r in rows:
+                results[r.id] = {'state': BaiduPush.FAILED, 'result': str(data.get('message'))[:255]}
+        else:
+            message = str(data.get('message') or 'HTTP %s' % resp.status_code)[:200]
+            retries = int(self.app.config['H3BLOG_BAIDU_PUSH_RETRIES'])
+            delay = float(self.app.config['H3BLOG_BAIDU_PUSH_RETRY_DELAY'])
+            for r in rows:
+                attempts = (r.attempts or 0) + 1
+                if attempts >= retries:
+                    results[r.id] = {'state': BaiduPush.FAILED, 'result': message, 'attempts': attempts}
+                else:
+                    results[r.id] = {'state': BaiduPush.PENDING, 'result': message, 'attempts': attempts,
+                                     'next_try': now + timedelta(seconds=delay * 2 ** (attempts - 1))}
+            self.app.logger.warning('百度推送失败: %s' % message)
+        updates = []
+        for r in rows:
+            values = results[r.id]
+            pending = values['state'] == BaiduPush.PENDING
+            updates.append({'_id': r.id, '_state': values['state'], '_result': values['result'],
+                            '_attempts': values.get('attempts', (r.attempts or 0) + 1),
+                            '_next_try': values['next_try'] if pending else now,
+                            '_pushed': None if pending else now})
+        with db.get_engine(app=self.app).begin() as conn:
+            conn.execute(t.update().where(t.c.id == db.bindparam('_id')).
+                         values(state=db.bindparam('_state'), result=db.bindparam('_result'),
+                                attempts=db.bindparam('_attempts'), next_try=db.bindparam('_next_try'),
+                                pushed=db.bindparam('_pushed'), lease=None), updates)
+        return sum(1 for u in updates if u['_state'] == BaiduPush.SUCCESS)
+
+    def _pause(self) -> None:
+        """暂停到第二天"""
+        tomorrow = datetime.now().date() + timedelta(days=1)
+        self.paused_until = datetime(tomorrow.year, tomorrow.month, tomorrow.day)
+
+    def _ensure_thread(self) -> None:
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._thread = threading.Thread(target=self._run, name='h3blog-baidu-push', daemon=True)
+            self._thread.start()
+
+    def _run(self) -> None:
+        while True:
+            self._event.wait(float(self.app.config['H3BLOG_BAIDU_PUSH_POLL_INTERVAL']))
+            self._event.clear()
+            try:
+                self.process()
+            except Exception as e:
+                self.app.logger.error('百度推送失败: %s' % e)
@@ -0,0 +1,166 @@
+import hashlib
+import io
+import json
+import os
+import threading
+import time
+import requests
+from flask import abort, redirect, request
+
+# 接口超时时间
+TIMEOUT = 5
+# 获取失败后至少等待这个时间再重试
+RETRY_AFTER = 60
+
+
+class BingWallpaper(object):
+    """
+    bing 每日壁纸
+
+    壁纸下载后保存在 H3BLOG_CACHE_PATH/bing，按 H3BLOG_IMAGE_WIDTHS 生成缩小的图片，
+    全部保存在内存中，/bing_bg 直接返回(?w=640 返回缩小的图片)。
+    超过 H3BLOG_BING_REFRESH 秒后仍然返回已有的壁纸，同时在后台线程重新获取，
+    只有第一次还没有壁纸时等待下载。H3BLOG_BING_REDIRECT 为 1 时跳转到 bing 的图片地址。
+    H3BLOG_BING_URL 可以指向 app.util.fake_server 中的模拟接口用于测试。
+    """
+    def __init__(self) -> None:
+        self.app = None
+        self._session = requests.Session()
+        self._current = None
+        self._loaded = False
+        self._refreshing = None
+        self._failed_at = 0
+        self._lock = threading.Lock()
+
+    def init_app(self, app) -> None:
+        self.app = app
+
+    @property
+    def path(self) -> str:
+        return os.path.join(self.app.config['H3BLOG_CACHE_PATH'], 'bing')
+
+    def current(self, wait: bool = True) -> dict:
+        """
+        当前的壁纸，过期时在后台刷新
+        还没有壁纸时 wait 为 True 则等待下载，失败返回 None
+        """
+        if not self._loaded:
+            with self._lock:
+                if not self._loaded:
+                    self._current = self._load()
+                    self._loaded = True
+        current = self._current
+        now = time.time()
+        if now - self._failed_at < RETRY_AFTER:
+            return current
+        if current is None or now - current['fetched'] > int(self.app.config['H3BLOG_BING_REFRESH']):
+            thread = self.refresh_async()
+            if current is None and wait:
+                thread.join(TIMEOUT * 3)
+                current = self._current
+        return current
+
+    def refresh_async(self) -> threading.Thread:
+        """在后台线程刷新，正在刷新时不重复刷新"""
+        with self._lock:
+            if self._refreshing is None or not self._refreshing.is_alive():
+                self._refreshing = threading.Thread(target=self._refresh_quietly, name='h3blog-bing', daemon=True)
+                self._refreshing.start()
+            return self._refreshing
+
+    def _refresh_quietly(self) -> None:
+        try:
+            self.refresh()
+        except Exception as e:
+            self._failed_at = time.time()
+            self.app.logger.warning('获取bing壁纸失败: %s' % e)
+
+    def refresh(self) -> dict:
+        """获取今天的壁纸，和现在的壁纸相同时不重复下载"""
+        base = self.app.config['H3BLOG_BING_URL'].rstrip('/')
+        resp = self._session.get(base + '/HPImageArchive.aspx',
+                                 params={'format': 'js', 'idx': 0, 'n': 1}, timeout=TIMEOUT)
+        resp.raise_for_status()
+        image = resp.json()['images'][0]
+        url = image['url'] if image['url'].startswith('http') else base + image['url']
+        current = self._current
+        if current is not None and current['url'] == url:
+            # 保存获取时间，重启后不会马上重新获取
+            current = dict(current, fetched=time.time())
+            self._save_meta(current)
+        else:
+            resp = self._session.get(url, timeout=TIMEOUT)
+            resp.raise_for_status()
+            current = self._store(url, image.get('startdate', ''), resp.content)
+        self._current = current
+        return current
+
+    def _store(self, url: str, date: str, data: bytes) -> dict:
+        """保存壁纸和缩小的图片，返回内存中的壁纸"""
+        from PIL import Image
+        etag = hashlib.sha256(data).hexdigest()[:16]
+        images = {0: data}
+        with Image.open(io.BytesIO(data)) as im:
+            im = im.convert('RGB')
+            for width in self.app.config['H3BLOG_IMAGE_WIDTHS']:
+                if width < im.width:
+                    b = io.BytesIO()
+                    im.resize((width, max(1, round(im.height * width / im.width))), Image.LANCZOS). \
+                        save(b, 'JPEG', quality=int(self.app.config['H3BLOG_IMAGE_QUALITY']))
+                    images[width] = b.getvalue()
+        os.makedirs(self.path, exist_ok=True)
+        files = {}
+        for width, content in images.items():
+            files[width] = '%s-%s.%d.jpg' % (date, etag, width)
+            with open(os.path.join(self.path, files[width]), 'wb') as f:
+                f.write(content)
+        meta = {'url': url, 'date': date, 'etag': etag, 'fetched': time.time(), 'files': files}
+        self._save_meta(meta)
+        # 删除以前的壁纸
+        keep = set(files.values())
+        for name in os.listdir(self.path):
+            if name.endswith('.jpg') and name not in keep:
+                os.remove(os.path.join(self.path, name))
+        return dict(meta, images=images)
+
+    def _save_meta(self, current: dict) -> None:
+        meta = dict((k, current[k]) for k in ('url', 'date', 'etag', 'fetched', 'files'))
+        tmp = os.path.join(self.path, 'latest.json.%d-%d.tmp' % (os.getpid(), threading.get_ident()))
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump(meta, f)
+        os.replace(tmp, os.path.join(self.path, 'latest.json'))
+
+    def _load(self) -> dict:
+        """读取上次保存的壁纸，重启后不用重新下载"""
+        try:
+            with open(os.path.join(self.path, 'latest.json'), encoding='utf-8') as f:
+                meta = json.load(f)
+            images = {}
+            for width, name in meta['files'].items():
+                with open(os.path.join(self.path, name), 'rb') as f:
+                    images[int(width)] = f.read()
+            return dict(meta, images=images)
+        except (OSError, ValueError, KeyError):
+            return None
+
+    def send(self):
+        '''
+        获取背景图片
+        '''
+        current = self.current()
+        if current is None:
+            abort(503)
+        if self.app.config['H3BLOG_BING_REDIRECT']:
+            return redirect(current['url'])
+        width = request.args.get('w', 0, type=int)
+        images = current['images']
+        if width > 0:
+            widths = sorted(w for w in images if w >= width)
+            width = widths[0] if widths else 0
+        else:
+            width = 0
+        response = self.app.response_class(images[width], mimetype='image/jpeg')
+        response.set_etag('%s-%d' % (current['etag'], width))
+        response.cache_control.public = True
+        response.cache_control.max_age = int(self.app.config['H3BLOG_BING_REFRESH'])
+        return response.make_conditional(request)
@@ -0,0 +1,131 @@
+import struct
+import zlib
+from werkzeug.http import parse_accept_header
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# 需要压缩的响应类型
+COMPRESS_MIMETYPES = frozenset([
+    'text/html', 'text/css', 'text/plain', 'text/xml', 'text/javascript',
+    'application/javascript', 'application/json', 'application/xml', 'image/svg+xml',
+])
+# gzip 头：没有文件名和修改时间
+_GZIP_HEADER = b'\x1f\x8b\x08\x00\x00\x00\x00\x00\x00\xff'
+# deflate 结束块
+_DEFLATE_END = zlib.compressobj(9, zlib.DEFLATED, -zlib.MAX_WBITS).flush(zlib.Z_FINISH)
+
+
+def compressible(content_type: str) -> bool:
+    return (content_type or '').split(';')[0].strip().lower() in COMPRESS_MIMETYPES
+
+
+def choose_encoding(accept_encoding: str) -> str:
+    """根据 Accept-Encoding 选择压缩方式，不压缩时返回 None"""
+    accept = parse_accept_header(accept_encoding)
+    if brotli is not None and accept['br']:
+        return 'br'
+    if accept['gzip']:
+        return 'gzip'
+    return None
+
+
+def compress(data: bytes, encoding: str, level: int = 6) -> bytes:
+    if encoding == 'br':
+        return brotli.compress(data, quality=min(level, 11))
+    return _GZIP_HEADER + deflate_part(data, level) + _DEFLATE_END + \
+        struct.pack('<LL', zlib.crc32(data) & 0xffffffff, len(data) & 0xffffffff)
+
+
+def deflate_part(data: bytes, level: int = 6) -> bytes:
+    """
+    把一段内容压缩为独立的 deflate 块(不引用前面的内容、不结束数据流)，
+    多段可以直接拼接，用于页面中不变的部分只压缩一次
+    """
+    c = zlib.compressobj(level, zlib.DEFLATED, -zlib.MAX_WBITS)
+    return c.compress(data) + c.flush(zlib.Z_SYNC_FLUSH)
+
+
+def gzip_join(parts: list, deflated: list, level: int = 6) -> bytes:
+    """
+    拼接 gzip 数据，parts 为原始内容，deflated 为对应的已压缩内容，
+    没有预先压缩的部分(None)在这里压缩
+    """
+    crc = 0
+    size = 0
+    chunks = [_GZIP_HEADER]
+    for data, d in zip(parts, deflated):
+        if not data:
+            continue
+        crc = zlib.crc32(data, crc)
+        size += len(data)
+        chunks.append(d if d is not None else deflate_part(data, level))
+    chunks.append(_DEFLATE_END)
+    chunks.append(struct.pack('<LL', crc & 0xffffffff, size & 0xffffffff))
+    return b''.join(chunks)
+
+
+class CompressMiddleware(object):
+    """
+    压缩响应的 WSGI 中间件
+    只压缩文本类型、没有 Content-Encoding 的完整响应，
+    页面缓存已经压缩好的响应直接发送
+    """
+    def __init__(self, wsgi_app, level: int = 6, min_size: int = 500) -> None:
+        self.wsgi_app = wsgi_app
+        self.level = level
+        self.min_size = min_size
+
+    def __call__(self, environ, start_response):
+        encoding = choose_encoding(environ.get('HTTP_ACCEPT_ENCODING', ''))
+        if encoding is None or environ.get('REQUEST_METHOD') == 'HEAD':
+            return self.wsgi_app(environ, start_response)
+
+        captured = []
+        def _start_response(status, headers, exc_info=None):
+            captured[:] = [status, headers, exc_info]
+            return lambda data: None  # 不支持 write()，本程序没有使用
+
+        app_iter = self.wsgi_app(environ, _start_response)
+        status, headers, exc_info = captured
+        names = dict((k.lower(), v) for k, v in headers)
+        if not status.startswith('200') or 'content-encoding' in names or \
+                not compressible(names.get('content-type')) or \
+                'content-length' not in names or int(names['content-length']) < self.min_size:
+            start_response(status, headers, exc_info)
+            return app_iter
+        try:
+            data = b''.join(app_iter)
+        finally:
+            if hasattr(app_iter, 'close'):
+                app_iter.close()
+        data = compress(data, encoding, self.level)
+        headers = [(k, v) for k, v in headers if k.lower() not in ('content-length', 'etag', 'vary')]
+        headers.append(('Content-Encoding', encoding))
+        headers.append(('Content-Length', str(len(data))))
+        vary = names.get('vary')
+        headers.append(('Vary', vary + ', Accept-Encoding' if vary else 'Accept-Encoding'))
+        etag = names.get('etag')
+        if etag:
+            # 压缩后的内容和原内容不同，强 ETag 改为弱 ETag
+            headers.append(('ETag', etag if etag.startswith('W/') else 'W/' + etag))
+        start_response(status, headers, exc_info)
+        return [data]
+
+
+class Compress(object):
+    """
+    响应压缩，H3BLOG_COMPRESS 为 1 时启用
+    前面有 nginx 等服务器压缩时不需要启用
+    """
+    def __init__(self) -> None:
+        self.app = None
+        self.enabled = False
+
+    def init_app(self, app) -> None:
+        self.app = app
+        self.enabled = bool(app.config['H3BLOG_COMPRESS'])
+        if self.enabled:
+            app.wsgi_app = CompressMiddleware(app.wsgi_app, int(app.config['H3BLOG_COMPRESS_LEVEL']))
@@ -0,0 +1,139 @@
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from werkzeug.security import safe_join
+
+# Pillow 保存图片使用的格式
+_FORMATS = {
+    'jpg': 'JPEG',
+    'jpeg': 'JPEG',
+    'png': 'PNG',
+    'webp': 'WEBP',
+}
+
+
+class ImageDerivatives(object):
+    """
+    上传图片的缩略图
+
+    按 H3BLOG_IMAGE_WIDTHS 中的宽度生成原格式和 WebP 两种缩略图，
+    保存在 H3BLOG_CACHE_PATH/images 下，文件名为 <原文件名>.<宽度>.<格式>。
+    上传后交给后台线程池生成，
+    访问 /admin/uploads/<文件名>?w=320 时返回合适的缩略图，
+    没有生成过的(比如以前上传的图片)在第一次访问时生成。
+    图片损坏、过大等无法生成时返回原图，同一个文件不再重复尝试。
+    """
+    def __init__(self) -> None:
+        self.app = None
+        self._executor = None
+        self._lock = threading.Lock()
+        # 生成失败的原图 (文件, 修改时间)
+        self._failed = set()
+
+    def init_app(self, app) -> None:
+        self.app = app
+
+    @property
+    def path(self) -> str:
+        return os.path.join(self.app.config['H3BLOG_CACHE_PATH'], 'images')
+
+    @property
+    def executor(self) -> ThreadPoolExecutor:
+        if self._executor is None:
+            with self._lock:
+                if self._executor is None:
+                    self._executor = ThreadPoolExecutor(
+                        max_workers=int(self.app.config['H3BLOG_IMAGE_WORKERS']),
+                        thread_name_prefix='h3blog-images')
+        return self._executor
+
+    def choose_width(self, width: int) -> int:
+        """不小于请求宽度的最小缩略图宽度，超过最大宽度时返回最大宽度"""
+        widths = sorted(self.app.config['H3BLOG_IMAGE_WIDTHS'])
+        for w in widths:
+            if w >= width:
+                return w
+        return widths[-1]
+
+    def variant_name(self, filename: str, width: int, fmt: str) -> str:
+        return '{}.{}.{}'.format(filename, width, fmt)
+
+    def original_path(self, filename: str) -> str:
+        return safe_join(self.app.config['H3BLOG_UPLOAD_PATH'], filename)
+
+    def variant_path(self, filename: str, width: int, fmt: str) -> str:
+        return safe_join(self.path, self.variant_name(filename, width, fmt))
+
+    def source_format(self, filename: str) -> str:
+        """可以生成缩略图的原图格式，不支持时返回 None(比如 gif 动图)"""
+        ext = os.path.splitext(filename)[1][1:].lower()
+        return ext if ext in _FORMATS else None
+
+    def get(self, filename: str, width: int, webp: bool = False) -> tuple:
+        """
+        返回缩略图的 (目录, 文件名)，不存在时生成
+        原图不存在、格式不支持或者生成失败时返回 None
+        """
+        fmt = self.source_format(filename)
+        source = self.original_path(filename)
+        if fmt is None or source is None or not os.path.isfile(source):
+            return None
+        width = self.choose_width(width)
+        if webp:
+            fmt = 'webp'
+        target = self.variant_path(filename, width, fmt)
+        if target is None:
+            return None
+        if not os.path.isfile(target):
+            key = (source, os.path.getmtime(source))
+            if key in self._failed:
+                return None
+            try:
+                self._generate(source, [(width, fmt, target)])
+            except Exception as e:
+                self._failed.add(key)
+                self.app.logger.error('生成缩略图失败 %s: %s' % (filename, e))
+                return None
+        return os.path.dirname(target), os.path.basename(target)
+
+    def _generate(self, source: str, variants: list) -> list:
+        """生成缩略图，variants 为 [(宽度, 格式, 文件), ...]，返回生成的 [宽度.格式]"""
+        from PIL import Image, ImageOps
+        quality = int(self.app.config['H3BLOG_IMAGE_QUALITY'])
+        done = []
+        with Image.open(source) as im:
+            im = ImageOps.exif_transpose(im)
+            for width, fmt, target in variants:
+                img = im
+                if im.width > width:
+                    img = im.resize((width, max(1, round(im.height * width / im.width))), Image.LANCZOS)
+                if _FORMATS[fmt] == 'JPEG' and img.mode not in ('RGB', 'L'):
+                    img = img.convert('RGB')
+                os.makedirs(os.path.dirname(target), exist_ok=True)
+                tmp = '%s.%d-%d.tmp' % (target, os.getpid(), threading.get_ident())
+                img.save(tmp, _FORMATS[fmt], quality=quality, optimize=True)
+                os.replace(tmp, target)
+                done.append('{}.{}'.format(width, fmt))
+        return done
+
+    def generate_all(self, filename: str) -> list:
+        """生成全部尺寸的缩略图"""
+        fmt = self.source_format(filename)
+        source = self.original_path(filename)
+        if fmt is None or source is None or not os.path.isfile(source):
+            return []
+        variants = []
+        for width in self.app.config['H3BLOG_IMAGE_WIDTHS']:
+            for f in (fmt, 'webp'):
+                variants.append((width, f, self.variant_path(filename, width, f)))
+        return self._generate(source, variants)
+
+    def submit(self, filename: str):
+        """上传后在后台生成缩略图"""
+        return self.executor.submit(self._process, filename)
+
+    def _process(self, filename: str) -> None:
+        try:
+            self.generate_all(filename)
+        except Exception as e:
+            self.app.logger.error('生成缩略图失败 %s: %s' % (filename, e))
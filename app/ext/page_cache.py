@@ -0,0 +1,330 @@
+import hashlib
+import os
+import re
+import secrets
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+from functools import wraps
+from flask import current_app, g, request, session
+from markupsafe import Markup
+
+# 缓存页面中csrf令牌的占位符，命中缓存时替换为当前会话的令牌
+CSRF_PLACEHOLDER = '__h3blog_csrf_token_%s__'
+# 片段占位符，命中缓存时替换为片段当前的渲染结果
+FRAGMENT_PLACEHOLDER = '<!--h3blog-fragment:%s:%d-->'
+# ETag 按时间分段，页面中的csrf令牌会过期，每段时间后让浏览器重新获取页面
+VALIDATOR_PERIOD = 1800
+
+
+def _fragment_re(nonce: str):
+    return re.compile(rb'<!--h3blog-fragment:' + re.escape(nonce.encode()) + rb':(\d+)-->')
+
+
+def _dynamic_re(nonce: str):
+    """缓存页面中每次请求都不同的部分：片段和csrf令牌"""
+    return re.compile(_fragment_re(nonce).pattern + b'|' + re.escape((CSRF_PLACEHOLDER % nonce).encode()))
+
+
+class PageCache(object):
+    """
+    前台页面缓存
+
+    缓存完整的响应内容，缓存键由 endpoint、路由参数、查询参数、
+    前端模板和访问者身份(匿名/登录用户)组成。
+    每个缓存条目带有依赖标签，比如 ``article:1``、``category:2``、``tag:3``，
+    后台保存内容时按标签清除受影响的页面；
+    所有页面都带有 ``layout`` 标签(导航、侧边栏依赖的分类、标签、设置)。
+    侧边栏中的热门、最新文章不单独追踪，依靠过期时间刷新。
+
+    页面中和访问者有关的小片段(登录状态、隐藏内容等)可以用 ``cache_fragment(name, *args)``
+    输出，缓存时只保存占位符和参数，每次请求由 ``fragment(name)`` 注册的函数重新渲染，
+    这样的页面可以使用 ``cached(per_user=False)`` 所有访问者共用一份缓存。
+    占位符中带有每次渲染随机生成的标识，评论等页面内容无法伪造占位符。
+
+    启用响应压缩(H3BLOG_COMPRESS)时，页面中不变的部分在缓存时压缩一次，
+    命中缓存时只压缩片段和csrf令牌，再拼接为完整的 gzip 响应。
+
+    清除缓存时同时更新缓存目录中的 content_version 文件，它的修改时间是全站内容版本，
+    用于生成 ETag/Last-Modified；其他进程发现版本变化时清空自己的缓存。
+    """
+    def __init__(self) -> None:
+        self.app = None
+        self._version = None
+        self._fragments = {}
+        self._entries = OrderedDict()
+        self._tags = {}
+        self._lock = threading.Lock()
+
+    def init_app(self, app) -> None:
+        self.app = app
+        app.add_template_global(self.render_fragment, 'cache_fragment')
+
+    @property
+    def timeout(self) -> int:
+        return int(self.app.config.get('H3BLOG_PAGE_CACHE_TIMEOUT', 0) or 0)
+
+    def _variant(self, per_user: bool = True) -> str:
+        from flask_login import current_user
+        variant = 'anon'
+        if not per_user:
+            variant = 'shared'
+        elif current_user.is_authenticated:
+            variant = 'user:%s' % current_user.id
+        if request.cookies.get('toggleTheme') == 'dark':
+            variant += ':dark'
+        return variant
+
+    def _make_key(self, per_user: bool = True) -> tuple:
+        view_args = tuple(sorted((request.view_args or {}).items()))
+        args = tuple(sorted(request.args.items(multi=True)))
+        return (request.host, request.endpoint, view_args, args,
+                current_app.config['H3BLOG_TEMPLATE'], self._variant(per_user))
+
+    def _cacheable(self) -> bool:
+        return self.timeout > 0 and request.method == 'GET' and \
+            '_flashes' not in session
+
+    def tag(self, *tags) -> None:
+        """给当前正在缓存的页面添加依赖标签"""
+        page_tags = g.get('page_cache_tags')
+        if page_tags is not None:
+            page_tags.update(tags)
+
+    def fragment(self, name: str):
+        """注册片段渲染函数，参数为 cache_fragment() 传入的参数，返回 html"""
+        def decorator(f):
+            self._fragments[name] = f
+            return f
+        return decorator
+
+    def render_fragment(self, name: str, *args) -> Markup:
+        """
+        渲染片段，模板中为 cache_fragment(name, *args)
+        页面正在缓存时输出占位符，参数保存在缓存中，所以参数需要是不可变的简单数据
+        """
+        fragments = g.get('page_cache_fragments')
+        if fragments is None:
+            return Markup(self._fragments[name](*args))
+        fragments.append((name, args))
+        return Markup(FRAGMENT_PLACEHOLDER % (g.page_cache_nonce, len(fragments) - 1))
+
+    def on_hit(self, f, *args) -> None:
+        """当前页面命中缓存时需要执行的函数，比如累加浏览量"""
+        callbacks = g.get('page_cache_callbacks')
+        if callbacks is not None:
+            callbacks.append((f, args))
+        f(*args)
+
+    def _fill(self, body: bytes, fragments: list, nonce: str) -> bytes:
+        if not fragments:
+            return body
+        def repl(m):
+            name, args = fragments[int(m.group(1))]
+            return str(self._fragments[name](*args)).encode('utf-8')
+        return _fragment_re(nonce).sub(repl, body)
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry['expires'] < time.time():
+                self._remove(key)
+                return None
+            self._entries.move_to_end(key)
+            return entry
+
+    def set(self, key, entry: dict, tags) -> None:
+        entry['tags'] = frozenset(tags)
+        entry['expires'] = time.time() + self.timeout
+        max_entries = int(self.app.config.get('H3BLOG_PAGE_CACHE_MAX_ENTRIES', 1000))
+        with self._lock:
+            self._remove(key)
+            self._entries[key] = entry
+            for t in entry['tags']:
+                self._tags.setdefault(t, set()).add(key)
+            while len(self._entries) > max_entries:
+                self._remove(next(iter(self._entries)))
+
+    def _remove(self, key) -> None:
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return
+        for t in entry['tags']:
+            keys = self._tags.get(t)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._tags[t]
+
+    def purge(self, *tags) -> None:
+        """清除带有任一标签的缓存页面"""
+        with self._lock:
+            for t in tags:
+                for key in list(self._tags.get(t, ())):
+                    self._remove(key)
+        self._bump_version()
+
+    def clear(self) -> None:
+        self._clear()
+        self._bump_version()
+
+    def _clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._tags.clear()
+
+    @property
+    def _version_file(self) -> str:
+        return os.path.join(self.app.config['H3BLOG_CACHE_PATH'], 'content_version')
+
+    def _bump_version(self) -> None:
+        filename = self._version_file
+        try:
+            os.makedirs(os.path.dirname(filename), exist_ok=True)
+            with open(filename, 'w') as f:
+                f.write(str(time.time()))
+            self._version = os.stat(filename).st_mtime
+        except OSError as e:
+            self.app.logger.warning('更新内容版本失败: %s' % e)
+
+    def content_version(self) -> float:
+        """全站内容版本，即最后一次修改内容的时间戳"""
+        try:
+            version = os.stat(self._version_file).st_mtime
+        except OSError:
+            self._bump_version()
+            return self._version or 0
+        if version != self._version:
+            if self._version is not None:
+                # 其他进程修改了内容
+                self._clear()
+            self._version = version
+        return version
+
+    def validators(self) -> tuple:
+        """当前请求页面的 (ETag, Last-Modified)"""
+        version = self.content_version()
+        period = int(time.time() // VALIDATOR_PERIOD) * VALIDATOR_PERIOD
+        key = repr((version, period) + self._make_key())
+        etag = hashlib.md5(key.encode('utf-8')).hexdigest()
+        return etag, datetime.utcfromtimestamp(int(max(version, period)))
+
+    def not_modified(self):
+        """
+        浏览器缓存的页面仍然有效时返回304响应，否则返回 None
+        在渲染页面之前调用
+        """
+        if request.method != 'GET':
+            return None
+        etag, last_modified = self.validators()
+        if request.if_none_match:
+            if not request.if_none_match.contains_weak(etag):
+                return None
+        elif not request.if_modified_since or request.if_modified_since < last_modified:
+            return None
+        response = current_app.response_class(status=304)
+        self.add_validators(response, etag, last_modified)
+        return response
+
+    def add_validators(self, response, etag: str = None, last_modified: datetime = None) -> None:
+        """
+        给响应添加 ETag、Last-Modified，浏览器每次使用前需要验证
+        页面中的csrf令牌每次都不同，所以使用弱 ETag
+        """
+        if etag is None:
+            etag, last_modified = self.validators()
+        response.set_etag(etag, weak=True)
+        response.last_modified = last_modified
+        response.cache_control.no_cache = True
+
+    def _from_entry(self, entry: dict):
+        from flask_wtf.csrf import generate_csrf
+        from app.ext.compress import gzip_join
+        for f, args in entry['callbacks']:
+            f(*args)
+        parts = []
+        for part in entry['parts']:
+            if isinstance(part, bytes):
+                parts.append(part)
+            elif part < 0:
+                parts.append(generate_csrf().encode())
+            else:
+                name, args = entry['fragments'][part]
+                parts.append(str(self._fragments[name](*args)).encode('utf-8'))
+        response = current_app.response_class(status=entry['status'],
+                                              content_type=entry['content_type'])
+        if entry['deflated'] is not None and request.accept_encodings['gzip']:
+            response.set_data(gzip_join(parts, entry['deflated']))
+            response.headers['Content-Encoding'] = 'gzip'
+        else:
+            response.set_data(b''.join(parts))
+        if entry['deflated'] is not None:
+            response.vary.add('Accept-Encoding')
+        return response
+
+    def _to_entry(self, response) -> dict:
+        from app.ext.compress import compressible, deflate_part
+        body = response.get_data()
+        nonce = g.page_cache_nonce
+        token = g.get(current_app.config.get('WTF_CSRF_FIELD_NAME', 'csrf_token'))
+        if token:
+            body = body.replace(token.encode(), (CSRF_PLACEHOLDER % nonce).encode())
+        # 不变的内容为 bytes，片段为片段序号，csrf令牌为 -1
+        parts = []
+        pos = 0
+        for m in _dynamic_re(nonce).finditer(body):
+            parts.append(body[pos:m.start()])
+            parts.append(int(m.group(1)) if m.group(1) is not None else -1)
+            pos = m.end()
+        parts.append(body[pos:])
+        deflated = None
+        if self.app.config['H3BLOG_COMPRESS'] and compressible(response.content_type):
+            level = int(self.app.config['H3BLOG_COMPRESS_LEVEL'])
+            deflated = [deflate_part(p, level) if isinstance(p, bytes) and p else None for p in parts]
+        return {
+            'parts': parts,
+            'deflated': deflated,
+            'fragments': g.page_cache_fragments,
+            'callbacks': g.page_cache_callbacks,
+            'status': response.status_code,
+            'content_type': response.content_type,
+        }
+
+    def cached(self, *tags, per_user: bool = True):
+        """
+        缓存视图函数的响应
+        tags 为页面的固定依赖标签，视图内可以调用 page_cache.tag() 追加
+        per_user 为 False 时登录用户和匿名访问者共用缓存，页面中和用户有关的内容需要使用片段
+        """
+        def decorator(f):
+            @wraps(f)
+            def decorated_function(*args, **kwargs):
+                if not self._cacheable():
+                    return f(*args, **kwargs)
+                # 其他进程修改了内容时清空缓存
+                self.content_version()
+                key = self._make_key(per_user)
+                entry = self.get(key)
+                if entry is not None:
+                    return self._from_entry(entry)
+                g.page_cache_tags = set(tags)
+                g.page_cache_tags.add('layout')
+                g.page_cache_fragments = []
+                g.page_cache_callbacks = []
+                g.page_cache_nonce = secrets.token_hex(8)
+                try:
+                    response = current_app.make_response(f(*args, **kwargs))
+                    if response.status_code == 200 and not response.direct_passthrough:
+                        self.set(key, self._to_entry(response), g.page_cache_tags)
+                finally:
+                    fragments = g.pop('page_cache_fragments')
+                    g.pop('page_cache_callbacks')
+                    nonce = g.pop('page_cache_nonce')
+                if fragments:
+                    response.set_data(self._fill(response.get_data(), fragments, nonce))
+                return response
+            return decorated_function
+        return decorator
@@ -0,0 +1,127 @@
+import re
+from collections import Counter
+from typing import Iterator
+
+# 英文/数字单词 或 连续的中日韩字符
+_token_re = re.compile(r'[0-9a-z_]+|[\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff]+')
+
+MAX_TERM_LENGTH = 64
+MAX_TERM_FREQUENCY = 10
+
+
+def tokenize(text: str, for_query: bool = False) -> Iterator[str]:
+    """
+    分词，英文按单词切分，中文按二元组(bigram)切分
+    建索引时中文同时输出单字，以支持单字搜索；
+    查询时只有单独一个汉字才按单字匹配
+    """
+    if not text:
+        return
+    for m in _token_re.finditer(text.lower()):
+        word = m.group()
+        if word[0] < '\u3400':
+            yield word[:MAX_TERM_LENGTH]
+            continue
+        if len(word) == 1:
+            yield word
+            continue
+        if not for_query:
+            for c in word:
+                yield c
+        for i in range(len(word) - 1):
+            yield word[i:i + 2]
+
+
+class SearchIndex(object):
+    """
+    文章全文检索倒排索引
+
+    标题、摘要、标签和去除html标签后的正文分词后写入 search_term 表，
+    搜索时只查询索引表并按权重排序，不再扫描 article.content_html
+    """
+    # 各字段的权重
+    FIELD_WEIGHTS = (
+        ('title', 10),
+        ('tags', 5),
+        ('summary', 3),
+        ('body', 1),
+    )
+
+    def init_app(self, app) -> None:
+        self.app = app
+
+    def _article_fields(self, article) -> dict:
+        from app.util import strip_tags
+        return {
+            'title': article.title or '',
+            'tags': ' '.join([t.name for t in article.tags]),
+            'summary': article.summary or '',
+            'body': strip_tags(article.content_html or ''),
+        }
+
+    def _article_terms(self, article) -> dict:
+        """计算文章每个词的权重"""
+        fields = self._article_fields(article)
+        weights = Counter()
+        for name, weight in self.FIELD_WEIGHTS:
+            for term, tf in Counter(tokenize(fields[name])).items():
+                weights[term] += weight * min(tf, MAX_TERM_FREQUENCY)
+        return weights
+
+    def index_article(self, article) -> None:
+        """更新文章索引，需要调用方提交事务"""
+        from app.ext import db
+        from app.models import SearchTerm
+        self.remove_article(article.id)
+        rows = [{'term': term, 'article_id': article.id, 'weight': weight}
+                for term, weight in self._article_terms(article).items()]
+        if rows:
+            db.session.execute(SearchTerm.__table__.insert(), rows)
+
+    def remove_article(self, article_id: int) -> None:
+        from app.ext import db
+        from app.models import SearchTerm
+        db.session.execute(SearchTerm.__table__.delete().
+                           where(SearchTerm.article_id == article_id))
+
+    def rebuild(self, chunk_size: int = 200) -> int:
+        """重建全部文章索引，返回索引的文章数量"""
+        from app.ext import db
+        from app.models import Article, SearchTerm
+        db.session.execute(SearchTerm.__table__.delete())
+        count = 0
+        last_id = 0
+        while True:
+            articles = Article.query.options(db.undefer_group('body')). \
+                filter(Article.id > last_id). \
+                order_by(Article.id.asc()).limit(chunk_size).all()
+            if not articles:
+                break
+            for a in articles:
+                self.index_article(a)
+            last_id = articles[-1].id
+            count += len(articles)
+            db.session.commit()
+            db.session.expunge_all()
+        return count
+
+    def search(self, query: str, page: int = 1, per_page: int = 10):
+        """
+        搜索已发布文章，按相关度排序分页返回
+        所有关键词都需要命中
+        """
+        from app.ext import db
+        from app.models import Article, SearchTerm
+        terms = list(set(tokenize(query, for_query=True)))
+        if not terms:
+            terms = ['']
+        score = db.func.sum(SearchTerm.weight).label('score')
+        hits = db.session.query(SearchTerm.article_id, score). \
+            filter(SearchTerm.term.in_(terms)). \
+            group_by(SearchTerm.article_id). \
+            having(db.func.count(SearchTerm.term) == len(terms)). \
+            subquery()
+        return Article.query.join(hits, Article.id == hits.c.article_id). \
+            filter(Article.state == 1). \
+            order_by(hits.c.score.desc(), Article.timestamp.desc()). \
+            paginate(page, per_page=per_page, error_out=False)
@@ -0,0 +1,163 @@
+import os
+import threading
+from datetime import datetime
+from xml.sax.saxutils import escape
+from flask import current_app, url_for, send_from_directory
+
+SITEMAP_INDEX = 'sitemap.xml'
+SITEMAP_FILE = 'sitemap-{}.xml'
+
+
+class Sitemap(object):
+    """
+    sitemap生成
+
+    文章、分类、标签按行流式读取，每个sitemap文件最多 SITEMAP_MAX_URL_COUNT 条url，
+    由 sitemap.xml 索引文件汇总。生成的文件缓存在磁盘上，
+    后台修改内容时调用 invalidate() 删除索引文件，下次访问时重新生成。
+    生成过程中内容又发生变化时丢弃本次结果重新生成，不会写入过期的索引。
+    """
+    def __init__(self) -> None:
+        self.app = None
+        self._lock = threading.Lock()
+        self._generation = 0
+
+    def init_app(self, app) -> None:
+        self.app = app
+
+    @property
+    def path(self) -> str:
+        return os.path.join(self.app.config['H3BLOG_CACHE_PATH'], 'sitemap')
+
+    def invalidate(self) -> None:
+        """内容发生变化，删除sitemap索引等待重新生成"""
+        self._generation += 1
+        try:
+            os.remove(os.path.join(self.path, SITEMAP_INDEX))
+        except FileNotFoundError:
+            pass
+
+    def send_file(self, filename: str):
+        """返回sitemap文件，不存在时先生成"""
+        if not os.path.exists(os.path.join(self.path, SITEMAP_INDEX)):
+            self.generate()
+        return send_from_directory(self.path, filename, mimetype='application/xml')
+
+    def _base_url(self) -> str:
+        domain = self.app.config['H3BLOG_DOMAIN']
+        if domain.startswith('http://') or domain.startswith('https://'):
+            return domain
+        return '{}://{}'.format(self.app.config['SITEMAP_URL_SCHEME'], domain)
+
+    def _urls(self):
+        """
+        依次返回 (endpoint, 参数, 最后修改时间, 更新频率, 权重)
+        """
+        from app.ext import db
+        from app.models import Article, Category, Tag, article_tag
+        latest = db.session.query(db.func.max(Article.timestamp)). \
+            filter(Article.state == 1).scalar()
+        #首页
+        yield 'main.index', {}, latest, 'always', 1.0
+        #关于我
+        yield 'main.about', {}, None, 'monthly', 0.5
+        #分类
+        category_lastmod = dict(db.session.query(Article.category_id, db.func.max(Article.timestamp)).
+                                filter(Article.state == 1).group_by(Article.category_id))
+        for category_id, name in db.session.query(Category.id, Category.name).yield_per(1000):
+            lastmod = category_lastmod.get(category_id)
+            yield 'main.category', {'c': name}, lastmod, 'daily', 0.9
+            yield 'main.category_hot', {'c': name}, lastmod, 'daily', 0.9
+        #标签
+        yield 'main.tags', {}, None, 'daily', 0.9
+        tag_lastmod = dict(db.session.query(article_tag.c.tag_id, db.func.max(Article.timestamp)).
+                           join(Article, Article.id == article_tag.c.article_id).
+                           filter(Article.state == 1).group_by(article_tag.c.tag_id))
+        for tag_id, code in db.session.query(Tag.id, Tag.code).yield_per(1000):
+            lastmod = tag_lastmod.get(tag_id)
+            yield 'main.tag', {'t': code}, lastmod, 'daily', 0.9
+            yield 'main.tag_hot', {'t': code}, lastmod, 'daily', 0.9
+        #文章
+        articles = db.session.query(Article.name, Article.timestamp). \
+            filter(Article.state == 1).order_by(Article.id.asc()).yield_per(1000)
+        for name, timestamp in articles:
+            yield 'main.article', {'name': name}, timestamp, 'monthly', 0.8
+
+    def _write_url(self, f, loc: str, lastmod: datetime = None, changefreq: str = None,
+                   priority: float = None) -> None:
+        f.write('<url><loc>{}</loc>'.format(escape(loc)))
+        if lastmod:
+            f.write('<lastmod>{}</lastmod>'.format(lastmod.strftime('%Y-%m-%dT%H:%M:%S')))
+        if changefreq:
+            f.write('<changefreq>{}</changefreq>'.format(changefreq))
+        if priority is not None:
+            f.write('<priority>{}</priority>'.format(priority))
+        f.write('</url>\n')
+
+    def generate(self) -> int:
+        """生成全部sitemap文件，返回sitemap文件数量"""
+        with self._lock:
+            while True:
+                count = self._generate(self._generation)
+                if count is not None:
+                    return count
+
+    def _generate(self, generation: int) -> int:
+        """生成sitemap文件，期间调用过 invalidate() 时不写入索引并返回 None"""
+        with self.app.test_request_context(base_url=self._base_url()):
+            os.makedirs(self.path, exist_ok=True)
+            max_count = int(self.app.config['SITEMAP_MAX_URL_COUNT'])
+            suffix = '.{}-{}.tmp'.format(os.getpid(), threading.get_ident())
+            files = []
+            f = None
+            count = 0
+            for endpoint, values, lastmod, changefreq, priority in self._urls():
+                if f is None or count >= max_count:
+                    if f is not None:
+                        self._close(f)
+                    files.append(SITEMAP_FILE.format(len(files) + 1))
+                    f = self._open(os.path.join(self.path, files[-1] + suffix))
+                    count = 0
+                loc = url_for(endpoint, _external=True, **values)
+                self._write_url(f, loc, lastmod, changefreq, priority)
+                count += 1
+            self._close(f)
+
+            for filename in files:
+                os.replace(os.path.join(self.path, filename + suffix),
+                           os.path.join(self.path, filename))
+            self._remove_stale(files)
+
+            index = os.path.join(self.path, SITEMAP_INDEX)
+            now = datetime.now().strftime('%Y-%m-%dT%H:%M:%S')
+            with open(index + suffix, 'w', encoding='utf-8') as f:
+                f.write('<?xml version="1.0" encoding="UTF-8"?>\n')
+                f.write('<sitemapindex xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">\n')
+                for filename in files:
+                    loc = url_for('main.sitemap_page', page=filename[8:-4], _external=True)
+                    f.write('<sitemap><loc>{}</loc><lastmod>{}</lastmod></sitemap>\n'.
+                            format(escape(loc), now))
+                f.write('</sitemapindex>\n')
+            if generation != self._generation:
+                os.remove(index + suffix)
+                return None
+            os.replace(index + suffix, index)
+            current_app.logger.info('生成sitemap文件%d个' % len(files))
+            return len(files)
+
+    def _open(self, filename: str):
+        f = open(filename, 'w', encoding='utf-8')
+        f.write('<?xml version="1.0" encoding="UTF-8"?>\n')
+        f.write('<urlset xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">\n')
+        return f
+
+    def _close(self, f) -> None:
+        f.write('</urlset>\n')
+        f.close()
+
+    def _remove_stale(self, files: list) -> None:
+        """删除上次生成但本次不再需要的sitemap文件"""
+        for filename in os.listdir(self.path):
+            if filename.startswith('sitemap-') and filename.endswith('.xml') \
+                    and filename not in files:
+                os.remove(os.path.join(self.path, filename))
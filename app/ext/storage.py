@@ -0,0 +1,192 @@
+import os
+import queue
+import shutil
+import threading
+import time
+
+# 七牛上传凭证有效期
+QINIU_TOKEN_EXPIRES = 3600
+# 凭证剩余时间少于这个时间时重新生成
+QINIU_TOKEN_MARGIN = 300
+
+
+class StorageError(Exception):
+    pass
+
+
+class LocalStorage(object):
+    """本地存储，上传的文件已经在 H3BLOG_UPLOAD_PATH，不需要推送"""
+    remote = False
+
+    def put(self, key: str, localfile: str) -> str:
+        return None
+
+
+class QiniuStorage(object):
+    """七牛云存储，上传凭证在有效期内重复使用"""
+    remote = True
+
+    def __init__(self, access_key: str, secret_key: str, bucket: str, cdn_url: str) -> None:
+        self.access_key = access_key
+        self.secret_key = secret_key
+        self.bucket = bucket
+        self.cdn_url = cdn_url
+        self._auth = None
+        self._token = None
+        self._token_expires = 0
+        self._lock = threading.Lock()
+
+    def token(self) -> str:
+        with self._lock:
+            now = time.time()
+            if self._token is None or self._token_expires - now < QINIU_TOKEN_MARGIN:
+                from qiniu import Auth
+                if self._auth is None:
+                    self._auth = Auth(self.access_key, self.secret_key)
+                self._token = self._auth.upload_token(self.bucket, expires=QINIU_TOKEN_EXPIRES)
+                self._token_expires = now + QINIU_TOKEN_EXPIRES
+            return self._token
+
+    def put(self, key: str, localfile: str) -> str:
+        from qiniu import put_file
+        ret, info = put_file(self.token(), key, localfile)
+        if info.status_code == 401:
+            # 凭证失效，下次重新生成
+            self._token = None
+        if info.status_code != 200 or ret is None:
+            raise StorageError('七牛上传失败 %s: %s' % (info.status_code, info.error))
+        return self.cdn_url + ret.get('key')
+
+
+class FakeStorage(object):
+    """
+    模拟的对象存储，把文件复制到本地目录，用于测试和开发
+    failures 设置为 n 时接下来 n 次上传失败，用于测试重试
+    """
+    remote = True
+
+    def __init__(self, path: str, base_url: str) -> None:
+        self.path = path
+        self.base_url = base_url
+        self.failures = 0
+        self.puts = 0
+
+    def put(self, key: str, localfile: str) -> str:
+        self.puts += 1
+        if self.failures > 0:
+            self.failures -= 1
+            raise StorageError('模拟上传失败')
+        target = os.path.join(self.path, *key.split('/'))
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        shutil.copyfile(localfile, target)
+        return self.base_url + key
+
+
+class Storage(object):
+    """
+    图片存储
+
+    H3BLOG_UPLOAD_TYPE 选择存储方式：local(默认)、qiniu、fake(模拟的对象存储)。
+    上传的图片先保存在本地并返回本地地址，远程存储由后台线程推送，
+    推送成功后把 Picture.url 替换为 CDN 地址；失败时按
+    H3BLOG_STORAGE_RETRY_DELAY * 2^n 秒后重试，最多 H3BLOG_STORAGE_RETRIES 次。
+    重启时没有推送完的图片可以用 flask storage-push 重新推送。
+    """
+    def __init__(self) -> None:
+        self.app = None
+        self.pushed = 0
+        self.failed = 0
+        self._queue = queue.Queue()
+        self._thread = None
+        self._backends = {}
+        self._lock = threading.Lock()
+
+    def init_app(self, app) -> None:
+        self.app = app
+
+    def backend(self):
+        """
+        当前配置的存储，后台设置修改配置后会创建新的实例
+        """
+        config = self.app.config
+        upload_type = config.get('H3BLOG_UPLOAD_TYPE') or 'local'
+        if upload_type == 'qiniu':
+            key = (upload_type, config.get('QINIU_ACCESS_KEY'), config.get('QINIU_SECRET_KEY'),
+                   config.get('QINIU_BUCKET_NAME'), config.get('QINIU_CDN_URL'))
+        elif upload_type == 'fake':
+            key = (upload_type, config['H3BLOG_CACHE_PATH'], config['H3BLOG_FAKE_STORAGE_URL'])
+        else:
+            key = ('local',)
+        backend = self._backends.get(key)
+        if backend is None:
+            with self._lock:
+                backend = self._backends.get(key)
+                if backend is None:
+                    if key[0] == 'qiniu':
+                        backend = QiniuStorage(*key[1:])
+                    elif key[0] == 'fake':
+                        backend = FakeStorage(os.path.join(key[1], 'fake_storage'), key[2])
+                    else:
+                        backend = LocalStorage()
+                    self._backends[key] = backend
+        return backend
+
+    @property
+    def remote(self) -> bool:
+        return self.backend().remote
+
+    def _ensure_thread(self) -> None:
+        if self._thread is None or not self._thread.is_alive():
+            with self._lock:
+                if self._thread is None or not self._thread.is_alive():
+                    self._thread = threading.Thread(target=self._run, name='h3blog-storage', daemon=True)
+                    self._thread.start()
+
+    def submit(self, picture_id: int, filename: str) -> None:
+        """后台推送图片，filename 为上传目录中的内容地址"""
+        if not self.remote:
+            return
+        self._ensure_thread()
+        self._queue.put((picture_id, filename, 0))
+
+    def join(self) -> None:
+        """等待队列中的图片推送完(不包括等待重试的)"""
+        self._queue.join()
+
+    def push(self, picture_id: int, filename: str) -> str:
+        """推送一张图片并更新 Picture.url 和使用这张图片作为缩略图的文章，返回新的地址"""
+        from app.ext import db
+        from app.models import Picture, Article
+        localfile = os.path.join(self.app.config['H3BLOG_UPLOAD_PATH'], *filename.split('/'))
+        url = self.backend().put(filename, localfile)
+        if url:
+            t = Picture.__table__
+            a = Article.__table__
+            with db.get_engine(app=self.app).begin() as conn:
+                old_url = conn.execute(db.select([t.c.url]).where(t.c.id == picture_id)).scalar()
+                conn.execute(t.update().where(t.c.id == picture_id).values(url=url))
+                if old_url and old_url != url:
+                    conn.execute(a.update().where(a.c.thumbnail == old_url).values(thumbnail=url))
+        return url
+
+    def _run(self) -> None:
+        while True:
+            picture_id, filename, attempt = self._queue.get()
+            try:
+                self.push(picture_id, filename)
+                self.pushed += 1
+            except Exception as e:
+                self._retry(picture_id, filename, attempt, e)
+            finally:
+                self._queue.task_done()
+
+    def _retry(self, picture_id: int, filename: str, attempt: int, error: Exception) -> None:
+        if attempt >= int(self.app.config['H3BLOG_STORAGE_RETRIES']):
+            self.failed += 1
+            self.app.logger.error('推送图片失败 %s: %s' % (filename, error))
+            return
+        delay = float(self.app.config['H3BLOG_STORAGE_RETRY_DELAY']) * 2 ** attempt
+        self.app.logger.warning('推送图片失败 %s: %s，%g 秒后重试' % (filename, error, delay))
+        timer = threading.Timer(delay, self._queue.put, ((picture_id, filename, attempt + 1),))
+        timer.daemon = True
+        timer.start()
@@ -0,0 +1,161 @@
+import hashlib
+import os
+import re
+import threading
+
+# 读写文件的块大小
+BLOCK_SIZE = 64 * 1024
+_upload_id_re = re.compile(r'^[0-9A-Za-z_-]{8,64}$')
+
+
+class UploadStore(object):
+    """
+    上传文件存储
+
+    文件按 sha256 命名，保存到 H3BLOG_UPLOAD_PATH/<前两位>/<三四位>/<sha256>.<扩展名>，
+    相同内容只保存一份；上传时边读边写边计算哈希，不会把整个文件读入内存。
+    大文件可以分块上传，未完成的分块保存在 H3BLOG_UPLOAD_PATH/.partial，
+    中断后查询已上传的大小继续上传。
+    """
+    def __init__(self) -> None:
+        self.app = None
+
+    def init_app(self, app) -> None:
+        self.app = app
+
+    @property
+    def path(self) -> str:
+        return self.app.config['H3BLOG_UPLOAD_PATH']
+
+    @property
+    def partial_path(self) -> str:
+        return os.path.join(self.path, '.partial')
+
+    def content_name(self, sha256: str, ext: str) -> str:
+        """内容地址，使用 / 分隔，可以直接用在 url 中"""
+        return '{}/{}/{}{}'.format(sha256[:2], sha256[2:4], sha256, ext.lower())
+
+    def _tmp_name(self) -> str:
+        return os.path.join(self.path, '.%d-%d.tmp' % (os.getpid(), threading.get_ident()))
+
+    def save(self, stream, filename: str) -> tuple:
+        """
+        保存上传的文件流，返回 (内容地址, sha256, 文件大小)
+        """
+        tmp = self._tmp_name()
+        os.makedirs(self.path, exist_ok=True)
+        h = hashlib.sha256()
+        size = 0
+        try:
+            with open(tmp, 'wb') as f:
+                while True:
+                    block = stream.read(BLOCK_SIZE)
+                    if not block:
+                        break
+                    h.update(block)
+                    f.write(block)
+                    size += len(block)
+            if size == 0:
+                raise ValueError('文件为空')
+            return self._commit(tmp, h.hexdigest(), filename) + (size,)
+        finally:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+
+    def _commit(self, tmp: str, sha256: str, filename: str) -> tuple:
+        name = self.content_name(sha256, os.path.splitext(filename)[1])
+        target = os.path.join(self.path, *name.split('/'))
+        if not os.path.exists(target):
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            os.replace(tmp, target)
+        return name, sha256
+
+    def _partial_file(self, upload_id: str) -> str:
+        if not _upload_id_re.match(upload_id or ''):
+            raise ValueError('上传id格式错误')
+        return os.path.join(self.partial_path, upload_id + '.part')
+
+    def uploaded_size(self, upload_id: str) -> int:
+        """分块上传已经保存的大小"""
+        try:
+            return os.path.getsize(self._partial_file(upload_id))
+        except OSError:
+            return 0
+
+    def append_chunk(self, upload_id: str, offset: int, stream) -> int:
+        """
+        保存一个分块，offset 需要等于已经保存的大小，返回保存后的大小
+        重复上传已经保存过的分块时直接返回
+        """
+        filename = self._partial_file(upload_id)
+        size = self.uploaded_size(upload_id)
+        if offset != size:
+            if offset < size:
+                return size
+            raise ValueError('分块位置错误，已上传 %d 字节' % size)
+        max_size = int(self.app.config['H3BLOG_UPLOAD_MAX_SIZE'])
+        os.makedirs(self.partial_path, exist_ok=True)
+        with open(filename, 'ab') as f:
+            while True:
+                block = stream.read(BLOCK_SIZE)
+                if not block:
+                    break
+                size += len(block)
+                if size > max_size:
+                    raise ValueError('文件超过 %d 字节' % max_size)
+                f.write(block)
+        return size
+
+    def discard(self, upload_id: str) -> None:
+        """删除未完成的分块"""
+        try:
+            os.remove(self._partial_file(upload_id))
+        except OSError:
+            pass
+
+    def finish_chunks(self, upload_id: str, filename: str) -> tuple:
+        """分块全部上传后计算哈希并保存，返回 (内容地址, sha256, 文件大小)"""
+        partial = self._partial_file(upload_id)
+        h = hashlib.sha256()
+        size = 0
+        with open(partial, 'rb') as f:
+            while True:
+                block = f.read(BLOCK_SIZE)
+                if not block:
+                    break
+                h.update(block)
+                size += len(block)
+        try:
+            return self._commit(partial, h.hexdigest(), filename) + (size,)
+        finally:
+            if os.path.exists(partial):
+                os.remove(partial)
+
+    def add_picture(self, name: str, filename: str, sha256: str, pending: list = None):
+        """
+        记录上传的图片，filename 为 save 返回的内容地址
+        相同内容的图片已经上传过时直接返回原来的记录，否则在后台生成缩略图、推送远程存储
+        传入 pending 时新图片的 (id, 内容地址) 加入 pending，由调用者在提交引用图片地址的修改后
+        调用 submit()，避免推送完成替换地址时引用还没有写入数据库
+        """
+        from flask import url_for
+        from app.ext import db
+        from app.models import Picture
+        pic = Picture.query.filter_by(sha256=sha256).first()
+        if pic is not None:
+            return pic
+        pic = Picture(name=name if len(name) < 32 else os.path.basename(filename)[-32:],
+                      url=url_for('admin.get_image', filename=filename), sha256=sha256)
+        db.session.add(pic)
+        db.session.commit()
+        if pending is not None:
+            pending.append((pic.id, filename))
+        else:
+            self.submit(pic.id, filename)
+        return pic
+
+    def submit(self, picture_id: int, filename: str) -> None:
+        """后台生成缩略图、推送远程存储，先使用本地地址，推送完成后替换为 CDN 地址"""
+        from app.ext import images, storage
+        images.submit(filename)
+        storage.submit(picture_id, filename)
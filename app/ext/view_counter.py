@@ -0,0 +1,153 @@
+import atexit
+import os
+import threading
+import time
+from sqlalchemy import bindparam
+
+try:
+    import fcntl
+except ImportError:  # Windows 下没有 fcntl，不加文件锁
+    fcntl = None
+
+
+class ViewCounter(object):
+    """
+    文章浏览量计数器
+
+    浏览量先追加到缓存目录下的计数文件，多个进程和 ``flask flush-views`` 共用，
+    达到阈值或间隔时间后取走文件中的计数合并，
+    以一条 ``UPDATE article SET vc = vc + n`` 批量写回数据库，
+    避免每次浏览文章都开启一次写事务。
+    """
+    def __init__(self) -> None:
+        self.app = None
+        self._pending = {}
+        self._total = 0
+        self._lock = threading.Lock()
+        self._last_flush = time.time()
+        self._timer = None
+
+    def init_app(self, app) -> None:
+        self.app = app
+        atexit.register(self.flush)
+
+    @property
+    def _path(self) -> str:
+        return os.path.join(self.app.config['H3BLOG_CACHE_PATH'], 'view_counts')
+
+    def incr(self, article_id: int, n: int = 1) -> None:
+        """文章浏览量加n"""
+        with self._lock:
+            self._append(['%d %d\n' % (article_id, n)])
+            self._pending[article_id] = self._pending.get(article_id, 0) + n
+            self._total += n
+            total = self._total
+        self._ensure_timer()
+        threshold = int(self.app.config['H3BLOG_VIEW_COUNT_FLUSH_THRESHOLD'])
+        if total >= threshold:
+            self.flush()
+
+    def pending(self, article_id: int) -> int:
+        """本进程尚未写回数据库的浏览量"""
+        return self._pending.get(article_id, 0)
+
+    def apply(self, article) -> None:
+        """
+        把未写回的浏览量叠加到文章对象上用于显示，
+        不会标记对象为已修改，所以不会在请求结束时被提交
+        """
+        from sqlalchemy.orm.attributes import set_committed_value
+        n = self.pending(article.id)
+        if n:
+            set_committed_value(article, 'vc', (article.vc or 0) + n)
+
+    def flush(self) -> int:
+        """把计数文件中全部进程累积的浏览量写回数据库，返回写回的文章数量"""
+        if self.app is None:
+            return 0
+        with self._lock:
+            self._pending = {}
+            self._total = 0
+            self._last_flush = time.time()
+            pending = self._take()
+        if not pending:
+            return 0
+        from app.ext import db
+        from app.models import Article
+        table = Article.__table__
+        stmt = table.update(). \
+            where(table.c.id == bindparam('_id')). \
+            values(vc=table.c.vc + bindparam('_n'))
+        params = [{'_id': k, '_n': v} for k, v in pending.items()]
+        try:
+            with self.app.app_context():
+                with db.get_engine(app=self.app).begin() as conn:
+                    conn.execute(stmt, params)
+        except Exception as e:
+            # 写回失败时把计数放回计数文件，等待下次写回
+            with self._lock:
+                self._append(['%d %d\n' % (k, v) for k, v in pending.items()])
+            self.app.logger.error('写回文章浏览量失败: %s' % e)
+            return 0
+        return len(params)
+
+    def _append(self, lines: list) -> None:
+        """追加计数到计数文件"""
+        path = self._path
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            while True:
+                with open(path, 'a') as f:
+                    if fcntl is not None:
+                        fcntl.flock(f, fcntl.LOCK_EX)
+                    # 打开文件后、加锁前文件被 flush 取走了，重新打开新的文件
+                    try:
+                        if os.fstat(f.fileno()).st_ino != os.stat(path).st_ino:
+                            continue
+                    except FileNotFoundError:
+                        continue
+                    f.writelines(lines)
+                    return
+        except OSError as e:
+            self.app.logger.error('保存文章浏览量失败: %s' % e)
+
+    def _take(self) -> dict:
+        """取走计数文件，返回合并后的 {文章id: 浏览量}"""
+        path = self._path
+        taken = '%s.%d.%d' % (path, os.getpid(), threading.get_ident())
+        try:
+            os.replace(path, taken)
+        except FileNotFoundError:
+            return {}
+        pending = {}
+        try:
+            with open(taken) as f:
+                # 等待改名前已经加锁的进程写完
+                if fcntl is not None:
+                    fcntl.flock(f, fcntl.LOCK_EX)
+                for line in f:
+                    try:
+                        k, v = line.split()
+                        pending[int(k)] = pending.get(int(k), 0) + int(v)
+                    except ValueError:
+                        continue
+        finally:
+            os.remove(taken)
+        return pending
+
+    def _ensure_timer(self) -> None:
+        """首次计数时启动定时写回线程"""
+        if self._timer is not None and self._timer.is_alive():
+            return
+        with self._lock:
+            if self._timer is not None and self._timer.is_alive():
+                return
+            self._timer = threading.Thread(target=self._run, name='h3blog-view-counter', daemon=True)
+            self._timer.start()
+
+    def _run(self) -> None:
+        interval = float(self.app.config['H3BLOG_VIEW_COUNT_FLUSH_INTERVAL'])
+        while True:
+            time.sleep(max(interval - (time.time() - self._last_flush), 1))
+            if time.time() - self._last_flush >= interval:
+                self.flush()
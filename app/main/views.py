@@ -1,7 +1,7 @@
 import datetime
 from urllib.parse import parse_qs
 from flask import render_template, redirect, request, current_app, \
-    url_for, g, send_from_directory, abort, flash, jsonify
+    url_for, g, send_from_directory, abort, flash, jsonify, session
 from flask_login import login_user, logout_user, login_required, current_user
 from flask_wtf import form
 from . import main
@@ -9,23 +9,76 @@ from app.models import Article, Tag, Category, article_tag, Recommend, User, \
      InvitationCode, OnlineTool, Comment, OrderLog
 from .forms import SearchForm, LoginForm,RegistForm, PasswordForm, InviteRegistForm, \
     CommentForm
-from app.ext import db, csrf, alipay
+from app.ext import db, csrf, alipay, view_counter, search_index, page_cache, bing
 from ..import db, sitemap
-from app.util import get_bing_img_url, request_form_auto_fill
+from app.util import request_form_auto_fill, render_hidden, hidden_login_prompt
 
 def build_template_path(tpl: str) -> str:
     """ 获取模板路径 """
     return '{}/{}'.format(current_app.config['H3BLOG_TEMPLATE'], tpl)
 
+# 页面缓存片段，和访问者有关的内容每次请求重新渲染
+@page_cache.fragment('user_nav')
+def user_nav_fragment():
+    return render_template(build_template_path('common/user_nav.html'))
+
+@page_cache.fragment('comment_editor')
+def comment_editor_fragment(article_id):
+    return render_template(build_template_path('common/comment_editor.html'), article_id=article_id)
+
+@page_cache.fragment('hidden_content')
+def hidden_content_fragment(html):
+    return render_hidden(html)
+
+@page_cache.fragment('h_content')
+def h_content_fragment(h_content, h_role):
+    if current_user.is_authenticated and current_user.role == h_role:
+        return h_content
+    return hidden_login_prompt()
+
+# 支持条件请求(ETag/Last-Modified)的页面，内容只和全站内容版本、访问者有关
+CONDITIONAL_ENDPOINTS = frozenset([
+    'main.index', 'main.hot', 'main.about', 'main.article', 'main.tags', 'main.tag',
+    'main.tag_hot', 'main.category', 'main.category_hot', 'main.archive',
+    'main.archive_month', 'main.search_results', 'main.robots',
+])
+
 @main.before_request
 def before_request():
     if request.endpoint == 'main.static':
     # if '/css/' in request.path or '/js/' in request.path or '/img/' in request.path:
         return
+    # 有提示消息的页面只显示一次，不能使用浏览器缓存
+    g.conditional = request.endpoint in CONDITIONAL_ENDPOINTS and '_flashes' not in session
+    if g.conditional:
+        response = page_cache.not_modified()
+        if response is not None:
+            _count_view()
+            return response
     g.search_form = SearchForm(prefix='search')
 
+def _count_view() -> None:
+    """文章页面返回304时没有执行视图函数，同样累加浏览量"""
+    if request.endpoint == 'main.article':
+        name = request.view_args.get('name')
+    elif request.endpoint == 'main.about':
+        name = 'about-me'
+    else:
+        return
+    article_id = db.session.query(Article.id).filter(Article.name == name).scalar()
+    if article_id is not None:
+        view_counter.incr(article_id)
+
+@main.after_request
+def after_request(response):
+    if request.endpoint in CONDITIONAL_ENDPOINTS and g.get('conditional') and \
+            request.method == 'GET' and response.status_code == 200:
+        page_cache.add_validators(response)
+    return response
+
 
 @main.route('/', methods=['GET'])
+@page_cache.cached('articles', 'recommend')
 def index():
     page = request.args.get('page', 1, type=int)
     articles = Article.query.filter_by(state=1). \
@@ -40,6 +93,7 @@ def favicon():
     return main.send_static_file('img/favicon.ico')
 
 @main.route('/hot/',methods=['GET'])
+@page_cache.cached('articles', 'recommend')
 def hot():
     page = request.args.get('page',1,type=int)
     articles = Article.query.filter_by(state=1). \
@@ -50,20 +104,25 @@ def hot():
 
 @main.route('/about/', methods=['GET', 'POST'])
 def about():
-    article = Article.query.filter(Article.name=='about-me').first()
+    article = Article.query.options(db.undefer_group('body')). \
+        filter(Article.name=='about-me').first()
     if article :
-        article.vc = article.vc + 1
-        return render_template('article.html', article=article)
+        view_counter.incr(article.id)
+        view_counter.apply(article)
+        return render_template(build_template_path('article.html'), article=article)
     return render_template(build_template_path('about.html'))
 
 
 @main.route('/article/<name>/', methods=['GET', 'POST'])
+@page_cache.cached(per_user=False)
 def article(name):
-    article = Article.query.filter_by(name=name).first()
+    article = Article.query.options(db.undefer_group('body')). \
+        filter_by(name=name).first()
     if article is None:
         abort(404)
-    article.vc = article.vc + 1
-    db.session.commit()
+    page_cache.tag('article:%d' % article.id)
+    page_cache.on_hit(view_counter.incr, article.id)
+    view_counter.apply(article)
     category = article.category
     tpl_name = category.tpl_page
     return render_template(build_template_path(tpl_name), article=article)
@@ -75,18 +134,26 @@ def tags():
 
 
 @main.route('/tag/<t>/', methods=['GET'])
+@page_cache.cached()
 def tag(t):
     page = request.args.get('page', 1, type=int)
     tag = Tag.query.filter(Tag.code == t).first()
+    if tag is None:
+        abort(404)
+    page_cache.tag('tag:%d' % tag.id)
     articles = tag.articles.filter(Article.state == 1).\
         order_by(Article.timestamp.desc()). \
         paginate(page, per_page=current_app.config['H3BLOG_POST_PER_PAGE'], error_out=False)
     return render_template(build_template_path('tag.html'), articles=articles, tag=tag,orderby='time')
 
 @main.route('/tag/<t>/hot/', methods=['GET'])
+@page_cache.cached()
 def tag_hot(t):
     page = request.args.get('page', 1, type=int)
     tag = Tag.query.filter(Tag.code == t).first()
+    if tag is None:
+        abort(404)
+    page_cache.tag('tag:%d' % tag.id)
     articles = tag.articles.filter(Article.state == 1).\
         order_by(Article.vc.desc()). \
         paginate(page, per_page=current_app.config['H3BLOG_POST_PER_PAGE'], error_out=False)
@@ -94,19 +161,27 @@ def tag_hot(t):
 
 
 @main.route('/category/<c>/', methods=['GET', 'POST'])
+@page_cache.cached()
 def category(c):
     """
     文章分类列表
     """
     cty = Category.query.filter_by(name=c).first()
+    if cty is None:
+        abort(404)
+    page_cache.tag('category:%d' % cty.id)
     tpl_name = cty.tpl_list
     if cty.tpl_mold == 'single_page':
         tpl_name = cty.tpl_page
     return render_template(build_template_path(tpl_name), category=cty,orderby='time')
 
 @main.route('/category/<c>/hot/', methods=['GET', 'POST'])
+@page_cache.cached()
 def category_hot(c):
     cty = Category.query.filter_by(name=c).first()
+    if cty is None:
+        abort(404)
+    page_cache.tag('category:%d' % cty.id)
     tpl_name = cty.tpl_list
     if cty.tpl_mold == 'single_page':
         tpl_name = cty.tpl_mold
@@ -126,30 +201,73 @@ def comment_add():
         a = Article.query.filter(Article.id == c.article_id).first()
         a.comment_num = a.comments.count()
         db.session.commit()
+        page_cache.purge('article:%d' % a.id)
         ret['code'] = 1
         ret['id'] = c.id
 
     return jsonify(ret)
 
 @main.route('/archive/',methods=['GET'])
+@page_cache.cached('articles')
 def archive():
     """
-    根据时间归档
+    根据时间归档，按月份分页
     """
-    articles = Article.query.filter_by(state=1).order_by(Article.timestamp.desc()).all()
+    page = request.args.get('page', 1, type=int)
+    year = db.extract('year', Article.timestamp)
+    month = db.extract('month', Article.timestamp)
+    months = db.session.query(year.label('year'), month.label('month'),
+                              db.func.count(Article.id).label('count')). \
+        filter(Article.state == 1). \
+        group_by(year, month).order_by(year.desc(), month.desc()). \
+        paginate(page, per_page=current_app.config['H3BLOG_ARCHIVE_MONTH_PER_PAGE'], error_out=False)
     time_tag = []
-    current_tag = ''
-    for a in articles:
-        a_t = a.timestamp.strftime('%Y-%m')
-        if  a_t != current_tag:
-            tag = dict()
-            tag['name'] = a_t
-            tag['articles'] = []
-            time_tag.append(tag)
-            current_tag = a_t
-        tag = time_tag[-1]
-        tag['articles'].append(a)
-    return render_template(build_template_path('archives.html'),time_tag = time_tag)
+    if months.items:
+        start, _ = month_range(months.items[-1].year, months.items[-1].month)
+        _, end = month_range(months.items[0].year, months.items[0].month)
+        articles = archive_articles(start, end)
+        current_tag = ''
+        for a in articles:
+            a_t = a.timestamp.strftime('%Y-%m')
+            if  a_t != current_tag:
+                tag = dict()
+                tag['name'] = a_t
+                tag['articles'] = []
+                time_tag.append(tag)
+                current_tag = a_t
+            tag = time_tag[-1]
+            tag['articles'].append(a)
+    return render_template(build_template_path('archives.html'),time_tag = time_tag, months = months)
+
+@main.route('/archive/<int:year>/<int:month>/',methods=['GET'])
+@page_cache.cached('articles')
+def archive_month(year, month):
+    """
+    获取某个月份归档的文章
+    """
+    if month < 1 or month > 12:
+        abort(404)
+    start, end = month_range(year, month)
+    articles = [{
+        'name': a.name,
+        'title': a.title,
+        'url': url_for('main.article', name=a.name),
+        'timestamp': a.timestamp.strftime('%Y-%m-%d %H:%M:%S')
+        } for a in archive_articles(start, end)]
+    return jsonify({'name': '%04d-%02d' % (year, month), 'articles': articles})
+
+def month_range(year: int, month: int) -> tuple:
+    """ 返回月份的开始时间和下个月的开始时间 """
+    start = datetime.datetime(int(year), int(month), 1)
+    if start.month == 12:
+        return start, start.replace(year=start.year + 1, month=1)
+    return start, start.replace(month=start.month + 1)
+
+def archive_articles(start: datetime.datetime, end: datetime.datetime) -> list:
+    """ 只查询归档需要的字段，不加载文章内容 """
+    return db.session.query(Article.name, Article.title, Article.timestamp). \
+        filter(Article.state == 1, Article.timestamp >= start, Article.timestamp < end). \
+        order_by(Article.timestamp.desc()).all()
 
 @main.route('/search/', methods=['POST'])
 def search():
@@ -162,40 +280,19 @@ def search():
 @main.route('/search_results/<query>', methods=['GET', 'POST'])
 def search_results(query):
     page = request.args.get('page', 1, type=int)
-    articles = Article.query.filter(Article.content_html.like('%%%s%%' % query), Article.state == 1).order_by(Article.timestamp.desc()). \
-        paginate(page, per_page=current_app.config['H3BLOG_POST_PER_PAGE'], error_out=False)
+    articles = search_index.search(query, page, per_page=current_app.config['H3BLOG_POST_PER_PAGE'])
     return render_template(build_template_path('search_result.html'), articles=articles, query=query)
 
-@sitemap.register_generator
-def sitemap():
+@main.route('/sitemap.xml')
+def sitemap_index():
     """
-    sitemap生成
+    sitemap索引
     """
-    articles = Article.query.filter(Article.state == 1).all()
-    categories = Category.query.all()
-    tags = Tag.query.all()
-    import datetime
-    now = datetime.datetime.now()
-    #首页
-    yield 'main.index',{},now.strftime('%Y-%m-%dT%H:%M:%S'),'always',1.0
-    #关于我
-    yield 'main.about',{},now.strftime('%Y-%m-%dT%H:%M:%S'),'always',0.5
-    #分类
-    for category in categories:
-        yield 'main.category',{'c':category.name},now.strftime('%Y-%m-%dT%H:%M:%S'),'always',0.9
-    for categories in categories:
-        yield 'main.category_hot',{'c':category.name},now.strftime('%Y-%m-%dT%H:%M:%S'),'always',0.9
-    #标签
-    yield 'main.tags',{},now.strftime('%Y-%m-%dT%H:%M:%S'),'always',0.9
-    for t in tags:
-        yield 'main.tag',{'t':t.code},now.strftime('%Y-%m-%dT%H:%M:%S'),'always',0.9
-    for t in tags:
-        yield 'main.tag_hot',{'t':t.code},now.strftime('%Y-%m-%dT%H:%M:%S'),'always',0.9
-
-    #文章
-    for a in articles:
-        #posts.post是文章视图的endpoint,后面是其参数
-        yield 'main.article',{'name':a.name}
+    return sitemap.send_file('sitemap.xml')
+
+@main.route('/sitemap-<int:page>.xml')
+def sitemap_page(page):
+    return sitemap.send_file('sitemap-{}.xml'.format(page))
 
 @main.route('/robots.txt')
 def robots():
@@ -328,6 +425,6 @@ def alipay_nofity():
 @main.route('/bing_bg')
 def bing_bg():
     '''
-    获取背景地址
+    获取背景图片
     '''
-    return redirect(get_bing_img_url())
\ No newline at end of file
+    return bing.send()
\ No newline at end of file
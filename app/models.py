@@ -6,7 +6,7 @@ from flask import current_app
 from flask_login import UserMixin, AnonymousUserMixin
 from werkzeug.security import generate_password_hash, check_password_hash
 from datetime import datetime
-import hashlib, os
+import hashlib, json, os, time
 import markdown
 from flask_login import current_user
 from flask import url_for, request
@@ -26,7 +26,7 @@ class User(UserMixin, db.Model):
     status = db.Column(db.Boolean, default=False)
     role = db.Column(db.Integer, default=2, comment='1=管理员,2=普通账号,3=vip')
     avatar = db.Column(db.String(120),default='')
-    articles = db.relationship('Article', backref='author', lazy='dynamic')
+    articles = db.relationship('Article', back_populates='author', lazy='dynamic')
 
     @property
     def password(self):
@@ -83,13 +83,13 @@ class Category(db.Model):
     tpl_list = db.Column(db.String(300)) #列表模板
     tpl_page = db.Column(db.String(300)) #单页/详情模板
     tpl_mold = db.Column(db.String(20)) #模板类型 list,single_page
-    content = db.Column(db.Text) # 如果是单页，可以录入信息内容
+    content = db.deferred(db.Column(db.Text)) # 如果是单页，可以录入信息内容
     seo_title = db.Column(db.String(100))
     seo_description = db.Column(db.String(300))
     seo_keywords = db.Column(db.String(300))
     sn = db.Column(db.Integer, default=0) #排序编号
     visible = db.Column(db.Boolean, default=True) #是否隐藏
-    articles = db.relationship('Article', backref='category', lazy='dynamic')
+    articles = db.relationship('Article', back_populates='category', lazy='dynamic')
     icon = db.Column(db.String(128), default='')
 
     def __repr__(self):
@@ -133,8 +133,12 @@ class Article(db.Model):
     title = db.Column(db.String(120), index=True)
     name = db.Column(db.String(64),index=True,unique=True)
     editor = db.Column(db.String(10),nullable=False, default='')
-    content = db.Column(db.Text)
-    content_html = db.Column(db.Text)
+    # 文章内容比较大，列表页只需要标题和摘要，默认延迟加载，
+    # 需要显示文章内容时使用 Article.query.options(db.undefer_group('body'))
+    content = db.deferred(db.Column(db.Text), group='body')
+    content_html = db.deferred(db.Column(db.Text), group='body')
+    # content_html 按隐藏内容拆分后的 json，保存文章时由 split_content() 生成
+    content_segments = db.deferred(db.Column(db.Text), group='body')
     summary = db.Column(db.String(300))
     thumbnail = db.Column(db.String(200))
     state = db.Column(db.Integer,default=0)
@@ -143,44 +147,85 @@ class Article(db.Model):
     timestamp = db.Column(db.DateTime, index=True, default=datetime.now)
     author_id = db.Column(db.Integer, db.ForeignKey('user.id'))
     category_id = db.Column(db.Integer, db.ForeignKey('category.id'))
+    # 列表页每篇文章都要显示分类和作者，和文章一起关联查询，避免每篇文章再查询一次
+    author = db.relationship('User', back_populates='articles', lazy='joined')
+    category = db.relationship('Category', back_populates='articles', lazy='joined')
     tags = db.relationship('Tag',secondary=article_tag,backref=db.backref('articles',lazy='dynamic'),lazy='dynamic')
-    h_content = db.Column(db.String(800), nullable=False, default = '') #隐藏内容
+    h_content = db.deferred(db.Column(db.String(800), nullable=False, default = ''), group='body') #隐藏内容
     h_role = db.Column(db.Integer, default=0, comment='1=管理员,2=普通账号,3=vip') #那个角色可以看见隐藏的内容
     
 
     def content_to_html(self):
-        return markdown.markdown(self.content, extensions=[
-            'markdown.extensions.extra',
-            'markdown.extensions.codehilite',
-            ])
-
-    # @property
-    # def author(self):
-    #     """返回作者对象"""
-    #     return User.query.get(self.author_id)
+        return util.render_markdown(self.content)
+
+    def split_content(self) -> None:
+        '''按隐藏内容拆分 content_html，修改 content_html 后调用'''
+        self.content_segments = util.dump_content_segments(self.content_html)
+
+    def render_content(self) -> str:
+        '''
+        文章内容，未登录时隐藏内容替换为登录提示
+        隐藏内容作为页面缓存片段输出，登录用户和匿名访问者可以共用页面缓存
+        '''
+        from app.ext import page_cache
+        if self.content_segments is None:
+            segments = util.split_hidden_content(self.content_html)
+        else:
+            segments = json.loads(self.content_segments)
+        return util.join_content_segments(
+            segments, lambda html: page_cache.render_fragment('hidden_content', html))
 
-    @property
-    def category(self):
-        """返回文章分类对象"""
-        return Category.query.get(self.category_id)
+    # 已发布文章的上一篇/下一篇映射
+    _neighbors = None
+    _neighbors_expires = 0
 
     @property
     def category_name(self):
         """返回文章分类名称，主要是为了使用 flask-wtf 的 obj 返回对象的功能"""
-        return Category.query.get(self.category_id).name
+        return self.category.name
+
+    @classmethod
+    def neighbors(cls) -> dict:
+        """
+        返回已发布文章 id 到 (上一篇, 下一篇) 的映射，上一篇/下一篇只包含 id、name、title
+        映射在进程内缓存，后台保存文章时调用 clear_neighbors() 清除
+        """
+        neighbors = cls._neighbors
+        if neighbors is not None and cls._neighbors_expires > time.time():
+            return neighbors
+        rows = db.session.query(Article.id, Article.name, Article.title). \
+            filter(Article.state == 1).order_by(Article.id.asc()).all()
+        neighbors = {}
+        for i, row in enumerate(rows):
+            prev = rows[i - 1] if i > 0 else None
+            next = rows[i + 1] if i + 1 < len(rows) else None
+            neighbors[row.id] = (prev, next)
+        cls._neighbors = neighbors
+        cls._neighbors_expires = time.time() + current_app.config['H3BLOG_ARTICLE_NEIGHBORS_TIMEOUT']
+        return neighbors
+
+    @classmethod
+    def clear_neighbors(cls) -> None:
+        cls._neighbors = None
 
     @property
     def previous(self):
         """用于分页显示的上一页"""
+        n = self.neighbors().get(self.id)
+        if n is not None:
+            return n[0]
         a = self.query.filter(Article.state==1,Article.id < self.id). \
-            order_by(Article.timestamp.desc()).first()
+            order_by(Article.id.desc()).first()
         return a
 
     @property
     def next(self):
         """用于分页显示的下一页"""
+        n = self.neighbors().get(self.id)
+        if n is not None:
+            return n[1]
         a = self.query.filter(Article.state==1,Article.id > self.id). \
-            order_by(Article.timestamp.asc()).first()
+            order_by(Article.id.asc()).first()
         return a
 
     @property
@@ -197,22 +242,24 @@ class Article(db.Model):
 
     @property
     def show_h_content(self) -> str:
-        if current_user.is_authenticated and current_user.role == self.h_role:
-            return self.h_content
-        else:
-            # url = url_for('main.profile')
-            url = url_for('main.login') + '?next=' + request.path
-            repl = '''
-            <p class="border border-warning p-2 text-center">
-                本文隐藏内容 <a href="{}">登陆</a> 后才可以浏览
-            </p>
-            '''.format(url)
-            return repl
+        '''按角色显示的隐藏内容，作为页面缓存片段输出'''
+        from app.ext import page_cache
+        return page_cache.render_fragment('h_content', self.h_content, self.h_role)
 
     def __repr__(self):
         return '<Title %r>' % self.title
 
 
+class SearchTerm(db.Model):
+    '''
+    文章全文检索倒排索引
+    '''
+    __tablename__ = 'search_term'
+    term = db.Column(db.String(64), primary_key=True)
+    article_id = db.Column(db.Integer, db.ForeignKey('article.id'), primary_key=True, index=True)
+    weight = db.Column(db.Integer, nullable=False, default=0)
+
+
 class Comment(db.Model):
     '''
     评论
@@ -254,8 +301,50 @@ class AccessLog(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     ip = db.Column(db.String(20))
     url = db.Column(db.String(120))
+    timestamp = db.Column(db.DateTime, default=datetime.now, index=True)
+    remark = db.Column(db.String(32), index=True)
+
+
+class AccessLogHourly(db.Model):
+    '''
+    抓取日志按小时汇总(搜索引擎、路径)
+    '''
+    __tablename__ = 'access_log_hourly'
+    hour = db.Column(db.DateTime, primary_key=True)
+    remark = db.Column(db.String(32), primary_key=True)
+    url = db.Column(db.String(120), primary_key=True)
+    count = db.Column(db.Integer, default=0)
+
+
+class AccessLogDaily(db.Model):
+    '''
+    抓取日志按天汇总(搜索引擎、路径)
+    '''
+    __tablename__ = 'access_log_daily'
+    day = db.Column(db.Date, primary_key=True)
+    remark = db.Column(db.String(32), primary_key=True)
+    url = db.Column(db.String(120), primary_key=True)
+    count = db.Column(db.Integer, default=0)
+
+class BaiduPush(db.Model):
+    '''
+    百度主动推送队列
+    '''
+    __tablename__ = 'baidu_push'
+    PENDING = 0
+    SUCCESS = 1
+    FAILED = 2
+    id = db.Column(db.Integer, primary_key=True)
+    url = db.Column(db.String(300), index=True)
+    state = db.Column(db.Integer, default=PENDING) # 0 等待推送 1 推送成功 2 推送失败
+    attempts = db.Column(db.Integer, default=0) # 已推送次数
+    next_try = db.Column(db.DateTime, default=datetime.now) # 下次推送时间
+    lease = db.Column(db.String(32)) # 正在推送的进程标识，多进程时避免重复推送
+    result = db.Column(db.String(255)) # 推送结果
     timestamp = db.Column(db.DateTime, default=datetime.now)
-    remark = db.Column(db.String(32))
+    pushed = db.Column(db.DateTime) # 推送完成时间
+    __table_args__ = (db.Index('ix_baidu_push_state_next_try', 'state', 'next_try'),)
+
 
 class Picture(db.Model):
     '''
@@ -267,6 +356,7 @@ class Picture(db.Model):
     timestamp = db.Column(db.DateTime, default=datetime.now)
     url = db.Column(db.String(120))
     remark = db.Column(db.String(32))
+    sha256 = db.Column(db.String(64), index=True) # 文件内容哈希，相同图片只保存一份
 
 class InvitationCode(db.Model):
     '''
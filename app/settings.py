@@ -41,7 +41,23 @@ class BaseConfig(object):
     H3BLOG_POST_PER_PAGE = 10
     H3BLOG_MANAGE_POST_PER_PAGE = 15
     H3BLOG_COMMENT_PER_PAGE = 15
+    H3BLOG_ARCHIVE_MONTH_PER_PAGE = 12 # 归档页每页显示月份数量
     H3BLOG_SLOW_QUERY_THRESHOLD = 1
+    H3BLOG_VIEW_COUNT_FLUSH_INTERVAL = int(os.getenv('H3BLOG_VIEW_COUNT_FLUSH_INTERVAL', 60)) # 浏览量写回数据库的间隔(秒)
+    H3BLOG_VIEW_COUNT_FLUSH_THRESHOLD = int(os.getenv('H3BLOG_VIEW_COUNT_FLUSH_THRESHOLD', 100)) # 累积多少次浏览后立即写回
+    H3BLOG_PAGE_CACHE_TIMEOUT = int(os.getenv('H3BLOG_PAGE_CACHE_TIMEOUT', 300)) # 前台页面缓存时间(秒)，0为不缓存
+    H3BLOG_PAGE_CACHE_MAX_ENTRIES = int(os.getenv('H3BLOG_PAGE_CACHE_MAX_ENTRIES', 1000)) # 最多缓存页面数量
+    H3BLOG_ARTICLE_NEIGHBORS_TIMEOUT = int(os.getenv('H3BLOG_ARTICLE_NEIGHBORS_TIMEOUT', 300)) # 上一篇/下一篇映射缓存时间(秒)
+    H3BLOG_TEMPLATE_GLOBAL_CACHE_TIMEOUT = int(os.getenv('H3BLOG_TEMPLATE_GLOBAL_CACHE_TIMEOUT', 0)) # 模板全局函数跨请求缓存时间(秒)，0为只在请求内缓存
+    H3BLOG_ACCESS_LOG_QUEUE_SIZE = int(os.getenv('H3BLOG_ACCESS_LOG_QUEUE_SIZE', 10000)) # 抓取日志队列长度，队列满时丢弃
+    H3BLOG_ACCESS_LOG_BATCH_SIZE = int(os.getenv('H3BLOG_ACCESS_LOG_BATCH_SIZE', 200)) # 抓取日志每批写入条数
+    H3BLOG_ACCESS_LOG_FLUSH_INTERVAL = int(os.getenv('H3BLOG_ACCESS_LOG_FLUSH_INTERVAL', 5)) # 抓取日志写入间隔(秒)
+    H3BLOG_ACCESS_LOG_RETENTION_DAYS = int(os.getenv('H3BLOG_ACCESS_LOG_RETENTION_DAYS', 30)) # 抓取日志原始记录保留天数
+    H3BLOG_ACCESS_LOG_HOURLY_RETENTION_DAYS = int(os.getenv('H3BLOG_ACCESS_LOG_HOURLY_RETENTION_DAYS', 90)) # 抓取日志小时汇总保留天数，按天汇总永久保留
+    H3BLOG_MARKDOWN_VERSION = int(os.getenv('H3BLOG_MARKDOWN_VERSION', 1)) # markdown渲染版本，修改扩展或代码高亮后加1并执行 flask rerender
+    H3BLOG_ASSETS = int(os.getenv('H3BLOG_ASSETS', 1)) # 使用 flask collect-static 生成的带哈希静态文件
+    H3BLOG_COMPRESS = int(os.getenv('H3BLOG_COMPRESS', 0)) # 压缩响应(gzip/br)，前面有nginx压缩时不需要开启
+    H3BLOG_COMPRESS_LEVEL = int(os.getenv('H3BLOG_COMPRESS_LEVEL', 6)) # 压缩级别
     H3BLOG_REGISTER_INVITECODE = os.getenv('H3BLOG_REGISTER_INVITECODE',False)   # 是否开启邀请码注册
     H3BLOG_COMMENT = os.getenv("H3BLOG_COMMENT", False) # 是否开发评论，默认不开启
     H3BLOG_EDITOR = os.getenv('H3BLOG_EDITOR', 'markdown') # 默认编辑器
@@ -49,7 +65,19 @@ class BaseConfig(object):
 
     H3BLOG_UPLOAD_TYPE = os.getenv('H3BLOG_UPLOAD_TYPE','') # 默认本地上传
     H3BLOG_UPLOAD_PATH = os.path.join(basedir, 'uploads')
+    H3BLOG_STORAGE_RETRIES = int(os.getenv('H3BLOG_STORAGE_RETRIES', 5)) # 推送远程存储失败的重试次数
+    H3BLOG_STORAGE_RETRY_DELAY = float(os.getenv('H3BLOG_STORAGE_RETRY_DELAY', 2)) # 第一次重试的等待秒数，之后每次加倍
+    H3BLOG_FAKE_STORAGE_URL = os.getenv('H3BLOG_FAKE_STORAGE_URL', 'http://fake-cdn.h3blog.local/') # 模拟存储(fake)的地址
+    H3BLOG_CACHE_PATH = os.path.join(basedir, 'cache') # 缓存文件目录
+    H3BLOG_UPLOAD_CHUNK_SIZE = int(os.getenv('H3BLOG_UPLOAD_CHUNK_SIZE', 4 * 1024 * 1024)) # 分块上传每块大小
+    H3BLOG_UPLOAD_MAX_SIZE = int(os.getenv('H3BLOG_UPLOAD_MAX_SIZE', 200 * 1024 * 1024)) # 分块上传文件最大大小
     H3BLOG_ALLOWED_IMAGE_EXTENSIONS = ['png', 'jpg', 'jpeg', 'gif', 'webp']
+    H3BLOG_IMAGE_WIDTHS = [320, 640, 1280] # 上传图片生成的缩略图宽度
+    H3BLOG_IMAGE_QUALITY = int(os.getenv('H3BLOG_IMAGE_QUALITY', 80)) # 缩略图质量
+    H3BLOG_IMAGE_WORKERS = int(os.getenv('H3BLOG_IMAGE_WORKERS', 2)) # 生成缩略图的后台线程数
+    H3BLOG_BING_URL = os.getenv('H3BLOG_BING_URL', 'https://cn.bing.com') # bing 壁纸接口地址
+    H3BLOG_BING_REFRESH = int(os.getenv('H3BLOG_BING_REFRESH', 3600)) # bing 壁纸刷新间隔秒数
+    H3BLOG_BING_REDIRECT = int(os.getenv('H3BLOG_BING_REDIRECT', 0)) # 1 跳转到 bing 的图片地址，0 返回本地保存的图片
     H3BLOG_TONGJI_SCRIPT = os.getenv('H3BLOG_TONGJI_SCRIPT','') #统计代码
     H3BLOG_EXTEND_META = os.getenv('H3BLOG_EXTEND_META', '') # 扩展META
     H3BLOG_ROBOTS = os.getenv('H3BLOG_ROBOTS', 'User-agent: *\nAllow: /') # 网站robots定义
@@ -62,21 +90,30 @@ class BaseConfig(object):
     QINIU_SECRET_KEY = os.getenv('QINIU_SECRET_KEY','secret456')
 
     BAIDU_PUSH_TOKEN = os.getenv('BAIDU_PUSH_TOKEN') #主动推送给百度链接，token是在搜索资源平台申请的推送用的准入密钥
+    H3BLOG_BAIDU_PUSH_API = os.getenv('H3BLOG_BAIDU_PUSH_API', 'http://data.zz.baidu.com') # 百度推送接口地址
+    H3BLOG_BAIDU_PUSH_BATCH_SIZE = int(os.getenv('H3BLOG_BAIDU_PUSH_BATCH_SIZE', 2000)) # 每次推送的链接数，百度限制2000
+    H3BLOG_BAIDU_PUSH_INTERVAL = float(os.getenv('H3BLOG_BAIDU_PUSH_INTERVAL', 1)) # 两次推送请求的最小间隔秒数
+    H3BLOG_BAIDU_PUSH_RETRIES = int(os.getenv('H3BLOG_BAIDU_PUSH_RETRIES', 5)) # 推送失败的重试次数
+    H3BLOG_BAIDU_PUSH_RETRY_DELAY = float(os.getenv('H3BLOG_BAIDU_PUSH_RETRY_DELAY', 60)) # 第一次重试的等待秒数，之后每次加倍
+    H3BLOG_BAIDU_PUSH_POLL_INTERVAL = float(os.getenv('H3BLOG_BAIDU_PUSH_POLL_INTERVAL', 60)) # 后台检查推送队列的间隔秒数
 
     SITEMAP_URL_SCHEME = os.getenv('SITEMAP_URL_SCHEME','http')
-    SITEMAP_MAX_URL_COUNT = os.getenv('SITEMAP_MAX_URL_COUNT',100000)
+    SITEMAP_MAX_URL_COUNT = int(os.getenv('SITEMAP_MAX_URL_COUNT',50000)) # 每个sitemap文件最多url数量
 
     ALIPAY_APPID= os.getenv('ALIPAY_APPID', '') # 设置签约的appid
     ALIPAY_PUBLIC_KEY = os.getenv('ALIPAY_PUBLIC_KEY', '') # 支付宝公钥
     ALIPAY_PRIVATE_KEY =os.getenv('ALIPAY_PRIVATE_KEY', '') # 支付宝的公钥，验证支付宝回传消息使用，不是你自己的公钥
     ALIPAY_DEBUG = os.getenv('ALIPAY_DEBUG', True)
     ALIPAY_NOTIFY_URL = os.getenv('ALIPAY_NOTIFY_URL', '')
+    ALIPAY_GATEWAY = os.getenv('ALIPAY_GATEWAY', '') # 网关地址，为空时根据 ALIPAY_DEBUG 选择沙箱或正式网关
+    ALIPAY_POOL_SIZE = int(os.getenv('ALIPAY_POOL_SIZE', 10)) # 网关连接池大小，也是批量查询的线程数
     
 
     
 
 class DevelopmentConfig(BaseConfig):
     DEBUG = True
+    H3BLOG_ASSETS = 0 # 开发时直接使用模板目录中的静态文件
     # SQLALCHEMY_DATABASE_URI = os.getenv('DATABASE_URL', prefix + os.path.join(basedir, 'data-dev.db'))
 
 class TestingConfig(BaseConfig):
@@ -1,33 +1,114 @@
-from threading import active_count
+import time
+from functools import wraps
 from typing import Any, List
-from flask import Flask
+from flask import Flask, current_app, _request_ctx_stack
 from flask_login import current_user
 from flask import url_for, request 
+from flask_sqlalchemy import Pagination
+from app.ext import db
+from app.util import split_hidden_content, join_content_segments
 from app.models import Article, Tag, Category, article_tag, Recommend, User, \
      InvitationCode, OnlineTool, Comment
 import re
 
+# 跨请求缓存的模板全局函数结果 key -> (过期时间, 结果中对象的主键)
+_global_cache = {}
+
+
+def _load(cls, ids: list) -> list:
+    """按主键在当前请求的会话中重新查询对象，保持原来的顺序"""
+    if not ids:
+        return []
+    objs = dict((o.id, o) for o in cls.query.filter(cls.id.in_(ids)))
+    return [objs[i] for i in ids if i in objs]
+
+
+def _freeze(value) -> tuple:
+    """
+    缓存的结果只保存对象的主键，对象和请求的数据库会话绑定，
+    跨请求使用会出现 DetachedInstanceError
+    """
+    items = value.items if isinstance(value, Pagination) else value
+    cls = type(items[0]) if items else None
+    ids = [i.id for i in items]
+    if isinstance(value, Pagination):
+        return 'page', cls, ids, value.page, value.per_page, value.total
+    return 'list', cls, ids
+
+
+def _thaw(frozen: tuple) -> Any:
+    items = _load(frozen[1], frozen[2])
+    if frozen[0] == 'page':
+        return Pagination(None, frozen[3], frozen[4], frozen[5], items)
+    return items
+
+
+def memoize(f):
+    """
+    模板全局函数缓存，同一个请求内相同参数只查询一次；
+    H3BLOG_TEMPLATE_GLOBAL_CACHE_TIMEOUT 大于0时在多个请求之间缓存，
+    后台修改文章、分类、标签时调用 clear_template_global_cache() 清除
+    """
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        key = (f.__name__, args, tuple(sorted(kwargs.items())))
+        try:
+            hash(key)
+        except TypeError:
+            return f(*args, **kwargs)
+        ctx = _request_ctx_stack.top
+        request_cache = {}
+        if ctx is not None:
+            if not hasattr(ctx, 'template_global_cache'):
+                ctx.template_global_cache = {}
+            request_cache = ctx.template_global_cache
+        if key in request_cache:
+            return request_cache[key]
+        timeout = current_app.config.get('H3BLOG_TEMPLATE_GLOBAL_CACHE_TIMEOUT', 0)
+        if timeout > 0:
+            entry = _global_cache.get(key)
+            if entry is not None and entry[0] > time.time():
+                value = _thaw(entry[1])
+            else:
+                value = f(*args, **kwargs)
+                _global_cache[key] = (time.time() + timeout, _freeze(value))
+        else:
+            value = f(*args, **kwargs)
+        request_cache[key] = value
+        return value
+    return decorated_function
+
+
+def clear_template_global_cache() -> None:
+    _global_cache.clear()
+
+
 def register_template_filter(app):
     '''注册模板过滤器'''
 
     @app.template_filter('hidden_content')
     def hidden_content(content):
-        if current_user.is_authenticated:
-            return content.replace('[h3_hidden]','').replace('[/h3_hidden]','')
-        else:
-            login_url = url_for('main.login') + '?next=' + request.path
-            repl = '''
-            <p class="border border-warning p-2 text-center">
-            本文隐藏内容 <a href="{}">登陆</a> 后才可以浏览
-            </p>
-            '''.format(login_url)
-            return re.sub('\[h3_hidden\].*?\[/h3_hidden\]',repl,content,flags=re.DOTALL)
+        return join_content_segments(split_hidden_content(content))
+
+    @app.template_filter('image_width')
+    def image_width(url, width):
+        """本地上传的图片使用指定宽度的缩略图"""
+        prefix = url_for('admin.get_image', filename='')
+        if url and url.startswith(prefix) and '?' not in url:
+            return '{}?w={}'.format(url, width)
+        return url
+
+    @app.template_filter('article_content')
+    def article_content(article):
+        """文章内容，使用保存时拆分好的隐藏内容"""
+        return article.render_content()
 
 def register_template_global(app: Flask):
     """
     注册模板全局函数
     """
     @app.template_global()
+    @memoize
     def get_articles(
             categorys:str = None, #文章分类，分类标识逗号分割比如"python,flask,django"
             tags:str = None, # 文章标签，文章标签逗号分割比如"python,安全,何三笔记"
@@ -42,7 +123,7 @@ def register_template_global(app: Flask):
         根据条件获取已发布的文章
         """
         results = []
-        query = Article.query.filter(Article.state == 1)
+        query = db.session.query(Article).filter(Article.state == 1)
         if categorys and len(categorys) > 0:
             query = query.filter(Article.category.has(Category.name.in_(categorys.split(','))))
         if tags and len(tags) > 0:
@@ -68,11 +149,12 @@ def register_template_global(app: Flask):
         return results
 
     @app.template_global()
+    @memoize
     def get_categorys(names:str = None, visible = None) -> List[Category] :
         """
         获取文章分类
         """
-        query = Category.query
+        query = db.session.query(Category)
         if names and len(names) > 0:
             query = query.filter(Category.name.in_(names.split(',')))
         if visible:
@@ -81,11 +163,12 @@ def register_template_global(app: Flask):
         return query.all()
     
     @app.template_global()
+    @memoize
     def get_tags(tags:str = None) -> List[Tag] :
         """
         获取系统标签
         """
-        query = Tag.query.filter(Tag.visible == True)
+        query = db.session.query(Tag).filter(Tag.visible == True)
         if tags and len(tags) > 0:
             query = query.filter(Tag.name.in_(tags.split(',')))
         return query.all()
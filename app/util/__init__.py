@@ -1,3 +1,5 @@
 from .common import *
 from .draw_img import *
-from .model import request_form_auto_fill
\ No newline at end of file
+from .model import request_form_auto_fill
+from .render import render_markdown, markdown_to_html, dump_content_segments, \
+    join_content_segments, split_hidden_content, hidden_login_prompt, render_hidden
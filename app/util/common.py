@@ -40,32 +40,6 @@ def isAjax() -> bool :
         return True
     return False
 
-def upload_file_qiniu(inputdata,filename=None):
-    from qiniu import Auth, put_data, etag
-    access_key = current_app.config.get('QINIU_ACCESS_KEY')
-    secret_key = current_app.config.get('QINIU_SECRET_KEY')
-    '''
-    :param inputdata: bytes类型的数据
-    :return: 文件在七牛的上传名字
-    '''
-    # 构建鉴权对象
-    q = Auth(access_key, secret_key)
-    #要上传的空间
-    bucket_name = current_app.config.get('QINIU_BUCKET_NAME')
-
-    #生成上传 Token，可以指定过期时间等
-    token = q.upload_token(bucket_name)
-    #如果需要对上传的图片命名，就把第二个参数改为需要的名字
-    ret1,ret2=put_data(token,filename,data=inputdata)
-    print('ret1:',ret1)
-    print('ret2:',ret2)
-
-    #判断是否上传成功
-    if ret2.status_code!=200:
-        raise Exception('文件上传失败')
-
-    return ret1.get('key')
-
 def file_list_qiniu():
     from qiniu import Auth, BucketManager
     access_key = current_app.config.get('QINIU_ACCESS_KEY')
@@ -197,17 +171,6 @@ def gen_invit_code(count,long):
     return r
 
 
-def get_bing_img_url(format='js',idx=0):
-    '''
-    获取bing每日壁纸url
-    '''
-    url = 'https://cn.bing.com/HPImageArchive.aspx?format={}&idx={}&n=1'.format(format,idx)
-    resp = requests.get(url,timeout=5).text
-    data = json.loads(resp)
-    return 'https://cn.bing.com{}'.format(data['images'][0]['url'])
-
-
-
 def get_short_id() -> str:
     array = [ "0", "1", "2", "3", "4", "5","6", "7", "8", "9",
           "a", "b", "c", "d", "e", "f","g", "h", "i", "j", "k", "l", "m", "n", "o", "p", "q", "r", "s","t", "u", "v", "w", "x", "y", "z",
@@ -1,8 +1,122 @@
 from typing import Dict
 from PIL import Image, ImageDraw, ImageFont
 from io import BytesIO
-import requests
+from functools import lru_cache
+import hashlib
+import json
+import os
 import re
+import threading
+import requests
+
+# 渲染结果有变化时修改，之前的图片缓存失效
+DRAW_VERSION = 1
+
+_url_re = re.compile(
+    r'^(?:http|ftp)s?://' # http:// or https://
+    r'(?:(?:[A-Z0-9](?:[A-Z0-9-]{0,61}[A-Z0-9])?\.)+(?:[A-Z]{2,6}\.?|[A-Z0-9-]{2,}\.?)|' #domain...
+    r'localhost|' #localhost...
+    r'\d{1,3}\.\d{1,3}\.\d{1,3}\.\d{1,3})' # ...or ip
+    r'(?::\d+)?' # optional port
+    r'(?:/?|[/?]\S+)$', re.IGNORECASE)
+
+_session = requests.Session()
+
+
+@lru_cache(maxsize=64)
+def load_font(path: str, size: int) -> ImageFont.FreeTypeFont:
+    '''字体，按 (文件, 大小) 缓存，字体文件不存在时使用默认字体'''
+    try:
+        return ImageFont.truetype(path, size)
+    except OSError:
+        try:
+            return ImageFont.load_default(size)
+        except TypeError:
+            return ImageFont.load_default()
+
+
+@lru_cache(maxsize=16)
+def load_image(src: str) -> Image.Image:
+    '''
+    背景图片和图片图层，按地址缓存解码后的图片，远程图片只下载一次
+    返回的图片是共享的，不要修改
+    '''
+    if _url_re.match(src):
+        resp = _session.get(src, timeout=10)
+        resp.raise_for_status()
+        img = Image.open(BytesIO(resp.content))
+    else:
+        img = Image.open(src)
+    img.load()
+    return img
+
+
+@lru_cache(maxsize=16)
+def _base_canvas(width: int, height: int, background_color: str, background_img: str) -> Image.Image:
+    '''画好背景的画布，相同背景的图片复制这个画布，不再重复创建和粘贴背景'''
+    canvas = Image.new('RGB', (width, height), background_color)
+    if background_img:
+        canvas.paste(load_image(background_img), (0, 0))
+    return canvas
+
+
+def clear_draw_cache() -> None:
+    '''清除字体、图片和画布缓存，比如替换了背景图片文件后'''
+    load_font.cache_clear()
+    load_image.cache_clear()
+    _base_canvas.cache_clear()
+
+
+def cover_config(title: str, font_path: str, width: int = 800, height: int = 400,
+                 background_color: str = '#424155', title_color: str = '#ff0000',
+                 title_size: int = 60, background_img: str = '') -> Dict:
+    '''标题居中的封面图配置'''
+    return {
+        'width': width,
+        'height': height,
+        'background_img': background_img,
+        'background_color': background_color,
+
+        'layers': [
+            {
+                'layer_type': 'text',
+                'color': title_color,
+                'font': {
+                    'font': font_path,
+                    'size': title_size,
+                },
+                'position': '0,0',
+                'align': 'center',
+                'text': title
+            }
+        ]
+    }
+
+
+def draw_key(config: Dict) -> str:
+    '''图片配置的哈希，相同配置画出的图片相同'''
+    h = hashlib.sha256(('%s|' % DRAW_VERSION).encode())
+    h.update(json.dumps(config, sort_keys=True, ensure_ascii=False).encode('utf-8'))
+    return h.hexdigest()
+
+
+def draw_cached(config: Dict, cache_dir: str, fmt: str = 'PNG') -> str:
+    '''
+    按配置画图并保存到 cache_dir，返回图片文件
+    相同配置已经画过时直接返回缓存的文件
+    '''
+    key = draw_key(config)
+    filename = os.path.join(cache_dir, key[:2], '{}.{}'.format(key, fmt.lower()))
+    if not os.path.isfile(filename):
+        d = H3blogDrow()
+        d.parse_config(config)
+        img = d.draw()
+        os.makedirs(os.path.dirname(filename), exist_ok=True)
+        tmp = '%s.%d-%d.tmp' % (filename, os.getpid(), threading.get_ident())
+        img.save(tmp, fmt)
+        os.replace(tmp, filename)
+    return filename
+
 
 class H3blogDrow:
     '''自定义图片样式'''
@@ -21,74 +135,144 @@ class H3blogDrow:
         self.heigth = c.get('height', 400)
         self.background_color = c.get('background_color', '#424155')
         self.background_img = c.get('background_img')
-
-        layers = c.get('layers', None)
-        if not layers:
-            return
-        self.layers.extend(layers)
+        self.layers = list(c.get('layers', None) or [])
 
     def _create_canvas(self) -> None:
-        self.convas = Image.new('RGB', (self.width, self.heigth), self.background_color)
-
+        self.convas = _base_canvas(self.width, self.heigth, self.background_color,
+                                   self.background_img or '').copy()
 
     def draw(self) -> Image:
         '''画图'''
         # 创建背景设置画布
         self._create_canvas()
 
-        if self.background_img and len(self.background_img) > 0:
-            regex = re.compile(
-                r'^(?:http|ftp)s?://' # http:// or https://
-                r'(?:(?:[A-Z0-9](?:[A-Z0-9-]{0,61}[A-Z0-9])?\.)+(?:[A-Z]{2,6}\.?|[A-Z0-9-]{2,}\.?)|' #domain...
-                r'localhost|' #localhost...
-                r'\d{1,3}\.\d{1,3}\.\d{1,3}\.\d{1,3})' # ...or ip
-                r'(?::\d+)?' # optional port
-                r'(?:/?|[/?]\S+)$', re.IGNORECASE)
-            m = re.match(regex, self.background_img)
-            bg_img = None
-            if m :
-                resp = requests.get(self.background_img)
-                _img_bytes = BytesIO()
-                _img_bytes.write(resp.content)
-                bg_img = Image.open(_img_bytes)
-            else:
-                #创建背景图片
-                bg_img = Image.open(self.background_img)
-            #将背景图片写入画布
-            self.convas.paste(bg_img, (0,0))
-
         for layer in self.layers:
             if layer.get('layer_type') == 'text':
                 self._draw_text(layer)
             if layer.get('layer_type') == 'image':
-                self._draw_image()
+                self._draw_image(layer)
 
         return self.convas
 
-    def _darw_image(self, layer: dict) -> None:
-        pass
+    def _draw_image(self, layer: dict) -> None:
+        src = layer.get('src')
+        if not src:
+            return
+        img = load_image(src)
+        size = layer.get('size')
+        if size:
+            img = img.resize(tuple([int(i) for i in size.split(',')]), Image.LANCZOS)
+        p = tuple([int(i) for i in layer.get('position','0,0').split(',')])
+        if img.mode in ('RGBA', 'LA', 'P'):
+            img = img.convert('RGBA')
+            self.convas.paste(img, p, img)
+        else:
+            self.convas.paste(img, p)
 
     def _draw_text(self, layer: dict) -> None:
         draw = ImageDraw.Draw(self.convas)
         _font = layer.get('font')
-        font = ImageFont.truetype(_font.get('font'), _font.get('size', 36))
+        font = load_font(_font.get('font'), _font.get('size', 36))
+        text = layer.get('text', '')
         align = layer.get('align')
         p = tuple()
+        if align in ('center', 'top-right', 'bottom-left', 'bottom-right'):
+            left, top, right, bottom = draw.textbbox((0, 0), text, font=font) #获取字体大小
+            f_w, f_h = right - left, bottom - top
         if align and align == 'center':
-            f_w, f_h = font.getsize(layer.get('text')) #获取字体大小
             p = ((self.convas.width - f_w)/2, (self.convas.height - f_h)/2)
         elif align and align == 'top-left':
             p = (0,0)
         elif align and align == 'top-right':
-            f_w, f_h = font.getsize(layer.get('text')) #获取字体大小
             p = (self.convas.width - f_w, 0)
         elif align and align == 'bottom-left':
-            f_w, f_h = font.getsize(layer.get('text')) #获取字体大小
             p = (0, self.convas.height - f_h)
         elif align and align == 'bottom-right':
-            f_w, f_h = font.getsize(layer.get('text')) #获取字体大小
-            p = (self.convas.width - f_w, self.convas.height - f_w)
+            p = (self.convas.width - f_w, self.convas.height - f_h)
         else:
             p = tuple([int(i) for i in layer.get('position','0,0').split(',')])
         color = layer.get('color','0,0,0')
-        draw.text(p, layer.get('text',''), fill = color, font = font)
\ No newline at end of file
+        draw.text(p, text, fill = color, font = font)
+
+
+def _cover_worker(item: tuple) -> tuple:
+    '''子进程中画一篇文章的封面图，返回 (文章id, 图片文件, 错误信息)'''
+    article_id, config, cache_dir = item
+    try:
+        return article_id, draw_cached(config, cache_dir), None
+    except Exception as e:
+        return article_id, None, '%s: %s' % (type(e).__name__, e)
+
+
+def generate_covers(template: Dict = None, workers: int = None, chunk_size: int = 100,
+                    limit: int = None, progress=None) -> dict:
+    '''
+    给没有缩略图的文章生成封面图
+    template 为 cover_config 的参数(不包括标题)。按主键分批读取文章，交给进程池画图，
+    图片按上传图片保存(去重、缩略图、远程存储)，每批更新一次 Article.thumbnail，
+    更新提交后才推送远程存储，Article.thumbnail 取自 Picture.url 当前的值，
+    中断后重新执行时只处理还没有缩略图的文章。需要在请求上下文中调用(生成图片地址)。
+    progress 为每批完成后的回调，参数是当前的统计信息
+    '''
+    import time
+    from concurrent.futures import ProcessPoolExecutor
+    from flask import current_app
+    from app.ext import db, uploads
+    from app.models import Article, Picture
+    template = dict(template or {})
+    template.setdefault('font_path', os.path.join(current_app.root_path, 'admin', 'static', 'fonts', '站酷庆科黄油体.ttf'))
+    cache_dir = os.path.join(current_app.config['H3BLOG_CACHE_PATH'], 'draw')
+    t = Article.__table__
+    p = Picture.__table__
+    # 推送远程存储可能已经替换了图片地址
+    picture_url = db.select([p.c.url]).where(p.c.id == db.bindparam('_picture_id')).as_scalar()
+    engine = db.get_engine()
+    stats = {'total': 0, 'updated': 0, 'failed': [], 'seconds': 0}
+    start = time.time()
+    workers = workers or os.cpu_count() or 1
+    executor = ProcessPoolExecutor(max_workers=workers) if workers > 1 else None
+    try:
+        last_id = 0
+        while limit is None or stats['total'] < limit:
+            n = chunk_size if limit is None else min(chunk_size, limit - stats['total'])
+            with engine.connect() as conn:
+                rows = conn.execute(db.select([t.c.id, t.c.title]).
+                                    where(((t.c.thumbnail == None) | (t.c.thumbnail == '')) & (t.c.id > last_id)).
+                                    order_by(t.c.id.asc()).limit(n)).fetchall()
+            if not rows:
+                break
+            last_id = rows[-1].id
+            todo = [(r.id, cover_config(r.title or '', **template), cache_dir) for r in rows]
+            if executor is None:
+                drawn = map(_cover_worker, todo)
+            else:
+                drawn = executor.map(_cover_worker, todo, chunksize=max(1, len(todo) // (workers * 4)))
+            updates = []
+            pending = []
+            for article_id, filename, error in drawn:
+                if error is None:
+                    try:
+                        with open(filename, 'rb') as f:
+                            name, sha256, _ = uploads.save(f, filename)
+                        pic = uploads.add_picture('封面-%d.png' % article_id, name, sha256, pending)
+                        updates.append({'_id': article_id, '_picture_id': pic.id})
+                        continue
+                    except Exception as e:
+                        error = '%s: %s' % (type(e).__name__, e)
+                stats['failed'].append((article_id, error))
+            if updates:
+                with engine.begin() as conn:
+                    conn.execute(t.update().where(t.c.id == db.bindparam('_id')).
+                                 values(thumbnail=picture_url), updates)
+            for picture_id, name in pending:
+                uploads.submit(picture_id, name)
+            stats['total'] += len(rows)
+            stats['updated'] += len(updates)
+            stats['seconds'] = time.time() - start
+            if progress is not None:
+                progress(stats)
+    finally:
+        if executor is not None:
+            executor.shutdown()
+    stats['seconds'] = time.time() - start
+    return stats
@@ -0,0 +1,184 @@
+'''
+模拟的外部接口，用于测试和开发时不访问真实的服务
+
+    with FakeServer(fake_bing_app()) as server:
+        app.config['H3BLOG_BING_URL'] = server.url
+
+也可以单独运行： python -m app.util.fake_server bing 5001
+'''
+import io
+import json
+import sys
+import threading
+from flask import Flask, jsonify, request
+from werkzeug.serving import WSGIRequestHandler, make_server
+
+
+class _QuietRequestHandler(WSGIRequestHandler):
+    # 保持连接，和真实的接口一样可以测试连接复用
+    protocol_version = 'HTTP/1.1'
+    # 响应头和内容分开写入，不关闭 Nagle 时复用的连接每次请求都要等待延迟确认
+    disable_nagle_algorithm = True
+
+    def log_request(self, *args, **kwargs) -> None:
+        pass
+
+
+class FakeServer(object):
+    '''在后台线程运行的本地 http 服务，端口为 0 时自动选择'''
+    def __init__(self, app, host: str = '127.0.0.1', port: int = 0) -> None:
+        self.app = app
+        self.host = host
+        self.port = port
+        self.url = None
+        self._server = None
+        self._thread = None
+
+    def start(self) -> 'FakeServer':
+        self._server = make_server(self.host, self.port, self.app, threaded=True,
+                                   request_handler=_QuietRequestHandler)
+        self.port = self._server.server_port
+        self.url = 'http://%s:%d' % (self.host, self.port)
+        self._thread = threading.Thread(target=self._server.serve_forever, name='h3blog-fake-server', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+    def __enter__(self) -> 'FakeServer':
+        return self.start()
+
+    def __exit__(self, *exc) -> None:
+        self.stop()
+
+
+def fake_bing_app(date: str = '20200101', size: tuple = (1920, 1080)) -> Flask:
+    '''
+    模拟 bing 每日壁纸接口，修改 app.config['BING_DATE'] 模拟换了一天，
+    app.config['BING_HITS'] 记录每个地址的访问次数
+    '''
+    app = Flask('fake_bing')
+    app.config['BING_DATE'] = date
+    app.config['BING_HITS'] = {}
+    images = {}
+
+    @app.before_request
+    def count():
+        hits = app.config['BING_HITS']
+        hits[request.path] = hits.get(request.path, 0) + 1
+
+    @app.route('/HPImageArchive.aspx')
+    def archive():
+        date = app.config['BING_DATE']
+        return jsonify({'images': [{'startdate': date, 'url': '/th?id=OHR.Fake%s_1920x1080.jpg' % date,
+                                    'copyright': 'h3blog'}]})
+
+    @app.route('/th')
+    def image():
+        name = request.args.get('id', '')
+        if name not in images:
+            from PIL import Image
+            b = io.BytesIO()
+            color = (hash(name) & 0xff, 120, 200)
+            Image.new('RGB', size, color).save(b, 'JPEG')
+            images[name] = b.getvalue()
+        return app.response_class(images[name], mimetype='image/jpeg')
+
+    return app
+
+
+def fake_baidu_push_app(token: str = 'token', quota: int = 10) -> Flask:
+    '''
+    模拟百度主动推送接口 /urls?site=&token=
+    app.config['BAIDU_QUOTA'] 为剩余配额，BAIDU_FAILURES 为接下来返回 500 的次数，
+    BAIDU_REQUESTS 记录每次推送的链接
+    '''
+    app = Flask('fake_baidu_push')
+    app.config['BAIDU_QUOTA'] = quota
+    app.config['BAIDU_FAILURES'] = 0
+    app.config['BAIDU_REQUESTS'] = []
+
+    @app.route('/urls', methods=['POST'])
+    def urls():
+        if app.config['BAIDU_FAILURES'] > 0:
+            app.config['BAIDU_FAILURES'] -= 1
+            return 'server error', 500
+        if request.args.get('token') != token:
+            return jsonify({'error': 401, 'message': 'token is not valid'}), 401
+        urls = [u for u in request.get_data(as_text=True).split('\n') if u]
+        app.config['BAIDU_REQUESTS'].append(urls)
+        if len(urls) > 2000:
+            return jsonify({'error': 400, 'message': 'too many urls'}), 400
+        site = request.args.get('site', '')
+        not_same_site = [u for u in urls if not u.startswith(site)]
+        ok = [u for u in urls if u.startswith(site)]
+        if len(ok) > app.config['BAIDU_QUOTA']:
+            return jsonify({'error': 400, 'message': 'over quota'}), 400
+        app.config['BAIDU_QUOTA'] -= len(ok)
+        return jsonify({'success': len(ok), 'remain': app.config['BAIDU_QUOTA'],
+                        'not_same_site': not_same_site, 'not_valid': []})
+
+    return app
+
+
+def fake_alipay_app(app_public_key: str = None) -> Flask:
+    '''
+    模拟支付宝网关 /gateway.do，支持当面付预创建、查询和关闭订单
+    传入应用公钥(PEM)时校验请求签名，app.config['ALIPAY_ORDERS'] 为 {订单号: 订单状态}
+    '''
+    app = Flask('fake_alipay')
+    app.config['ALIPAY_ORDERS'] = {}
+    verifier = None
+    if app_public_key:
+        from Crypto.PublicKey import RSA
+        from Crypto.Signature import PKCS1_v1_5
+        verifier = PKCS1_v1_5.new(RSA.importKey(app_public_key))
+
+    def response(method, body):
+        return jsonify({method.replace('.', '_') + '_response': body})
+
+    @app.route('/gateway.do', methods=['GET', 'POST'])
+    def gateway():
+        from base64 import b64decode
+        params = request.values.to_dict()
+        method = params.get('method', '')
+        sign = params.pop('sign', '')
+        if verifier is not None:
+            from Crypto.Hash import SHA256
+            message = '&'.join('{}={}'.format(k, v) for k, v in sorted(params.items()))
+            if not verifier.verify(SHA256.new(message.encode('utf-8')), b64decode(sign)):
+                return response(method, {'code': '40002', 'msg': 'Invalid Arguments', 'sub_code': 'isv.invalid-signature'})
+        biz = json.loads(params.get('biz_content') or '{}')
+        no = biz.get('out_trade_no')
+        orders = app.config['ALIPAY_ORDERS']
+        if method == 'alipay.trade.precreate':
+            orders[no] = 'WAIT_BUYER_PAY'
+            return response(method, {'code': '10000', 'msg': 'Success', 'out_trade_no': no,
+                                     'qr_code': 'https://qr.alipay.com/fake%s' % no})
+        if no not in orders:
+            return response(method, {'code': '40004', 'msg': 'Business Failed', 'sub_code': 'ACQ.TRADE_NOT_EXIST'})
+        if method == 'alipay.trade.query':
+            return response(method, {'code': '10000', 'msg': 'Success', 'out_trade_no': no, 'trade_status': orders[no]})
+        if method == 'alipay.trade.close':
+            orders[no] = 'TRADE_CLOSED'
+            return response(method, {'code': '10000', 'msg': 'Success', 'out_trade_no': no})
+        return response(method, {'code': '40004', 'msg': 'Business Failed', 'sub_code': 'isv.invalid-method'})
+
+    return app
+
+
+FAKE_APPS = {
+    'bing': fake_bing_app,
+    'baidu_push': fake_baidu_push_app,
+    'alipay': fake_alipay_app,
+}
+
+
+if __name__ == '__main__':
+    name = sys.argv[1] if len(sys.argv) > 1 else 'bing'
+    port = int(sys.argv[2]) if len(sys.argv) > 2 else 5001
+    FAKE_APPS[name]().run(port=port)
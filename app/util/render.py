@@ -0,0 +1,240 @@
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+import markdown
+from flask import current_app, request, url_for
+
+# markdown 使用的扩展，修改后需要提高 H3BLOG_MARKDOWN_VERSION 并执行 flask rerender
+MARKDOWN_EXTENSIONS = (
+    'markdown.extensions.extra',
+    'markdown.extensions.codehilite',
+)
+
+
+_local = threading.local()
+
+
+def get_markdown() -> markdown.Markdown:
+    """
+    返回当前线程的 Markdown 实例
+    每个线程只创建一次实例、初始化一次扩展，转换后调用 reset() 清除文档状态
+    """
+    md = getattr(_local, 'md', None)
+    if md is None:
+        md = _local.md = markdown.Markdown(extensions=list(MARKDOWN_EXTENSIONS))
+        md.h3blog_inline_patterns = _inline_pattern_names(md)
+    return md
+
+
+def _inline_pattern_names(md: markdown.Markdown) -> set:
+    return set(item.name for item in md.inlinePatterns._priority)
+
+
+def _reset_markdown(md: markdown.Markdown) -> None:
+    md.reset()
+    # abbr 扩展把文档中定义的缩写注册为行内规则，reset() 不会清除，这里手动移除
+    for name in _inline_pattern_names(md) - md.h3blog_inline_patterns:
+        md.inlinePatterns.deregister(name, strict=False)
+
+
+def markdown_to_html(text: str) -> str:
+    """
+    markdown 转换为 html，不使用缓存也不依赖应用上下文，
+    可以在子进程中调用
+    """
+    md = get_markdown()
+    try:
+        return md.convert(text or '')
+    except Exception:
+        # 转换出错的实例不再复用
+        _local.md = None
+        raise
+    finally:
+        _reset_markdown(md)
+
+
+def render_key(text: str, version=None) -> str:
+    """渲染缓存键：内容、扩展和渲染版本的 sha256"""
+    if version is None:
+        version = current_app.config['H3BLOG_MARKDOWN_VERSION']
+    h = hashlib.sha256()
+    h.update(('%s|%s|' % (version, ','.join(MARKDOWN_EXTENSIONS))).encode())
+    h.update((text or '').encode('utf-8'))
+    return h.hexdigest()
+
+
+def _cache_file(key: str) -> str:
+    return os.path.join(current_app.config['H3BLOG_CACHE_PATH'], 'markdown', key[:2], key + '.html')
+
+
+def get_cached_html(key: str) -> str:
+    try:
+        with open(_cache_file(key), encoding='utf-8') as f:
+            return f.read()
+    except OSError:
+        return None
+
+
+def set_cached_html(key: str, html: str) -> None:
+    filename = _cache_file(key)
+    tmp = '%s.%d-%d.tmp' % (filename, os.getpid(), threading.get_ident())
+    try:
+        os.makedirs(os.path.dirname(filename), exist_ok=True)
+        with open(tmp, 'w', encoding='utf-8') as f:
+            f.write(html)
+        os.replace(tmp, filename)
+    except OSError as e:
+        current_app.logger.warning('写入markdown渲染缓存失败: %s' % e)
+
+
+def render_markdown(text: str) -> str:
+    """
+    markdown 转换为 html
+    按内容哈希缓存渲染结果，内容没有变化时不再重复渲染
+    """
+    key = render_key(text)
+    html = get_cached_html(key)
+    if html is None:
+        html = markdown_to_html(text)
+        set_cached_html(key, html)
+    return html
+
+
+# 文章中的隐藏内容 [h3_hidden]...[/h3_hidden]
+HIDDEN_START = '[h3_hidden]'
+HIDDEN_END = '[/h3_hidden]'
+_hidden_re = re.compile(re.escape(HIDDEN_START) + '(.*?)' + re.escape(HIDDEN_END), re.DOTALL)
+
+
+def split_hidden_content(html: str) -> list:
+    """
+    按隐藏内容拆分文章 html，返回 [[是否隐藏, html], ...]
+    保存文章时拆分，显示时只需要按登录状态拼接
+    """
+    segments = []
+    pos = 0
+    for m in _hidden_re.finditer(html or ''):
+        if m.start() > pos:
+            segments.append([0, html[pos:m.start()]])
+        segments.append([1, m.group(1)])
+        pos = m.end()
+    if pos < len(html or ''):
+        segments.append([0, html[pos:]])
+    return segments
+
+
+def dump_content_segments(html: str) -> str:
+    return json.dumps(split_hidden_content(html), ensure_ascii=False, separators=(',', ':'))
+
+
+def hidden_login_prompt() -> str:
+    """未登录时替换隐藏内容的登录提示"""
+    login_url = url_for('main.login') + '?next=' + request.path
+    return '''
+            <p class="border border-warning p-2 text-center">
+            本文隐藏内容 <a href="{}">登陆</a> 后才可以浏览
+            </p>
+            '''.format(login_url)
+
+
+def render_hidden(html: str) -> str:
+    """隐藏内容，未登录时显示登录提示"""
+    from flask_login import current_user
+    if current_user.is_authenticated:
+        return html
+    return hidden_login_prompt()
+
+
+def join_content_segments(segments: list, render_hidden_segment=render_hidden) -> str:
+    """拼接文章内容，隐藏的部分交给 render_hidden_segment 渲染"""
+    return ''.join([render_hidden_segment(html) if hidden else html for hidden, html in segments])
+
+
+def _render_worker(item: tuple) -> tuple:
+    """子进程中渲染一篇文章，返回 (文章id, html, 错误信息)"""
+    article_id, text = item
+    try:
+        return article_id, markdown_to_html(text), None
+    except Exception as e:
+        return article_id, None, '%s: %s' % (type(e).__name__, e)
+
+
+def rerender_articles(workers: int = None, chunk_size: int = 200, force: bool = False,
+                      progress=None) -> dict:
+    """
+    重新渲染全部 markdown 文章，更新全部文章拆分后的隐藏内容
+    按主键分批读取文章，缓存中没有的内容交给进程池渲染，每批提交一次，
+    其他编辑器的文章直接保存 html，只拆分隐藏内容。html 和拆分结果都没有变化的文章不更新。force 为 True 时忽略渲染缓存。
+    progress 为每批完成后的回调，参数是当前的统计信息
+    """
+    from concurrent.futures import ProcessPoolExecutor
+    from app.ext import db
+    from app.models import Article
+    t = Article.__table__
+    engine = db.get_engine()
+    stats = {'total': 0, 'rendered': 0, 'cached': 0, 'updated': 0, 'failed': [], 'seconds': 0}
+    start = time.time()
+    workers = workers or os.cpu_count() or 1
+    executor = ProcessPoolExecutor(max_workers=workers) if workers > 1 else None
+    try:
+        last_id = 0
+        while True:
+            with engine.connect() as conn:
+                rows = conn.execute(db.select([t.c.id, t.c.editor, t.c.content, t.c.content_html,
+                                               t.c.content_segments]).
+                                    where(t.c.id > last_id).
+                                    order_by(t.c.id.asc()).limit(chunk_size)).fetchall()
+            if not rows:
+                break
+            last_id = rows[-1].id
+            keys = {}
+            results = {}
+            todo = []
+            for r in rows:
+                if r.editor != 'markdown':
+                    results[r.id] = r.content_html or ''
+                    continue
+                keys[r.id] = render_key(r.content)
+                html = None if force else get_cached_html(keys[r.id])
+                if html is None:
+                    todo.append((r.id, r.content))
+                else:
+                    results[r.id] = html
+            stats['cached'] += len(keys) - len(todo)
+            if executor is None:
+                rendered = map(_render_worker, todo)
+            else:
+                rendered = executor.map(_render_worker, todo,
+                                        chunksize=max(1, len(todo) // (workers * 4)))
+            for article_id, html, error in rendered:
+                if error is not None:
+                    stats['failed'].append((article_id, error))
+                    continue
+                set_cached_html(keys[article_id], html)
+                results[article_id] = html
+                stats['rendered'] += 1
+            updates = []
+            for r in rows:
+                if r.id not in results:
+                    continue
+                segments = dump_content_segments(results[r.id])
+                if results[r.id] != r.content_html or segments != r.content_segments:
+                    updates.append({'_id': r.id, 'html': results[r.id], 'segments': segments})
+            if updates:
+                with engine.begin() as conn:
+                    conn.execute(t.update().where(t.c.id == db.bindparam('_id')).
+                                 values(content_html=db.bindparam('html'),
+                                        content_segments=db.bindparam('segments')), updates)
+            stats['total'] += len(rows)
+            stats['updated'] += len(updates)
+            stats['seconds'] = time.time() - start
+            if progress is not None:
+                progress(stats)
+    finally:
+        if executor is not None:
+            executor.shutdown()
+    stats['seconds'] = time.time() - start
+    return stats
@@ -0,0 +1,37 @@
+import pytest
+from app import create_app
+from app.ext import db
+from app.models import User, Category, Article, Tag
+
+
+@pytest.fixture(scope='session')
+def app(tmp_path_factory):
+    app = create_app('testing')
+    app.start = True
+    app.config['H3BLOG_CACHE_PATH'] = str(tmp_path_factory.mktemp('cache'))
+    app.config['H3BLOG_UPLOAD_PATH'] = str(tmp_path_factory.mktemp('uploads'))
+    with app.app_context():
+        db.create_all()
+        # 文章分属不同的作者和分类，列表页逐行查询时查询数量会超过预算
+        users = [User(username='admin', email='admin@h3blog.com', password='123', status=True, role=1),
+                 User(username='writer', email='writer@h3blog.com', password='123', status=True, role=2)]
+        categories = [Category(title='Python', name='python', tpl_list='category.html', tpl_page='article.html',
+                               tpl_mold='list')]
+        categories += [Category(title='分类%d' % i, name='c%d' % i, tpl_list='category.html',
+                                tpl_page='article.html', tpl_mold='list') for i in range(1, 5)]
+        db.session.add_all(users + categories)
+        tags = [Tag.add('flask'), Tag.add('python')]
+        for i in range(25):
+            a = Article(title='文章%d' % i, name='a%d' % i, editor='markdown', content='# 标题%d\n\n正文' % i,
+                        summary='摘要%d' % i, state=1, vc=0, category=categories[i % len(categories)],
+                        author=users[i % len(users)])
+            a.content_html = a.content_to_html()
+            a.tags.extend(tags)
+            db.session.add(a)
+        db.session.commit()
+        yield app
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
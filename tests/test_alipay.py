@@ -0,0 +1,92 @@
+import pytest
+from Crypto.PublicKey import RSA
+from flask import request
+from app.ext import alipay
+from app.ext import ali_pay
+from app.util.fake_server import FakeServer, fake_alipay_app
+
+
+def pem_body(pem: bytes) -> str:
+    return ''.join(pem.decode().strip().splitlines()[1:-1])
+
+
+@pytest.fixture(scope='module')
+def key():
+    return RSA.generate(1024)
+
+
+@pytest.fixture
+def fake_alipay(app, key, monkeypatch):
+    public_key = key.publickey().export_key()
+    fake = fake_alipay_app(public_key)
+    # 记录客户端端口，同一个连接的请求端口相同
+    fake.config['ALIPAY_PORTS'] = set()
+
+    @fake.before_request
+    def record_port():
+        fake.config['ALIPAY_PORTS'].add(request.environ.get('REMOTE_PORT'))
+
+    with FakeServer(fake) as server:
+        monkeypatch.setitem(app.config, 'ALIPAY_APPID', 'test')
+        monkeypatch.setitem(app.config, 'ALIPAY_PRIVATE_KEY', pem_body(key.export_key('PEM', pkcs=8)))
+        monkeypatch.setitem(app.config, 'ALIPAY_PUBLIC_KEY', pem_body(public_key))
+        monkeypatch.setitem(app.config, 'ALIPAY_GATEWAY', server.url + '/gateway.do')
+        monkeypatch.setattr(alipay, '_config_version', None)
+        yield fake
+
+
+def precreate(nos: list) -> None:
+    for no in nos:
+        assert alipay.trade_precreate_qrcode_str('test', no, 1) == 'https://qr.alipay.com/fake%s' % no
+
+
+def test_trade_query_many(fake_alipay):
+    nos = ['q%d' % i for i in range(5)]
+    precreate(nos)
+    results = alipay.trade_query_many(nos + ['missing'], workers=3)
+    assert set(results) == set(nos) | {'missing'}
+    for no in nos:
+        assert (results[no]['code'], results[no]['trade_status']) == ('10000', 'WAIT_BUYER_PAY')
+    assert results['missing']['sub_code'] == 'ACQ.TRADE_NOT_EXIST'
+
+
+def test_trade_close_many(fake_alipay):
+    nos = ['c%d' % i for i in range(5)]
+    precreate(nos)
+    results = alipay.trade_close_many(nos, workers=3)
+    assert all(r['code'] == '10000' for r in results.values())
+    assert [fake_alipay.config['ALIPAY_ORDERS'][no] for no in nos] == ['TRADE_CLOSED'] * 5
+    assert alipay.trade_query('c0')['trade_status'] == 'TRADE_CLOSED'
+
+
+def test_request_error_is_returned_per_order(app, fake_alipay, monkeypatch):
+    monkeypatch.setitem(app.config, 'ALIPAY_GATEWAY', 'http://127.0.0.1:1/gateway.do')
+    results = alipay.trade_query_many(['e0', 'e1'])
+    assert [r['code'] for r in results.values()] == ['error', 'error']
+
+
+def test_keys_parsed_once_until_config_changes(app, fake_alipay, monkeypatch):
+    imports = []
+    import_key = ali_pay.RSA.importKey
+
+    def counting_import_key(*args, **kwargs):
+        imports.append(args)
+        return import_key(*args, **kwargs)
+
+    monkeypatch.setattr(ali_pay.RSA, 'importKey', counting_import_key)
+    for i in range(3):
+        alipay.build_trade_precreate_url('test', 'k%d' % i, 1)
+    assert len(imports) == 2
+    monkeypatch.setitem(app.config, 'ALIPAY_NOTIFY_URL', 'http://h3blog.local/notify')
+    alipay.build_trade_precreate_url('test', 'k3', 1)
+    assert len(imports) == 4
+
+
+def test_requests_share_pooled_connections(fake_alipay):
+    session = alipay._session
+    nos = ['s%d' % i for i in range(20)]
+    precreate(nos)
+    alipay.trade_query_many(nos, workers=4)
+    assert alipay._session is session
+    # 40 个请求复用连接池中的连接：预创建 1 个，批量查询最多 4 个
+    assert len(fake_alipay.config['ALIPAY_PORTS']) <= 5
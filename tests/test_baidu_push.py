@@ -0,0 +1,85 @@
+import pytest
+import requests
+from app.ext import db
+from app.ext.baidu_push import BaiduPusher
+from app.models import BaiduPush
+from app.util.fake_server import FakeServer, fake_baidu_push_app
+
+
+@pytest.fixture
+def fake_baidu(app, monkeypatch):
+    fake = fake_baidu_push_app(quota=10)
+    with FakeServer(fake) as server:
+        monkeypatch.setitem(app.config, 'H3BLOG_BAIDU_PUSH_API', server.url)
+        monkeypatch.setitem(app.config, 'BAIDU_PUSH_TOKEN', 'token')
+        monkeypatch.setitem(app.config, 'H3BLOG_BAIDU_PUSH_INTERVAL', 0)
+        monkeypatch.setitem(app.config, 'H3BLOG_BAIDU_PUSH_RETRY_DELAY', 0)
+        with app.app_context():
+            BaiduPush.query.delete()
+            db.session.commit()
+        yield fake
+
+
+@pytest.fixture
+def pusher(app):
+    pusher = BaiduPusher()
+    pusher.init_app(app)
+    # 测试中直接调用 process，不启动后台线程
+    pusher._ensure_thread = lambda: None
+    return pusher
+
+
+def urls(pusher, n: int) -> list:
+    return ['%s/article/p%d/' % (pusher.site(), i) for i in range(n)]
+
+
+def results(app) -> list:
+    with app.app_context():
+        return [(r.state, r.result, r.attempts) for r in BaiduPush.query.order_by(BaiduPush.id)]
+
+
+def test_push_batches_queued_urls(app, fake_baidu, pusher):
+    assert pusher.enqueue(urls(pusher, 3) + urls(pusher, 1)) == 3
+    # 等待推送的链接不重复加入
+    assert pusher.enqueue(urls(pusher, 1)) == 0
+    assert pusher.process() == 3
+    assert fake_baidu.config['BAIDU_REQUESTS'] == [urls(pusher, 3)]
+    assert pusher.remain == 7
+    stats = pusher.stats()
+    assert (stats['pending'], stats['success'], stats['failed']) == (0, 3, 0)
+
+
+def test_over_quota_halves_batch_then_pauses(app, fake_baidu, pusher):
+    fake_baidu.config['BAIDU_QUOTA'] = 2
+    pusher.enqueue(urls(pusher, 5))
+    assert pusher.process() == 2
+    assert [len(r) for r in fake_baidu.config['BAIDU_REQUESTS']] == [5, 2]
+    assert pusher.paused_until is not None
+    stats = pusher.stats()
+    assert (stats['pending'], stats['success']) == (3, 2)
+    # 超过配额不算重试次数
+    assert [a for state, result, a in results(app) if state == BaiduPush.PENDING] == [0, 0, 0]
+
+
+def test_server_error_is_retried(app, fake_baidu, pusher):
+    fake_baidu.config['BAIDU_FAILURES'] = 1
+    pusher.enqueue(urls(pusher, 2))
+    assert pusher.process() == 2
+    assert [(state, attempts) for state, result, attempts in results(app)] == [(BaiduPush.SUCCESS, 2)] * 2
+
+
+def test_invalid_token_fails_without_retry(app, fake_baidu, pusher, monkeypatch):
+    monkeypatch.setitem(app.config, 'BAIDU_PUSH_TOKEN', 'wrong')
+    pusher.enqueue(urls(pusher, 1))
+    assert pusher.process() == 0
+    assert results(app) == [(BaiduPush.FAILED, 'token is not valid', 1)]
+
+
+def test_timeout_without_message(app, fake_baidu, pusher, monkeypatch):
+    def timeout(urls):
+        raise requests.Timeout()
+    monkeypatch.setattr(pusher, '_request', timeout)
+    monkeypatch.setitem(app.config, 'H3BLOG_BAIDU_PUSH_RETRY_DELAY', 60)
+    pusher.enqueue(urls(pusher, 1))
+    assert pusher.process() == 0
+    assert results(app) == [(BaiduPush.PENDING, 'Timeout', 1)]
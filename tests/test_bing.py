@@ -0,0 +1,74 @@
+import io
+import json
+import os
+import pytest
+from PIL import Image
+from app.ext import bing
+from app.ext.bing import BingWallpaper
+from app.util.fake_server import FakeServer, fake_bing_app
+
+
+@pytest.fixture
+def fake_bing(app, monkeypatch, tmp_path):
+    fake = fake_bing_app()
+    with FakeServer(fake) as server:
+        monkeypatch.setitem(app.config, 'H3BLOG_BING_URL', server.url)
+        monkeypatch.setitem(app.config, 'H3BLOG_CACHE_PATH', str(tmp_path))
+        monkeypatch.setitem(app.config, 'H3BLOG_BING_REDIRECT', 0)
+        yield fake
+
+
+def new_wallpaper(app) -> BingWallpaper:
+    '''模拟重启后的进程'''
+    wallpaper = BingWallpaper()
+    wallpaper.init_app(app)
+    return wallpaper
+
+
+def test_bing_bg_serves_cached_copy(app, client, fake_bing, monkeypatch):
+    monkeypatch.setattr(bing, '_current', None)
+    monkeypatch.setattr(bing, '_loaded', False)
+    resp = client.get('/bing_bg')
+    assert resp.status_code == 200
+    assert resp.mimetype == 'image/jpeg'
+    with Image.open(io.BytesIO(resp.data)) as im:
+        assert im.size == (1920, 1080)
+    resp = client.get('/bing_bg?w=600')
+    with Image.open(io.BytesIO(resp.data)) as im:
+        assert im.width == 640
+    resp = client.get('/bing_bg', headers={'If-None-Match': resp.headers['ETag'].replace('-640', '-0')})
+    assert resp.status_code == 304
+    # 只下载了一次
+    assert sorted(fake_bing.config['BING_HITS'].values()) == [1, 1]
+
+
+def test_refresh_skips_download_of_same_image(app, fake_bing):
+    wallpaper = new_wallpaper(app)
+    first = wallpaper.refresh()
+    second = wallpaper.refresh()
+    assert second['etag'] == first['etag']
+    assert second['fetched'] >= first['fetched']
+    assert fake_bing.config['BING_HITS'] == {'/HPImageArchive.aspx': 2, '/th': 1}
+    # 获取时间保存到文件中，重启后不会马上重新获取
+    with open(os.path.join(wallpaper.path, 'latest.json'), encoding='utf-8') as f:
+        assert json.load(f)['fetched'] == second['fetched']
+
+
+def test_restart_loads_saved_wallpaper(app, fake_bing):
+    current = new_wallpaper(app).refresh()
+    hits = dict(fake_bing.config['BING_HITS'])
+    restarted = new_wallpaper(app)
+    loaded = restarted.current()
+    assert loaded['etag'] == current['etag']
+    assert loaded['images'] == current['images']
+    assert fake_bing.config['BING_HITS'] == hits
+
+
+def test_new_day_replaces_old_files(app, fake_bing):
+    wallpaper = new_wallpaper(app)
+    old = wallpaper.refresh()
+    fake_bing.config['BING_DATE'] = '20200102'
+    new = wallpaper.refresh()
+    assert new['etag'] != old['etag']
+    files = set(os.listdir(wallpaper.path))
+    assert files == set(new['files'].values()) | {'latest.json'}
@@ -0,0 +1,37 @@
+import threading
+from contextlib import contextmanager
+import pytest
+from sqlalchemy import event
+from app.ext import db
+
+# 每个前台页面允许的查询数量，和 flask query-count 的默认值相同
+QUERY_BUDGET = 12
+
+
+@contextmanager
+def count_queries(app):
+    '''统计当前线程执行的 sql 数量，不包括后台线程写回浏览量、访问日志的查询'''
+    statements = []
+    thread = threading.get_ident()
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        if threading.get_ident() == thread:
+            statements.append(statement)
+
+    with app.app_context():
+        engine = db.engine
+    event.listen(engine, 'before_cursor_execute', before_cursor_execute)
+    try:
+        yield statements
+    finally:
+        event.remove(engine, 'before_cursor_execute', before_cursor_execute)
+
+
+@pytest.mark.parametrize('path', ['/', '/article/a3/', '/category/python/', '/archive/'])
+def test_public_page_query_budget(app, client, monkeypatch, path):
+    monkeypatch.setitem(app.config, 'H3BLOG_PAGE_CACHE_TIMEOUT', 0)
+    # 第一次请求加载配置、上一篇/下一篇等进程内缓存，不计入
+    assert client.get(path).status_code == 200
+    with count_queries(app) as statements:
+        assert client.get(path).status_code == 200
+    assert len(statements) <= QUERY_BUDGET, '\n'.join(statements)
@@ -0,0 +1,101 @@
+import os
+import time
+import pytest
+from flask import url_for
+from app.ext import db, storage
+from app.models import Picture, Article
+
+
+@pytest.fixture
+def fake_storage(app, monkeypatch):
+    monkeypatch.setitem(app.config, 'H3BLOG_UPLOAD_TYPE', 'fake')
+    monkeypatch.setitem(app.config, 'H3BLOG_STORAGE_RETRY_DELAY', 0.01)
+    backend = storage.backend()
+    backend.failures = 0
+    backend.puts = 0
+    return backend
+
+
+def add_picture(app, name: str) -> tuple:
+    '''在上传目录保存一张图片，返回 (图片id, 上传目录中的地址, 本地访问地址)'''
+    filename = 'test/%s.png' % name
+    localfile = os.path.join(app.config['H3BLOG_UPLOAD_PATH'], 'test', name + '.png')
+    os.makedirs(os.path.dirname(localfile), exist_ok=True)
+    with open(localfile, 'wb') as f:
+        f.write(name.encode())
+    with app.test_request_context():
+        url = url_for('admin.get_image', filename=filename)
+        pic = Picture(name=name, url=url)
+        db.session.add(pic)
+        db.session.commit()
+        return pic.id, filename, url
+
+
+def picture_url(app, picture_id: int) -> str:
+    with app.app_context():
+        return db.session.query(Picture.url).filter(Picture.id == picture_id).scalar()
+
+
+def wait_for(func, timeout: float = 5) -> None:
+    '''等待重试的推送由定时器放回队列，join 不会等待'''
+    deadline = time.time() + timeout
+    while not func():
+        assert time.time() < deadline, 'timed out'
+        time.sleep(0.01)
+
+
+def test_push_swaps_picture_and_thumbnail_url(app, fake_storage):
+    picture_id, filename, url = add_picture(app, 'push')
+    with app.app_context():
+        article = Article.query.filter_by(name='a1').first()
+        article.thumbnail = url
+        db.session.commit()
+    storage.submit(picture_id, filename)
+    storage.join()
+    cdn_url = app.config['H3BLOG_FAKE_STORAGE_URL'] + filename
+    assert picture_url(app, picture_id) == cdn_url
+    with app.app_context():
+        assert Article.query.filter_by(name='a1').first().thumbnail == cdn_url
+    with open(os.path.join(fake_storage.path, 'test', 'push.png'), 'rb') as f:
+        assert f.read() == b'push'
+
+
+def test_push_retries_after_failure(app, fake_storage):
+    picture_id, filename, url = add_picture(app, 'retry')
+    fake_storage.failures = 2
+    storage.submit(picture_id, filename)
+    wait_for(lambda: picture_url(app, picture_id) != url)
+    assert fake_storage.puts == 3
+    assert picture_url(app, picture_id) == app.config['H3BLOG_FAKE_STORAGE_URL'] + filename
+
+
+def test_push_gives_up_after_retries(app, fake_storage, monkeypatch):
+    monkeypatch.setitem(app.config, 'H3BLOG_STORAGE_RETRIES', 1)
+    picture_id, filename, url = add_picture(app, 'fail')
+    fake_storage.failures = 5
+    failed = storage.failed
+    storage.submit(picture_id, filename)
+    wait_for(lambda: storage.failed > failed)
+    assert fake_storage.puts == 2
+    assert picture_url(app, picture_id) == url
+
+
+def test_local_storage_skips_push(app, monkeypatch):
+    monkeypatch.setitem(app.config, 'H3BLOG_UPLOAD_TYPE', 'local')
+    picture_id, filename, url = add_picture(app, 'local')
+    storage.submit(picture_id, filename)
+    storage.join()
+    assert picture_url(app, picture_id) == url
+
+
+def test_storage_push_command_skips_pushed_pictures(app, fake_storage):
+    picture_id, filename, url = add_picture(app, 'command')
+    with app.app_context():
+        db.session.add(Picture(name='pushed', url=app.config['H3BLOG_FAKE_STORAGE_URL'] + 'test/pushed.png'))
+        db.session.commit()
+        pending = Picture.query.filter(Picture.url.startswith(url[:-len(filename)])).count()
+    result = app.test_cli_runner().invoke(args=['storage-push'])
+    assert result.exit_code == 0, result.output
+    assert 'Pushed %d pictures, 0 failed.' % pending in result.output
+    assert fake_storage.puts == pending
+    assert picture_url(app, picture_id) == app.config['H3BLOG_FAKE_STORAGE_URL'] + filename